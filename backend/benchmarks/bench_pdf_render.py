@@ -0,0 +1,93 @@
+"""
+Compare eager vs page-lazy PDF rendering.
+
+Each mode runs in a fresh process so peak RSS is measured independently:
+
+    cd backend
+    python -m benchmarks.bench_pdf_render --pages 40
+"""
+import argparse
+import base64
+import io
+import multiprocessing
+import resource
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+
+def make_pdf(pages: int) -> bytes:
+    """Build a synthetic A4 PDF (one receipt-like page per page) at 300 DPI."""
+    images = []
+    for n in range(pages):
+        img = Image.new("RGB", (2480, 3508), "white")
+        draw = ImageDraw.Draw(img)
+        draw.text((200, 200), f"RECEIPT page {n + 1}", fill="black")
+        for row in range(40):
+            y = 400 + row * 70
+            draw.line((200, y, 2280, y), fill="gray", width=2)
+            draw.text((220, y + 20), f"item {row:02d}    {(row + 1) * 110:>8} yen", fill="black")
+        images.append(img)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:], resolution=300)
+    return buffer.getvalue()
+
+
+def _render_eager(file_bytes: bytes) -> int:
+    """The previous implementation: render every page at 200 DPI, then resize and encode."""
+    from pdf2image import convert_from_bytes
+
+    from utils.image_utils import _resize_if_needed
+
+    encoded = 0
+    for img in convert_from_bytes(file_bytes, dpi=200):
+        img = _resize_if_needed(img)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        encoded += len(base64.b64encode(buffer.getvalue()))
+    return encoded
+
+
+def _run(mode: str, file_bytes: bytes, queue) -> None:
+    start = time.perf_counter()
+    if mode == "lazy":
+        from utils.image_utils import iter_pdf_pages_base64
+
+        pages = iter_pdf_pages_base64(file_bytes)
+        next(pages)
+        first_page_at = time.perf_counter() - start
+        for _ in pages:
+            pass
+    else:
+        # Nothing can be sent until every page is rendered
+        _render_eager(file_bytes)
+        first_page_at = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    queue.put((mode, elapsed, first_page_at, peak))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    args = parser.parse_args()
+
+    file_bytes = make_pdf(args.pages)
+    print(f"PDF: {args.pages} pages, {len(file_bytes) / 1e6:.1f} MB")
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    print(f"{'mode':<6} {'total s':>8} {'first page s':>13} {'peak RSS MB':>12}")
+    for mode in ("eager", "lazy"):
+        proc = ctx.Process(target=_run, args=(mode, file_bytes, queue))
+        proc.start()
+        name, elapsed, first_page_at, peak = queue.get()
+        proc.join()
+        print(f"{name:<6} {elapsed:>8.2f} {first_page_at:>13.2f} {peak / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Offline throughput benchmark for batch processing: job_service -> pipeline_service -> dropbox_service
+-> image_utils -> ocr_service, against the local Dropbox and Messages stand-ins in fakes/.
+
+    cd backend
+    python -m benchmarks.bench_pipeline --jpeg 40 --png 10 --multi-pdf 4 --suica 2 --latency 0.8 --rate-limit 0.02
+
+A synthetic corpus is written to a temporary directory and processed as one job, with the OCR cache off.
+Reports files/sec, p50/p99 per-file latency, peak RSS and model calls per receipt. --json saves the
+report; --baseline compares with a saved report and exits 1 when files/sec drops by more than --tolerance.
+PDFs need poppler (pdftoppm) like the app does.
+"""
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import tempfile
+import time
+
+from config import settings
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 1e6
+
+
+async def _run_job(paths: list[str], concurrency: int | None) -> dict:
+    from services import job_service
+
+    job_id = job_service.create_job("bench-token", paths, concurrency)
+    started: dict[int, float] = {}
+    finished: dict[int, float] = {}
+    results = errors = 0
+    done: dict = {}
+    start = time.perf_counter()
+    async for event in job_service.stream_events(job_id):
+        now = time.perf_counter()
+        data = json.loads(event["data"])
+        if event["event"] == "progress":
+            started[data["index"]] = now
+        elif event["event"] == "result":
+            finished[data["index"]] = now
+            results += 1
+        elif event["event"] == "error":
+            finished[data["index"]] = now
+            errors += 1
+            print(f"  error: {data['file_name']}: {data['error']}", file=sys.stderr)
+        elif event["event"] == "done":
+            done = data
+    elapsed = time.perf_counter() - start
+    latencies = [finished[i] - started[i] for i in finished if i in started]
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "results": results,
+        "errors": errors,
+        "done": done,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    # Settings are read when the services are first imported, so configure them before that
+    settings.data_dir = f"{workdir}/data"
+    settings.ocr_cache_enabled = args.cache
+    settings.ocr_concurrency = args.concurrency
+    settings.ocr_max_concurrency = max(settings.ocr_max_concurrency, args.concurrency)
+    settings.anthropic_requests_per_minute = args.rpm
+    settings.anthropic_input_tokens_per_minute = args.input_tpm
+    settings.anthropic_output_tokens_per_minute = args.output_tpm
+
+    from fakes.anthropic_app import create_app
+    from fakes.corpus import write_corpus
+    from fakes.offline import install
+    from services.rate_limiter import scheduler
+    from utils.image_utils import shutdown_process_pool
+
+    paths = write_corpus(
+        workdir, jpeg=args.jpeg, png=args.png, multi_pdf=args.multi_pdf, suica=args.suica,
+        pdf_pages=args.pdf_pages, seed=args.seed,
+    )
+    anthropic_app = create_app(latency=args.latency, rate_limit_rate=args.rate_limit, retry_after=args.retry_after, seed=args.seed)
+    install(workdir, anthropic_app=anthropic_app, download_latency=args.download_latency)
+
+    run_result = asyncio.run(_run_job(paths, args.concurrency))
+    shutdown_process_pool()
+
+    receipts = run_result["results"]
+    model_calls = anthropic_app.state.calls["messages"]
+    return {
+        "files": len(paths),
+        "receipts": receipts,
+        "errors": run_result["errors"],
+        "elapsed_s": round(run_result["elapsed"], 3),
+        "files_per_s": round(len(paths) / run_result["elapsed"], 3) if run_result["elapsed"] else 0.0,
+        "latency_p50_s": round(percentile(run_result["latencies"], 50), 3),
+        "latency_p99_s": round(percentile(run_result["latencies"], 99), 3),
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "worker_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "model_calls": model_calls,
+        "model_calls_per_receipt": round(model_calls / receipts, 3) if receipts else 0.0,
+        "rate_limited": anthropic_app.state.calls["rate_limited"],
+        "retries": scheduler.metrics()["retries"],
+        "usage": run_result["done"].get("usage"),
+        "preprocess_ms": run_result["done"].get("preprocess_ms"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jpeg", type=int, default=40, help="phone photos")
+    parser.add_argument("--png", type=int, default=10, help="scanned receipts")
+    parser.add_argument("--multi-pdf", type=int, default=4, help="multi-receipt PDFs")
+    parser.add_argument("--suica", type=int, default=2, help="Suica-like statement PDFs")
+    parser.add_argument("--pdf-pages", type=int, default=3, help="receipts per multi-receipt PDF")
+    parser.add_argument("--concurrency", type=int, default=settings.ocr_concurrency)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake Messages call")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability of a 429 per call")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds sent with a 429")
+    parser.add_argument("--download-latency", type=float, default=0.0, help="seconds per fake Dropbox download")
+    parser.add_argument("--rpm", type=int, default=100_000, help="scheduler requests-per-minute budget")
+    parser.add_argument("--input-tpm", type=int, default=100_000_000)
+    parser.add_argument("--output-tpm", type=int, default=100_000_000)
+    parser.add_argument("--cache", action="store_true", help="leave the OCR cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report from an earlier run to compare files/sec with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed files/sec drop vs the baseline")
+    args = parser.parse_args()
+
+    report = run(args)
+    for key in (
+        "files", "receipts", "errors", "elapsed_s", "files_per_s", "latency_p50_s", "latency_p99_s",
+        "peak_rss_mb", "worker_peak_rss_mb", "model_calls", "model_calls_per_receipt", "rate_limited", "retries",
+    ):
+        print(f"{key:<24} {report[key]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        floor = baseline["files_per_s"] * (1 - args.tolerance)
+        if report["files_per_s"] < floor:
+            print(f"REGRESSION: {report['files_per_s']} files/s < {floor:.3f} (baseline {baseline['files_per_s']})")
+            sys.exit(1)
+        print(f"OK: {report['files_per_s']} files/s >= {floor:.3f} (baseline {baseline['files_per_s']})")
+
+
+if __name__ == "__main__":
+    main()
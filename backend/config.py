@@ -1,8 +1,10 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings
 
 ENV_FILE = Path(__file__).resolve().parent.parent / ".env"
+DATA_DIR = Path(__file__).resolve().parent / "data"
 
 
 class Settings(BaseSettings):
@@ -10,7 +12,57 @@ class Settings(BaseSettings):
     dropbox_app_secret: str = ""
     dropbox_redirect_uri: str = "http://localhost:5173/auth/callback"
     anthropic_api_key: str = ""
+    anthropic_base_url: str | None = None
     frontend_url: str = "http://localhost:5173"
+    anthropic_model: str = "claude-sonnet-4-20250514"
+    anthropic_fast_model: str = "claude-haiku-4-5-20251001"
+    model_routing_enabled: bool = True
+    escalation_confidence: float = 0.8
+    data_dir: str = str(DATA_DIR)
+    ocr_concurrency: int = 4
+    ocr_max_concurrency: int = 16
+    image_workers: int = 2
+    anthropic_max_connections: int = 20
+    anthropic_max_keepalive_connections: int = 10
+    anthropic_timeout: float = 120.0
+    dropbox_max_connections: int = 8
+    dropbox_timeout: float = 100.0
+    dropbox_client_ttl: float = 4 * 60 * 60
+    blob_cache_max_bytes: int = 512 * 1024 * 1024
+    blob_cache_ttl: float = 4 * 60 * 60
+    anthropic_requests_per_minute: int = 50
+    anthropic_input_tokens_per_minute: int = 30000
+    anthropic_output_tokens_per_minute: int = 8000
+    anthropic_max_retries: int = 6
+    anthropic_retry_base_delay: float = 1.0
+    anthropic_retry_max_delay: float = 60.0
+    message_batch_poll_interval: float = 60.0
+    ocr_cache_enabled: bool = True
+    ocr_cache_max_bytes: int = 256 * 1024 * 1024
+    single_call_extraction: bool = True
+    category_fallback_confidence: float = 0.6
+    structured_output_retries: int = 1
+    prompt_caching_enabled: bool = True
+    local_category_enabled: bool = True
+    local_category_threshold: float = 0.85
+    local_category_min_examples: int = 50
+    layout_routing_enabled: bool = True
+    pdf_text_layer_mode: Literal["off", "text", "thumbnail"] = "thumbnail"
+    duplicate_detection_enabled: bool = True
+    duplicate_hash_distance: int = 12
+    results_store_enabled: bool = True
+    suica_tiling_enabled: bool = True
+    suica_tile_width: int = 1200
+    suica_band_height: int = 800
+    suica_band_overlap: int = 80
+    watch_folders: list[str] = []
+    watch_access_token: str = ""
+    watch_recursive: bool = True
+    watch_process_existing: bool = False
+    watch_longpoll_timeout: int = 120
+    watch_debounce_seconds: float = 10.0
+    watch_max_delay_seconds: float = 120.0
+    watch_concurrency: int | None = None
 
     model_config = {"env_file": str(ENV_FILE), "env_file_encoding": "utf-8"}
 
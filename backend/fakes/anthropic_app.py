@@ -0,0 +1,261 @@
+"""
+Local stand-in for the Anthropic Messages and Message Batches APIs.
+
+Returns canned extraction/classification JSON so the OCR and batch flows can run offline:
+
+    cd backend
+    uvicorn fakes.anthropic_app:app --port 8765
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 uvicorn main:app
+
+Messages calls can be slowed down and rate limited to exercise the scheduler
+(FAKE_ANTHROPIC_LATENCY seconds, FAKE_ANTHROPIC_429_RATE probability). Requests with cache_control
+breakpoints report prompt-cache writes the first time and reads after, once the prefix reaches the
+model's minimum cacheable length; shorter prefixes are billed as plain input, as the API does.
+
+It can also be mounted in-process with an ASGITransport (see fakes.offline).
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+from services.rate_limiter import estimate_text_tokens
+from services.usage_metrics import cache_min_tokens
+
+
+@dataclass
+class _Batch:
+    id: str
+    requests: list[dict]
+    created_at: datetime
+    ready_at: float
+    canceled: bool = False
+    results: list[dict] = field(default_factory=list)
+
+
+def _timestamp(dt: datetime | None) -> str | None:
+    return dt.isoformat().replace("+00:00", "Z") if dt else None
+
+
+def _prompt_text(params: dict) -> str:
+    system = params.get("system") or []
+    texts = [system] if isinstance(system, str) else [b.get("text", "") for b in system]
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(b.get("text", "") for b in content or [] if b.get("type") == "text")
+    return "\n".join(texts)
+
+
+def canned_text(params: dict) -> str:
+    """Plausible model output for the prompts in services.ocr_service."""
+    prompt = _prompt_text(params)
+    if "モバイルSuica" in prompt:
+        return json.dumps([
+            {"company_name": "JR東日本", "amount": 178, "balance": 4822, "tax_amount": None, "date": "2025-04-01",
+             "description": "JR東日本 渋谷→新宿", "confidence": 0.95},
+            {"company_name": "東京メトロ", "amount": 180, "balance": 4642, "tax_amount": None, "date": "2025-04-02",
+             "description": "東京メトロ 表参道→大手町", "confidence": 0.93},
+            {"company_name": "コンビニ", "amount": 540, "balance": 4102, "tax_amount": None, "date": "2025-04-03",
+             "description": "物販 コンビニ", "confidence": 0.9},
+        ], ensure_ascii=False)
+    if "取引一覧" in prompt:
+        indexes = [int(n) for n in re.findall(r"^(\d+): ", prompt, flags=re.MULTILINE)]
+        return json.dumps(
+            [{"index": i, "category": "旅費交通費", "reason": "交通機関の利用のため"} for i in indexes],
+            ensure_ascii=False,
+        )
+    if "領収書情報" in prompt:
+        return json.dumps({"category": "消耗品費", "reason": "物品の購入のため"}, ensure_ascii=False)
+    return json.dumps({
+        "company_name": "株式会社サンプル商店",
+        "amount": 1100,
+        "tax_amount": 100,
+        "date": "2025-04-15",
+        "description": "文房具",
+        "category": "消耗品費",
+        "category_reason": "文房具の購入のため",
+        "confidence": 0.92,
+    }, ensure_ascii=False)
+
+
+def _forced_tool(params: dict) -> dict | None:
+    choice = params.get("tool_choice") or {}
+    if choice.get("type") != "tool":
+        return None
+    return next((tool for tool in params.get("tools", []) if tool["name"] == choice["name"]), None)
+
+
+def _cached_prefix(params: dict) -> str | None:
+    """Tools and system blocks up to the last cache_control breakpoint, if the request has one."""
+    system = params.get("system")
+    if not isinstance(system, list):
+        return None
+    marked = [i for i, block in enumerate(system) if block.get("cache_control")]
+    if not marked:
+        return None
+    return json.dumps(params.get("tools", []), ensure_ascii=False) + "".join(b.get("text", "") for b in system[: marked[-1] + 1])
+
+
+def make_message(params: dict, prompt_cache: set[str] | None = None) -> dict:
+    """
+    A canned reply; with prompt_cache, cached prefixes are reported as cache writes the first time and reads after.
+    Prefixes shorter than cache_min_tokens for the model are not cached.
+    """
+    text = canned_text(params)
+    tool = _forced_tool(params)
+    if tool is not None:
+        data = json.loads(text)
+        if isinstance(data, list):
+            # Array answers go into the schema's single list property
+            data = {next(iter(tool["input_schema"]["properties"])): data}
+        content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool["name"], "input": data}]
+    else:
+        content = [{"type": "text", "text": text}]
+    images = sum(
+        1
+        for message in params.get("messages", [])
+        if not isinstance(message.get("content"), str)
+        for block in message.get("content") or []
+        if block.get("type") == "image"
+    )
+    tools = json.dumps(params.get("tools", []), ensure_ascii=False) if params.get("tools") else ""
+    usage = {
+        "input_tokens": estimate_text_tokens(tools + _prompt_text(params)) + 1600 * images,
+        "output_tokens": estimate_text_tokens(text),
+    }
+    prefix = _cached_prefix(params) if prompt_cache is not None else None
+    cached = estimate_text_tokens(prefix) if prefix is not None else 0
+    if cached >= cache_min_tokens(params.get("model", "")):
+        usage["input_tokens"] = max(0, usage["input_tokens"] - cached)
+        usage["cache_read_input_tokens" if prefix in prompt_cache else "cache_creation_input_tokens"] = cached
+        prompt_cache.add(prefix)
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake-model"),
+        "content": content,
+        "stop_reason": "tool_use" if tool is not None else "end_turn",
+        "stop_sequence": None,
+        "usage": usage,
+    }
+
+
+def create_app(
+    batch_seconds: float | None = None,
+    latency: float | None = None,
+    rate_limit_rate: float | None = None,
+    retry_after: float = 1.0,
+    seed: int | None = None,
+) -> FastAPI:
+    """
+    Build a fake API app; batches finish batch_seconds after creation.
+    Each Messages call takes latency seconds (±25% jitter) and is answered with a 429 (with retry_after)
+    with probability rate_limit_rate. Request counts are kept in app.state.calls.
+    """
+    if batch_seconds is None:
+        batch_seconds = float(os.environ.get("FAKE_ANTHROPIC_BATCH_SECONDS", "2"))
+    if latency is None:
+        latency = float(os.environ.get("FAKE_ANTHROPIC_LATENCY", "0"))
+    if rate_limit_rate is None:
+        rate_limit_rate = float(os.environ.get("FAKE_ANTHROPIC_429_RATE", "0"))
+    rng = random.Random(seed)
+    app = FastAPI(title="Fake Anthropic API")
+    app.state.calls = Counter()
+    prompt_cache: set[str] = set()
+    batches: dict[str, _Batch] = {}
+
+    def batch_json(batch: _Batch, request: Request) -> dict:
+        ended = batch.canceled or time.monotonic() >= batch.ready_at
+        succeeded = 0 if batch.canceled else len(batch.requests) if ended else 0
+        canceled = len(batch.requests) if batch.canceled else 0
+        return {
+            "id": batch.id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(batch.requests),
+                "succeeded": succeeded,
+                "errored": 0,
+                "canceled": canceled,
+                "expired": 0,
+            },
+            "created_at": _timestamp(batch.created_at),
+            "expires_at": _timestamp(batch.created_at + timedelta(hours=24)),
+            "ended_at": _timestamp(datetime.now(timezone.utc)) if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"{str(request.base_url).rstrip('/')}/v1/messages/batches/{batch.id}/results" if ended else None,
+        }
+
+    def get_batch(batch_id: str) -> _Batch:
+        batch = batches.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail={"type": "not_found_error", "message": "batch not found"})
+        return batch
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request):
+        params = await request.json()
+        if rate_limit_rate and rng.random() < rate_limit_rate:
+            app.state.calls["rate_limited"] += 1
+            return JSONResponse(
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "Fake rate limit"}},
+                status_code=429,
+                headers={"retry-after": f"{retry_after:g}"},
+            )
+        app.state.calls["messages"] += 1
+        await asyncio.sleep(latency * rng.uniform(0.75, 1.25) if latency else 0)
+        return make_message(params, prompt_cache)
+
+    @app.post("/v1/messages/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        batch = _Batch(
+            id=f"msgbatch_{uuid.uuid4().hex[:24]}",
+            requests=body["requests"],
+            created_at=datetime.now(timezone.utc),
+            ready_at=time.monotonic() + batch_seconds,
+        )
+        batches[batch.id] = batch
+        return batch_json(batch, request)
+
+    @app.get("/v1/messages/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str, request: Request):
+        return batch_json(get_batch(batch_id), request)
+
+    @app.post("/v1/messages/batches/{batch_id}/cancel")
+    async def cancel_batch(batch_id: str, request: Request):
+        batch = get_batch(batch_id)
+        if time.monotonic() < batch.ready_at:
+            batch.canceled = True
+        return batch_json(batch, request)
+
+    @app.get("/v1/messages/batches/{batch_id}/results")
+    async def batch_results(batch_id: str):
+        batch = get_batch(batch_id)
+        lines = []
+        for item in batch.requests:
+            if batch.canceled:
+                result = {"type": "canceled"}
+            else:
+                result = {"type": "succeeded", "message": make_message(item["params"], prompt_cache)}
+            lines.append(json.dumps({"custom_id": item["custom_id"], "result": result}, ensure_ascii=False))
+        return Response("\n".join(lines) + "\n", media_type="application/binary")
+
+    return app
+
+
+app = create_app()
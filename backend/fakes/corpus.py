@@ -0,0 +1,109 @@
+"""
+Synthetic receipt corpus for the offline stand-ins and benchmarks.
+
+    from fakes.corpus import write_corpus
+    paths = write_corpus("/tmp/receipts", jpeg=40, png=10, multi_pdf=5, suica=2)
+
+Files are laid out as a Dropbox folder under <root>/corpus, named the way the real ones are:
+phone photos (large JPEGs of a receipt on a table), scans (PNG), multi-receipt PDFs
+("2025-mm-dd hh.mm.ss.pdf", one receipt per page) and Mobile Suica statements (A4 tables).
+"""
+import io
+import random
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+SUICA_PREFIX = "JE80FB21040250463_"
+A4_AT_150_DPI = (1240, 1754)
+
+
+def receipt_image(rng: random.Random, width: int = 600) -> Image.Image:
+    """A thermal-receipt-like image: shop name, item lines, total."""
+    lines = rng.randint(6, 24)
+    height = 260 + lines * 36 + 160
+    image = Image.new("RGB", (width, height), (250, 250, 246))
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 40), f"SHOP {rng.randint(1, 500):03d}", fill="black")
+    draw.text((40, 80), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(8, 22):02d}:{rng.randint(0, 59):02d}", fill="black")
+    draw.line((40, 130, width - 40, 130), fill="black", width=2)
+    total = 0
+    for row in range(lines):
+        price = rng.randint(1, 60) * 10
+        total += price
+        y = 160 + row * 36
+        draw.text((40, y), f"ITEM {row + 1:02d}", fill="black")
+        draw.text((width - 160, y), f"{price:>6} JPY", fill="black")
+    y = 160 + lines * 36 + 30
+    draw.line((40, y, width - 40, y), fill="black", width=2)
+    draw.text((40, y + 30), "TOTAL", fill="black")
+    draw.text((width - 160, y + 30), f"{total:>6} JPY", fill="black")
+    return image
+
+
+def photo_of(receipt: Image.Image, rng: random.Random, size: tuple[int, int]) -> Image.Image:
+    """The receipt photographed on a table: scaled up, slightly rotated, on a darker background."""
+    background = Image.new("RGB", size, (rng.randint(60, 120),) * 3)
+    scale = size[1] * 0.8 / receipt.height
+    placed = receipt.resize((int(receipt.width * scale), int(receipt.height * scale)))
+    placed = placed.rotate(rng.uniform(-4, 4), expand=True, fillcolor=background.getpixel((0, 0)))
+    background.paste(placed, ((size[0] - placed.width) // 2, (size[1] - placed.height) // 2))
+    return background
+
+
+def suica_page(rng: random.Random, rows: int = 30) -> Image.Image:
+    """A4 page with a full-width table, like a Mobile Suica usage statement."""
+    image = Image.new("RGB", A4_AT_150_DPI, "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((100, 80), "MOBILE SUICA STATEMENT", fill="black")
+    balance = 5000
+    for row in range(rows):
+        y = 160 + row * 48
+        amount = rng.choice([140, 178, 180, 210, 540, 1000])
+        balance -= amount
+        draw.line((100, y, 1140, y), fill="gray", width=1)
+        draw.text((110, y + 14), f"04/{row % 28 + 1:02d}   STATION {rng.randint(1, 99):02d}", fill="black")
+        draw.text((700, y + 14), f"-{amount}", fill="black")
+        draw.text((950, y + 14), f"{balance}", fill="black")
+    return image
+
+
+def _pdf(pages: list[Image.Image]) -> bytes:
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def write_corpus(
+    root: str | Path,
+    jpeg: int = 40,
+    png: int = 10,
+    multi_pdf: int = 4,
+    suica: int = 2,
+    pdf_pages: int = 3,
+    photo_size: tuple[int, int] = (3024, 4032),
+    seed: int = 0,
+) -> list[str]:
+    """Write the corpus under <root>/corpus and return the Dropbox paths of the files."""
+    rng = random.Random(seed)
+    folder = Path(root) / "corpus"
+    folder.mkdir(parents=True, exist_ok=True)
+    files: dict[str, bytes] = {}
+
+    for n in range(jpeg):
+        buffer = io.BytesIO()
+        photo_of(receipt_image(rng), rng, photo_size).save(buffer, format="JPEG", quality=88)
+        files[f"IMG_{n:04d}.jpg"] = buffer.getvalue()
+    for n in range(png):
+        buffer = io.BytesIO()
+        receipt_image(rng, width=900).save(buffer, format="PNG")
+        files[f"scan_{n:04d}.png"] = buffer.getvalue()
+    for n in range(multi_pdf):
+        pages = [photo_of(receipt_image(rng), rng, A4_AT_150_DPI) for _ in range(pdf_pages)]
+        files[f"2025-04-{n % 28 + 1:02d} 12.{n // 28 % 60:02d}.00.pdf"] = _pdf(pages)
+    for n in range(suica):
+        files[f"{SUICA_PREFIX}2025{n % 12 + 1:02d}.pdf"] = _pdf([suica_page(rng)])
+
+    for name, data in files.items():
+        (folder / name).write_bytes(data)
+    return [f"/corpus/{name}" for name in files]
@@ -0,0 +1,163 @@
+"""
+Local-directory stand-in for the parts of dropbox.Dropbox this app uses.
+
+Paths map onto a directory on disk ("/2025/04/a.jpg" -> <root>/2025/04/a.jpg). Entries are real
+dropbox.files metadata objects, so services.dropbox_service treats them exactly like API results.
+"""
+import base64
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from dropbox.exceptions import ApiError
+from dropbox.files import DeletedMetadata, FileMetadata, FolderMetadata, ListFolderContinueError
+
+DROPBOX_HASH_BLOCK = 4 * 1024 * 1024
+
+
+def dropbox_content_hash(data: bytes) -> str:
+    """Dropbox content_hash: SHA-256 over the concatenated SHA-256 digests of 4 MB blocks."""
+    digests = b"".join(
+        hashlib.sha256(data[i:i + DROPBOX_HASH_BLOCK]).digest() for i in range(0, len(data), DROPBOX_HASH_BLOCK)
+    )
+    return hashlib.sha256(digests).hexdigest()
+
+
+class LocalDropbox:
+    """download_latency adds that many seconds to every files_download, like a network round trip."""
+
+    def __init__(
+        self, root: str | Path, page_size: int = 100, download_latency: float = 0.0, account_id: str = "dbid:local"
+    ) -> None:
+        self.root = Path(root)
+        self.account_id = account_id
+        self.page_size = page_size
+        self.download_latency = download_latency
+        self.calls: dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _local(self, path: str) -> Path:
+        return self.root / path.strip("/")
+
+    def _dropbox_path(self, local: Path) -> str:
+        return "/" + local.relative_to(self.root).as_posix()
+
+    def _metadata(self, local: Path):
+        path = self._dropbox_path(local)
+        if local.is_dir():
+            return FolderMetadata(name=local.name, id=f"id:{path}", path_lower=path.lower(), path_display=path)
+        stat = local.stat()
+        modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc).replace(tzinfo=None)
+        return FileMetadata(
+            name=local.name,
+            id=f"id:{path}",
+            path_lower=path.lower(),
+            path_display=path,
+            size=stat.st_size,
+            rev=f"{int(stat.st_mtime_ns):x}"[-16:].rjust(9, "0"),
+            content_hash=dropbox_content_hash(local.read_bytes()),
+            client_modified=modified,
+            server_modified=modified,
+        )
+
+    def _snapshot(self, path: str, recursive: bool) -> dict[str, float]:
+        base = self._local(path)
+        children = base.rglob("*") if recursive else base.iterdir()
+        return {self._dropbox_path(p): p.stat().st_mtime for p in sorted(children)}
+
+    def _page(self, state: dict) -> SimpleNamespace:
+        pending = state["pending"]
+        entries = []
+        for path in pending[:self.page_size]:
+            local = self._local(path)
+            entries.append(self._metadata(local) if local.exists() else DeletedMetadata(
+                name=local.name, path_lower=path.lower(), path_display=path
+            ))
+        state["pending"] = pending[self.page_size:]
+        return SimpleNamespace(entries=entries, has_more=bool(state["pending"]), cursor=_encode(state))
+
+    def files_list_folder(self, path: str, recursive: bool = False, **kwargs) -> SimpleNamespace:
+        self._count("files_list_folder")
+        snapshot = self._snapshot(path, recursive)
+        return self._page({"path": path, "recursive": recursive, "seen": snapshot, "pending": list(snapshot)})
+
+    def files_list_folder_continue(self, cursor: str) -> SimpleNamespace:
+        self._count("files_list_folder_continue")
+        try:
+            state = _decode(cursor)
+        except ValueError:
+            raise ApiError("fake", ListFolderContinueError.reset, "cursor reset", "")
+        if not state["pending"]:
+            # Delta since the snapshot stored in the cursor
+            current = self._snapshot(state["path"], state["recursive"])
+            seen = state["seen"]
+            changed = [p for p, mtime in current.items() if seen.get(p) != mtime]
+            deleted = [p for p in seen if p not in current]
+            state = {**state, "seen": current, "pending": changed + deleted}
+        return self._page(state)
+
+    def files_list_folder_get_latest_cursor(self, path: str, recursive: bool = False, **kwargs) -> SimpleNamespace:
+        self._count("files_list_folder_get_latest_cursor")
+        snapshot = self._snapshot(path, recursive)
+        return SimpleNamespace(cursor=_encode({"path": path, "recursive": recursive, "seen": snapshot, "pending": []}))
+
+    def files_list_folder_longpoll(self, cursor: str, timeout: int = 30) -> SimpleNamespace:
+        self._count("files_list_folder_longpoll")
+        state = _decode(cursor)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._snapshot(state["path"], state["recursive"]) != state["seen"]:
+                return SimpleNamespace(changes=True, backoff=None)
+            time.sleep(0.2)
+        return SimpleNamespace(changes=False, backoff=None)
+
+    def users_get_current_account(self) -> SimpleNamespace:
+        self._count("users_get_current_account")
+        return SimpleNamespace(account_id=self.account_id)
+
+    def files_get_metadata(self, path: str) -> FileMetadata | FolderMetadata:
+        self._count("files_get_metadata")
+        return self._metadata(self._local(path))
+
+    def files_download(
+        self, path: str, rev: str | None = None, extra_headers: dict | None = None
+    ) -> tuple[FileMetadata, "_Response"]:
+        self._count("files_download")
+        if self.download_latency:
+            time.sleep(self.download_latency)
+        local = self._local(path)
+        content = local.read_bytes()
+        byte_range = (extra_headers or {}).get("Range")
+        if byte_range:
+            start, end = byte_range.removeprefix("bytes=").split("-")
+            content = content[int(start):int(end) + 1]
+        return self._metadata(local), _Response(content)
+
+
+class _Response:
+    """The parts of requests.Response that files_download callers use."""
+
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+def _encode(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+def _decode(cursor: str) -> dict:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
@@ -0,0 +1,36 @@
+"""
+Point the app's shared clients at the local stand-ins instead of the real APIs.
+
+    from fakes.offline import install
+    install("/path/to/receipts")   # Dropbox paths resolve under this directory
+"""
+from pathlib import Path
+
+import anthropic
+from fastapi import FastAPI
+
+from fakes.anthropic_app import create_app
+from fakes.dropbox_fake import LocalDropbox
+from services.client_registry import registry, sdk_httpx
+
+FAKE_BASE_URL = "http://fake-anthropic"
+
+
+def fake_anthropic_client(app: FastAPI) -> anthropic.AsyncAnthropic:
+    """AsyncAnthropic whose HTTP calls are served in-process by the given ASGI app."""
+    http_client = sdk_httpx.AsyncClient(transport=sdk_httpx.ASGITransport(app=app), base_url=FAKE_BASE_URL)
+    return anthropic.AsyncAnthropic(api_key="fake", base_url=FAKE_BASE_URL, http_client=http_client, max_retries=0)
+
+
+def install(
+    dropbox_root: str | Path,
+    anthropic_app: FastAPI | None = None,
+    batch_seconds: float = 1.0,
+    download_latency: float = 0.0,
+) -> LocalDropbox:
+    fake_dropbox = LocalDropbox(dropbox_root, download_latency=download_latency)
+    registry.override(
+        anthropic_client=fake_anthropic_client(anthropic_app or create_app(batch_seconds=batch_seconds)),
+        dropbox_factory=lambda access_token: fake_dropbox,
+    )
+    return fake_dropbox
@@ -0,0 +1,48 @@
+"""
+Run a Message Batches job end to end against the local stand-ins.
+
+    cd backend
+    python -m fakes.run_message_batch /path/to/receipts --folder /2025/04
+"""
+import argparse
+import asyncio
+import tempfile
+
+from config import settings
+
+
+async def _run(folder: str) -> None:
+    from services import batch_api_service
+
+    job_id = batch_api_service.start_job("offline-token", folder)
+    while True:
+        job = batch_api_service.get_job(job_id)
+        print(f"{job.status}: {job.completed_requests}/{job.request_count} requests, batches={job.batch_ids}")
+        if job.status in ("ended", "canceled", "failed"):
+            break
+        await asyncio.sleep(settings.message_batch_poll_interval)
+
+    if job.error:
+        print(f"error: {job.error}")
+    for result in batch_api_service.get_results(job_id):
+        print(result.model_dump_json())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="local directory that stands in for the Dropbox root")
+    parser.add_argument("--folder", default="/")
+    parser.add_argument("--data-dir", help="SQLite data directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    settings.data_dir = args.data_dir or tempfile.mkdtemp(prefix="receipt-batch-")
+    settings.message_batch_poll_interval = 0.5
+
+    from fakes.offline import install
+
+    install(args.root)
+    asyncio.run(_run(args.folder))
+
+
+if __name__ == "__main__":
+    main()
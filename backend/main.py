@@ -1,10 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from config import settings
-from routers import auth, dropbox_files, export, ocr
+from routers import auth, cache, categories, dropbox_files, export, jobs, message_batches, metrics, ocr, results
+from services import batch_api_service, job_service, watch_service
+from services.client_registry import registry
+from utils.image_utils import shutdown_process_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.start()
+    batch_api_service.resume_polling()
+    job_service.recover_jobs()
+    watch_service.start()
+    yield
+    await watch_service.stop()
+    await registry.aclose()
+    shutdown_process_pool()
+
 
-app = FastAPI(title="Receipt Scanner API")
+app = FastAPI(title="Receipt Scanner API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,7 +35,13 @@ app.add_middleware(
 app.include_router(auth.router)
 app.include_router(dropbox_files.router)
 app.include_router(ocr.router)
+app.include_router(jobs.router)
 app.include_router(export.router)
+app.include_router(cache.router)
+app.include_router(categories.router)
+app.include_router(metrics.router)
+app.include_router(message_batches.router)
+app.include_router(results.router)
 
 
 @app.get("/api/health")
@@ -0,0 +1,27 @@
+from pydantic import BaseModel
+
+from models.receipt import ReceiptResult
+
+
+class MessageBatchJobRequest(BaseModel):
+    path: str
+    access_token: str
+    recursive: bool = True
+
+
+class MessageBatchJob(BaseModel):
+    id: str
+    folder: str
+    status: str
+    error: str | None = None
+    file_count: int
+    request_count: int
+    completed_requests: int
+    batch_ids: list[str]
+    created_at: float
+    ended_at: float | None = None
+
+
+class MessageBatchJobResults(BaseModel):
+    job: MessageBatchJob
+    results: list[ReceiptResult]
@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+
+
+class CacheEntry(BaseModel):
+    key: str
+    kind: str
+    model: str
+    file_name: str
+    file_path: str
+    size: int
+    result_count: int
+    created_at: float
+    last_accessed: float
+    hit_count: int
+
+
+class CacheStats(BaseModel):
+    entries: int
+    total_bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+
+
+class CacheEntriesResponse(BaseModel):
+    entries: list[CacheEntry]
+
+
+class CacheInvalidateResponse(BaseModel):
+    deleted: int
@@ -20,17 +20,35 @@ class DropboxFile(BaseModel):
     path: str
     size: int
     is_folder: bool
+    content_hash: str | None = None
+    rev: str | None = None
+    server_modified: str | None = None
 
 
 class ListFilesRequest(BaseModel):
     path: str
     access_token: str
+    recursive: bool = False
 
 
 class ListFilesResponse(BaseModel):
     files: list[DropboxFile]
 
 
+class ListChangesRequest(BaseModel):
+    path: str
+    access_token: str
+    recursive: bool = True
+    reset: bool = False
+
+
+class ListChangesResponse(BaseModel):
+    files: list[DropboxFile]
+    deleted: list[str]
+    cursor: str
+    is_full_listing: bool
+
+
 class DownloadRequest(BaseModel):
     file_path: str
     access_token: str
@@ -0,0 +1,100 @@
+import re
+import unicodedata
+
+from pydantic import BaseModel, Field, field_validator
+
+from models.receipt import AccountingCategory
+
+# Tool input schemas for structured model output. Field types match ReceiptResult; the descriptions
+# carry the format rules the prompts used to spell out. The before-validators repair common slips
+# ("¥1,100", "0.9" as a string, categories outside the list) instead of rejecting the whole answer.
+
+
+# Asides that carry numbers of their own: rates ("8%") and bracketed notes ("(内税100円)")
+_NUMBER_ASIDES = re.compile(r"[\d.]+\s*%|\([^)]*\)|\[[^\]]*\]")
+_NUMBER = re.compile(r"[-−]?\d[\d,]*(?:\.\d+)?")
+
+
+def _to_int(value):
+    """
+    Yen amount from a string like "¥1,100", "1100.0" or "1,100円(内税100円)". A string that still
+    holds several numbers after dropping rates and bracketed notes is ambiguous and gives None.
+    """
+    if isinstance(value, str):
+        text = _NUMBER_ASIDES.sub(" ", unicodedata.normalize("NFKC", value))
+        numbers = _NUMBER.findall(text)
+        if len(numbers) != 1:
+            return None
+        number = numbers[0].replace(",", "").replace("−", "-")
+        return int(float(number)) if "." in number else int(number)
+    if isinstance(value, float):
+        return int(value)
+    return value
+
+
+def _to_category(value):
+    if isinstance(value, str):
+        try:
+            return AccountingCategory(value.strip())
+        except ValueError:
+            return None
+    return value
+
+
+def _to_confidence(value):
+    try:
+        return min(1.0, max(0.0, float(value))) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ReceiptExtraction(BaseModel):
+    """領収書から読み取った情報"""
+    company_name: str | None = Field(None, description="会社名・店名（発行元）。宛名ではありません")
+    amount: int | None = Field(None, description="税込金額（円、整数）")
+    tax_amount: int | None = Field(None, description="消費税額（円、整数）")
+    date: str | None = Field(None, description="YYYY-MM-DD形式の日付")
+    description: str | None = Field(None, description="品目・但し書き")
+    confidence: float | None = Field(None, description="0.0〜1.0の信頼度")
+
+    _amounts = field_validator("amount", "tax_amount", mode="before")(_to_int)
+    _confidence = field_validator("confidence", mode="before")(_to_confidence)
+
+
+class ReceiptExtractionWithCategory(ReceiptExtraction):
+    """領収書から読み取った情報と勘定科目"""
+    category: AccountingCategory | None = Field(None, description="最適な勘定科目。判断できない場合はnull")
+    category_reason: str | None = Field(None, description="分類理由")
+
+    _category = field_validator("category", mode="before")(_to_category)
+
+
+class SuicaTransaction(ReceiptExtraction):
+    """モバイルSuica利用明細の1行"""
+    amount: int | None = Field(None, description="入金・利用金額（円、整数）")
+    balance: int | None = Field(None, description="残高（円、整数）")
+    description: str | None = Field(None, description="種別・利用区間の説明（例: JR東日本 渋谷→新宿、物販 コンビニ、チャージ）")
+
+    _balance = field_validator("balance", mode="before")(_to_int)
+
+
+class SuicaTransactions(BaseModel):
+    """明細の取引（利用履歴）。表の上から順に全行"""
+    transactions: list[SuicaTransaction]
+
+
+class CategoryAnswer(BaseModel):
+    """勘定科目の分類結果"""
+    category: AccountingCategory | None = Field(None, description="最適な勘定科目")
+    reason: str | None = Field(None, description="分類理由")
+
+    _category = field_validator("category", mode="before")(_to_category)
+
+
+class IndexedCategoryAnswer(CategoryAnswer):
+    index: int = Field(description="取引の番号")
+
+
+class CategoryAnswers(BaseModel):
+    """取引ごとの勘定科目"""
+    answers: list[IndexedCategoryAnswer]
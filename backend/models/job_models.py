@@ -0,0 +1,41 @@
+from pydantic import BaseModel
+
+from models.receipt import ReceiptResult
+
+
+class JobRequest(BaseModel):
+    file_paths: list[str]
+    access_token: str
+    concurrency: int | None = None
+
+
+class ResumeJobRequest(BaseModel):
+    access_token: str
+    retry_errors: bool = False
+
+
+class Job(BaseModel):
+    id: str
+    status: str
+    error: str | None = None
+    total: int
+    pending: int
+    done: int
+    errors: int
+    created_at: float
+    updated_at: float
+
+
+class JobFile(BaseModel):
+    index: int
+    file_path: str
+    file_name: str
+    status: str
+    error: str | None = None
+    usage: dict | None = None
+
+
+class JobResults(BaseModel):
+    job: Job
+    files: list[JobFile]
+    results: list[ReceiptResult]
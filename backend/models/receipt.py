@@ -34,9 +34,12 @@ class ReceiptResult(BaseModel):
     description: str | None = None
     category: AccountingCategory | None = None
     category_reason: str | None = None
+    # Where the category came from: "model", "local" (vendor memo / classifier) or "default" (no answer)
+    category_source: str | None = None
     confidence: float | None = None
     error: str | None = None
     is_manually_edited: bool = False
+    duplicate_of: str | None = None
 
 
 class CategoryTotal(BaseModel):
@@ -53,7 +56,16 @@ class OcrRequest(BaseModel):
 class BatchOcrRequest(BaseModel):
     file_paths: list[str]
     access_token: str
+    concurrency: int | None = None
 
 
 class CsvExportRequest(BaseModel):
     results: list[ReceiptResult]
+
+
+class CategoryFeedbackRequest(BaseModel):
+    results: list[ReceiptResult]
+
+
+class CategoryFeedbackResponse(BaseModel):
+    learned: int
@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+
+from models.receipt import AccountingCategory, ReceiptResult
+
+# Query parameter format for months (YYYY-MM)
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+
+
+class ResultUpdate(BaseModel):
+    """Fields changed by a manual edit; fields left out keep their stored values."""
+    company_name: str | None = None
+    amount: int | None = None
+    tax_amount: int | None = None
+    date: str | None = None
+    description: str | None = None
+    category: AccountingCategory | None = None
+    category_reason: str | None = None
+
+
+class ResultPage(BaseModel):
+    results: list[ReceiptResult]
+    total: int
+
+
+class MonthlyTotal(BaseModel):
+    month: str
+    count: int
+    total_amount: int
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException
+
+from models.cache_models import CacheEntriesResponse, CacheInvalidateResponse, CacheStats
+from services import cache_service
+
+router = APIRouter(prefix="/api/cache", tags=["cache"])
+
+
+@router.get("", response_model=CacheStats)
+def get_cache_stats():
+    return cache_service.stats()
+
+
+@router.get("/entries", response_model=CacheEntriesResponse)
+def list_cache_entries(limit: int = 100, file_path: str | None = None):
+    return CacheEntriesResponse(entries=cache_service.list_entries(limit, file_path))
+
+
+@router.delete("/entries/{key}", response_model=CacheInvalidateResponse)
+def delete_cache_entry(key: str):
+    deleted = cache_service.invalidate(key=key)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    return CacheInvalidateResponse(deleted=deleted)
+
+
+@router.delete("", response_model=CacheInvalidateResponse)
+def clear_cache(file_path: str | None = None):
+    return CacheInvalidateResponse(deleted=cache_service.invalidate(file_path=file_path))
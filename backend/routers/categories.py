@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+
+from models.receipt import CategoryFeedbackRequest, CategoryFeedbackResponse
+from services import category_service
+
+router = APIRouter(prefix="/api/categories", tags=["categories"])
+
+
+@router.post("/feedback", response_model=CategoryFeedbackResponse)
+def submit_category_feedback(request: CategoryFeedbackRequest):
+    learned = category_service.learn(request.results)
+    return CategoryFeedbackResponse(learned=learned)
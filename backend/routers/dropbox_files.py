@@ -1,46 +1,143 @@
 import base64
+import re
+from collections.abc import Iterator
+from urllib.parse import quote
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 
 from models.dropbox_models import (
     DownloadRequest,
     DownloadResponse,
+    ListChangesRequest,
+    ListChangesResponse,
     ListFilesRequest,
     ListFilesResponse,
 )
-from services.dropbox_service import download_file, list_files
+from services.blob_cache import blob_cache
+from services.dropbox_service import (
+    download_blob,
+    get_file_metadata,
+    iter_download,
+    list_changes,
+    list_files,
+    media_type_for,
+    save_cursor,
+)
 
 router = APIRouter(prefix="/api/dropbox", tags=["dropbox"])
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 @router.post("/list", response_model=ListFilesResponse)
 def list_dropbox_files(request: ListFilesRequest):
     try:
-        files = list_files(request.access_token, request.path)
+        files = list_files(request.access_token, request.path, request.recursive)
         return ListFilesResponse(files=files)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/changes", response_model=ListChangesResponse)
+def list_dropbox_changes(request: ListChangesRequest):
+    try:
+        if request.reset:
+            save_cursor(request.access_token, request.path, request.recursive, None)
+        files, deleted, cursor, is_full_listing = list_changes(
+            request.access_token, request.path, request.recursive
+        )
+        return ListChangesResponse(
+            files=files, deleted=deleted, cursor=cursor, is_full_listing=is_full_listing
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/download", response_model=DownloadResponse)
 def download_dropbox_file(request: DownloadRequest):
     try:
-        file_bytes, file_name = download_file(request.access_token, request.file_path)
-        ext = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
-        media_type_map = {
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg",
-            "png": "image/png",
-            "gif": "image/gif",
-            "bmp": "image/bmp",
-            "tiff": "image/tiff",
-            "pdf": "application/pdf",
-        }
-        media_type = media_type_map.get(ext, "application/octet-stream")
+        blob = download_blob(request.access_token, request.file_path)
         return DownloadResponse(
-            file_name=file_name,
-            data_base64=base64.b64encode(file_bytes).decode(),
-            media_type=media_type,
+            file_name=blob.name,
+            data_base64=base64.b64encode(blob.data).decode(),
+            media_type=blob.media_type,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single "bytes=start-end" range into inclusive offsets; None if unsatisfiable."""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        # Suffix range: last N bytes
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def _iter_chunks(data: bytes, start: int, end: int) -> Iterator[bytes]:
+    view = memoryview(data)
+    for offset in range(start, end + 1, STREAM_CHUNK_SIZE):
+        yield bytes(view[offset:min(offset + STREAM_CHUNK_SIZE, end + 1)])
+
+
+@router.get("/file")
+def stream_dropbox_file(
+    path: str,
+    authorization: str | None = Header(default=None),
+    range_header: str | None = Header(default=None, alias="Range"),
+    if_none_match: str | None = Header(default=None),
+):
+    """
+    Raw file bytes with the proper Content-Type, for previews.
+    The token is read from "Authorization: Bearer ..." only, so it never appears in URLs or access logs.
+    The file's metadata is checked first: an If-None-Match hit costs no download, a file already in the
+    session blob cache is served from memory, and anything else is streamed from Dropbox as it arrives.
+    Supports single byte ranges.
+    """
+    token = authorization.removeprefix("Bearer ").strip() if authorization else None
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing access token")
+    try:
+        metadata = get_file_metadata(token, path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    etag = f'"{metadata.content_hash or metadata.rev}"'
+    media_type = media_type_for(metadata.name)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(metadata.name)}",
+    }
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    size = metadata.size
+    start, end, status_code = 0, size - 1, 200
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    blob = blob_cache.get(token, path)
+    if blob is not None and (blob.content_hash, blob.rev) == (metadata.content_hash, metadata.rev):
+        chunks = _iter_chunks(blob.data, start, end)
+    else:
+        chunks = iter_download(token, metadata, start, end, STREAM_CHUNK_SIZE)
+    return StreamingResponse(chunks, status_code=status_code, media_type=media_type, headers=headers)
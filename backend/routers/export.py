@@ -1,19 +1,59 @@
-from fastapi import APIRouter
-from fastapi.responses import Response
+from collections.abc import Iterable
+from typing import Literal
 
-from models.receipt import CsvExportRequest
-from services.csv_service import generate_csv
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from models.receipt import AccountingCategory, CsvExportRequest, ReceiptResult
+from models.result_models import MONTH_PATTERN
+from services import job_service, results_store
+from services.export_service import export
 
 router = APIRouter(prefix="/api/export", tags=["export"])
 
+ExportFormat = Literal["csv", "jsonl", "xlsx", "parquet"]
 
-@router.post("/csv")
-def export_csv(request: CsvExportRequest):
-    csv_bytes = generate_csv(request.results)
-    return Response(
-        content=csv_bytes,
-        media_type="text/csv; charset=shift_jis",
+
+def _export_response(results: Iterable[ReceiptResult], fmt: str) -> StreamingResponse:
+    try:
+        exported = export(results, fmt)
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=f"{fmt} export requires the {e.name} package")
+    return StreamingResponse(
+        exported.chunks,
+        media_type=exported.media_type,
         headers={
-            "Content-Disposition": 'attachment; filename="receipts.csv"',
+            "Content-Disposition": f'attachment; filename="{exported.file_name}"',
         },
     )
+
+
+@router.post("/csv")
+def export_csv(request: CsvExportRequest):
+    return _export_response(request.results, "csv")
+
+
+@router.get("/jobs/{job_id}")
+def export_job(job_id: str, format: ExportFormat = "csv"):
+    """Export a job's results, with manual edits made since, without sending them back from the client."""
+    if job_service.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _export_response(results_store.with_stored_edits(job_service.iter_results(job_id)), format)
+
+
+@router.get("/results")
+def export_results(
+    format: ExportFormat = "csv",
+    month: str | None = Query(None, pattern=MONTH_PATTERN),
+    category: AccountingCategory | None = None,
+    vendor: str | None = None,
+    min_amount: int | None = None,
+    max_amount: int | None = None,
+):
+    """Export stored results matching the same filters as /api/results."""
+    return _export_response(
+        results_store.iter_results(
+            month=month, category=category, vendor=vendor, min_amount=min_amount, max_amount=max_amount
+        ),
+        format,
+    )
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Header, HTTPException
+from sse_starlette.sse import EventSourceResponse
+
+from models.job_models import Job, JobRequest, JobResults, ResumeJobRequest
+from services import job_service
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+def _require_job(job_id: str) -> Job:
+    job = job_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("", response_model=Job)
+async def start_job(request: JobRequest):
+    job_id = job_service.create_job(request.access_token, request.file_paths, request.concurrency)
+    return job_service.get_job(job_id)
+
+
+@router.get("/{job_id}", response_model=Job)
+def get_job(job_id: str):
+    return _require_job(job_id)
+
+
+@router.get("/{job_id}/results", response_model=JobResults)
+def get_job_results(job_id: str):
+    job = _require_job(job_id)
+    return JobResults(job=job, files=job_service.get_files(job_id), results=job_service.get_results(job_id))
+
+
+@router.post("/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str):
+    _require_job(job_id)
+    if not await job_service.cancel_job(job_id):
+        raise HTTPException(status_code=409, detail="Job is not running")
+    return job_service.get_job(job_id)
+
+
+@router.post("/{job_id}/resume", response_model=Job)
+async def resume_job(job_id: str, request: ResumeJobRequest):
+    _require_job(job_id)
+    if not job_service.resume_job(job_id, request.access_token, request.retry_errors):
+        raise HTTPException(status_code=409, detail="Job is already running")
+    return job_service.get_job(job_id)
+
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, last_event_id: int = 0, last_event_id_header: str | None = Header(None, alias="Last-Event-ID")):
+    """Replay events after Last-Event-ID (header, or query parameter for clients that cannot set headers), then follow the job."""
+    _require_job(job_id)
+    if last_event_id_header and last_event_id_header.isdigit():
+        last_event_id = int(last_event_id_header)
+    return EventSourceResponse(job_service.stream_events(job_id, last_event_id))
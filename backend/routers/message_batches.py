@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException
+
+from models.batch_models import MessageBatchJob, MessageBatchJobRequest, MessageBatchJobResults
+from services import batch_api_service
+
+router = APIRouter(prefix="/api/message-batches", tags=["message-batches"])
+
+
+@router.post("", response_model=MessageBatchJob)
+async def start_message_batch_job(request: MessageBatchJobRequest):
+    job_id = batch_api_service.start_job(request.access_token, request.path, request.recursive)
+    return batch_api_service.get_job(job_id)
+
+
+@router.get("/{job_id}", response_model=MessageBatchJob)
+def get_message_batch_job(job_id: str):
+    job = batch_api_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/{job_id}/results", response_model=MessageBatchJobResults)
+def get_message_batch_results(job_id: str):
+    job = batch_api_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return MessageBatchJobResults(job=job, results=batch_api_service.get_results(job_id))
+
+
+@router.post("/{job_id}/cancel", response_model=MessageBatchJob)
+async def cancel_message_batch_job(job_id: str):
+    if not await batch_api_service.cancel_job(job_id):
+        raise HTTPException(status_code=409, detail="Job is not running")
+    return batch_api_service.get_job(job_id)
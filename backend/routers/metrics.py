@@ -0,0 +1,45 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services import usage_metrics, watch_service
+from services.blob_cache import blob_cache
+from services.client_registry import registry
+from services.rate_limiter import scheduler
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("", response_class=PlainTextResponse)
+def get_prometheus_metrics():
+    """Model usage, scheduler and client counters in the Prometheus text format."""
+    lines = usage_metrics.prometheus_lines()
+    for source, values in (("scheduler", scheduler.metrics()), ("clients", registry.metrics())):
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                lines += [f"# TYPE {source}_{key} gauge", f"{source}_{key} {value}"]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@router.get("/usage")
+def get_usage_metrics():
+    return usage_metrics.totals()
+
+
+@router.get("/clients")
+def get_client_metrics():
+    return registry.metrics()
+
+
+@router.get("/scheduler")
+def get_scheduler_metrics():
+    return scheduler.metrics()
+
+
+@router.get("/blob-cache")
+def get_blob_cache_metrics():
+    return blob_cache.metrics()
+
+
+@router.get("/watch")
+def get_watch_metrics():
+    return watch_service.status()
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from models.receipt import AccountingCategory, CategoryTotal, ReceiptResult
+from models.result_models import MONTH_PATTERN, MonthlyTotal, ResultPage, ResultUpdate
+from services import category_service, results_store
+
+router = APIRouter(prefix="/api/results", tags=["results"])
+
+
+@router.get("", response_model=ResultPage)
+def query_results(
+    month: str | None = Query(None, pattern=MONTH_PATTERN),
+    category: AccountingCategory | None = None,
+    vendor: str | None = None,
+    min_amount: int | None = None,
+    max_amount: int | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    results, total = results_store.query_results(
+        limit=limit, offset=offset, month=month, category=category, vendor=vendor,
+        min_amount=min_amount, max_amount=max_amount,
+    )
+    return ResultPage(results=results, total=total)
+
+
+@router.get("/summary/monthly", response_model=list[MonthlyTotal])
+def monthly_summary(year: str | None = Query(None, pattern=r"^\d{4}$")):
+    return results_store.monthly_totals(year)
+
+
+@router.get("/summary/categories", response_model=list[CategoryTotal])
+def category_summary(
+    from_month: str | None = Query(None, pattern=MONTH_PATTERN),
+    to_month: str | None = Query(None, pattern=MONTH_PATTERN),
+):
+    return results_store.category_totals(from_month, to_month)
+
+
+@router.get("/{result_id}", response_model=ReceiptResult)
+def get_result(result_id: str):
+    result = results_store.get_result(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return result
+
+
+@router.patch("/{result_id}", response_model=ReceiptResult)
+def update_result(result_id: str, update: ResultUpdate):
+    result = results_store.update_result(result_id, update)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    category_service.learn([result], manual=True)
+    return result
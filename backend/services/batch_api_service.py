@@ -0,0 +1,370 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+from config import settings
+from models.batch_models import MessageBatchJob
+from models.receipt import ReceiptResult
+from services import cache_service, category_service, duplicate_service, results_store, routing_service, usage_metrics
+from services.client_registry import registry
+from services.dropbox_service import download_file_async, list_files
+from services.ocr_service import build_receipt_request, build_suica_request, receipt_from_response, suica_results_from_response
+from services.pipeline_service import is_pdf
+from utils.image_utils import iter_pdf_page_parts, pdf_text_layer, prepare_image_base64_async, run_in_image_pool
+from utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+# API limits are 100,000 requests or 256 MB per batch; stay below the size limit for JSON overhead
+MAX_BATCH_REQUESTS = 100_000
+MAX_BATCH_BYTES = 200 * 1024 * 1024
+# Polling retries after a failed retrieve, doubling from message_batch_poll_interval up to this many seconds
+POLL_RETRY_MAX_DELAY = 30 * 60.0
+
+_lock = threading.Lock()
+_conn = None
+_tasks: set[asyncio.Task] = set()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("message_batches.sqlite3")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                file_count INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                ended_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS requests (
+                job_id TEXT NOT NULL,
+                custom_id TEXT NOT NULL,
+                batch_id TEXT,
+                file_index INTEGER NOT NULL,
+                page INTEGER,
+                file_path TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                results TEXT,
+                error TEXT,
+                PRIMARY KEY (job_id, custom_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_batches_job ON batches (job_id);
+            """
+        )
+    return _conn
+
+
+def _execute(sql: str, params: tuple = ()) -> list:
+    with _lock:
+        return _db().execute(sql, params).fetchall()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def start_job(access_token: str, folder: str, recursive: bool = True) -> str:
+    """Create a Message Batches job for a folder; building, submission and polling continue in the background."""
+    job_id = str(uuid.uuid4())
+    _execute(
+        "INSERT INTO jobs (id, folder, status, created_at) VALUES (?, ?, 'submitting', ?)",
+        (job_id, folder, time.time()),
+    )
+    _spawn(_run_job(job_id, access_token, folder, recursive))
+    return job_id
+
+
+def resume_polling() -> None:
+    """Restart polling for jobs that were waiting on the API when the server stopped (called from lifespan)."""
+    for row in _execute("SELECT id FROM jobs WHERE status IN ('processing', 'canceling')"):
+        _spawn(_poll_job(row["id"]))
+    # Submission needs the user's access token, which is never persisted
+    _execute(
+        "UPDATE jobs SET status = 'failed', error = 'Server restarted during submission', ended_at = ?"
+        " WHERE status = 'submitting'",
+        (time.time(),),
+    )
+
+
+async def _run_job(job_id: str, access_token: str, folder: str, recursive: bool) -> None:
+    try:
+        files = [f for f in await asyncio.to_thread(list_files, access_token, folder, recursive) if not f.is_folder]
+        _execute("UPDATE jobs SET file_count = ? WHERE id = ?", (len(files), job_id))
+
+        chunk: list[dict] = []
+        chunk_bytes = 0
+        for file_index, file in enumerate(files):
+            if _canceling(job_id):
+                break
+            try:
+                requests = await _build_requests(job_id, access_token, file_index, file.path)
+            except Exception as e:
+                # One unreadable file is recorded as an error result instead of failing the whole job
+                logger.warning("Could not prepare %s for job %s: %s", file.path, job_id, e)
+                _record_file_error(job_id, file_index, file.path, str(e))
+                continue
+            for request in requests:
+                size = len(json.dumps(request))
+                if chunk and (len(chunk) >= MAX_BATCH_REQUESTS or chunk_bytes + size > MAX_BATCH_BYTES):
+                    if _canceling(job_id):
+                        break
+                    await _submit(job_id, chunk)
+                    chunk, chunk_bytes = [], 0
+                chunk.append(request)
+                chunk_bytes += size
+        if chunk and not _canceling(job_id):
+            await _submit(job_id, chunk)
+
+        _execute("UPDATE jobs SET status = 'processing' WHERE id = ? AND status = 'submitting'", (job_id,))
+    except Exception as e:
+        logger.exception("Message batch job %s failed during submission", job_id)
+        _execute(
+            "UPDATE jobs SET status = 'failed', error = ?, ended_at = ? WHERE id = ?",
+            (str(e), time.time(), job_id),
+        )
+        return
+    await _poll_job(job_id)
+
+
+def _canceling(job_id: str) -> bool:
+    return bool(_execute("SELECT id FROM jobs WHERE id = ? AND status = 'canceling'", (job_id,)))
+
+
+def _record_file_error(job_id: str, file_index: int, file_path: str, error: str) -> None:
+    file_name = file_path.rsplit("/", 1)[-1]
+    result = ReceiptResult(id=str(uuid.uuid4()), file_name=file_name, file_path=file_path, error=error)
+    with _lock:
+        # Drop anything recorded for the file before it failed
+        _db().execute("DELETE FROM requests WHERE job_id = ? AND file_index = ?", (job_id, file_index))
+        _db().execute(
+            "INSERT INTO requests (job_id, custom_id, file_index, file_path, file_name, kind, cache_key, results, error)"
+            " VALUES (?, ?, ?, ?, ?, '', '', ?, ?)",
+            (job_id, f"f{file_index}", file_index, file_path, file_name, _dump([result]), error),
+        )
+
+
+async def _build_requests(job_id: str, access_token: str, file_index: int, file_path: str) -> list[dict]:
+    """Batch requests for one file; files already in the OCR cache are resolved immediately instead."""
+    file_bytes, file_name = await download_file_async(access_token, file_path)
+    digest = cache_service.content_hash(file_bytes)
+    plan = await routing_service.plan_route(file_bytes, file_name, digest)
+    kind = plan.kind
+    cache_key = cache_service.make_key(digest, kind)
+
+    def record(custom_id: str, page: int | None, results: list[ReceiptResult] | None = None) -> None:
+        _execute(
+            "INSERT INTO requests (job_id, custom_id, file_index, page, file_path, file_name, kind, cache_key, results)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id, custom_id, file_index, page, file_path, file_name, kind, cache_key,
+                _dump(results) if results is not None else None,
+            ),
+        )
+
+    cached = cache_service.get(cache_key, file_name, file_path)
+    if cached is not None:
+        record(f"f{file_index}", None, cached)
+        return []
+
+    if is_pdf(file_name):
+        # Pages with a text layer are sent as text, the rest rendered
+        texts = plan.texts if plan.texts is not None else await run_in_image_pool(pdf_text_layer, file_bytes)
+        text_stats: dict[str, int] = {}
+        pages = await asyncio.to_thread(
+            lambda: list(iter_pdf_page_parts(file_bytes, texts, pages=plan.pages, stats=text_stats))
+        )
+        usage_metrics.record_text_layer(**text_stats)
+        groups = plan.groups or [[page] for page in range(1, len(pages) + 1)]
+        prepared = dict(zip(plan.pages or range(1, len(pages) + 1), pages))
+        if kind == "multi":
+            # One request per receipt, keyed by the receipt's first page
+            requests = []
+            for group in groups:
+                custom_id = f"f{file_index}-p{group[0]}"
+                record(custom_id, group[0])
+                parts = [part for p in group for part in prepared[p]]
+                requests.append({"custom_id": custom_id, "params": build_receipt_request(parts)})
+            return requests
+        image_data = [part for group in groups for p in group for part in prepared[p]]
+    else:
+        image_data = await prepare_image_base64_async(file_bytes, file_name)
+    params = build_suica_request(image_data) if kind == "suica" else build_receipt_request(image_data)
+    record(f"f{file_index}", None)
+    return [{"custom_id": f"f{file_index}", "params": params}]
+
+
+async def _submit(job_id: str, requests: list[dict]) -> None:
+    batch = await registry.anthropic().messages.batches.create(requests=requests)
+    _execute(
+        "INSERT INTO batches (batch_id, job_id, status, created_at) VALUES (?, ?, ?, ?)",
+        (batch.id, job_id, batch.processing_status, time.time()),
+    )
+    with _lock:
+        _db().executemany(
+            "UPDATE requests SET batch_id = ? WHERE job_id = ? AND custom_id = ?",
+            [(batch.id, job_id, r["custom_id"]) for r in requests],
+        )
+    logger.info("Submitted message batch %s (%d requests) for job %s", batch.id, len(requests), job_id)
+
+
+async def _poll_job(job_id: str) -> None:
+    client = registry.anthropic()
+    failures = 0
+    while True:
+        try:
+            pending = _execute("SELECT batch_id FROM batches WHERE job_id = ? AND status != 'ended'", (job_id,))
+            if not pending:
+                break
+            still_running = False
+            for row in pending:
+                batch = await client.messages.batches.retrieve(row["batch_id"])
+                if batch.processing_status == "ended":
+                    await _collect_results(job_id, batch.id)
+                else:
+                    still_running = True
+                _execute("UPDATE batches SET status = ? WHERE batch_id = ?", (batch.processing_status, batch.id))
+            failures = 0
+            delay = settings.message_batch_poll_interval if still_running else 0.0
+        except Exception as e:
+            # Transient API errors must not stop polling; the job stays "processing" and the error is shown
+            failures += 1
+            delay = min(settings.message_batch_poll_interval * 2 ** failures, POLL_RETRY_MAX_DELAY)
+            logger.exception("Polling message batch job %s failed, retrying in %.0fs", job_id, delay)
+            _execute("UPDATE jobs SET error = ? WHERE id = ?", (str(e), job_id))
+        if delay:
+            await asyncio.sleep(delay)
+    _finalize(job_id)
+
+
+async def _collect_results(job_id: str, batch_id: str) -> None:
+    client = registry.anthropic()
+    requests = {
+        row["custom_id"]: row
+        for row in _execute("SELECT * FROM requests WHERE job_id = ? AND batch_id = ?", (job_id, batch_id))
+    }
+    async for entry in await client.messages.batches.results(batch_id):
+        row = requests.get(entry.custom_id)
+        if row is None or row["results"] is not None:
+            continue
+        label = f"{row['file_name']} (p{row['page']})" if row["page"] else row["file_name"]
+        error = None
+        results: list[ReceiptResult] = []
+        if entry.result.type == "succeeded":
+            message = entry.result.message
+            usage_metrics.record(usage_metrics.CallMetrics(
+                model=message.model,
+                purpose="suica" if row["kind"] == "suica" else "extraction",
+                ok=True,
+                input_tokens=message.usage.input_tokens,
+                output_tokens=message.usage.output_tokens,
+                cache_read_tokens=message.usage.cache_read_input_tokens or 0,
+                cache_write_tokens=message.usage.cache_creation_input_tokens or 0,
+                batch=True,
+            ))
+            try:
+                if row["kind"] == "suica":
+                    results = await suica_results_from_response(client, entry.result.message, row["file_name"], row["file_path"])
+                else:
+                    results = [await receipt_from_response(client, entry.result.message, label, row["file_path"])]
+            except Exception as e:
+                error = f"Failed to parse result: {e}"
+        elif entry.result.type == "errored":
+            error = f"Batch request errored: {entry.result.error.error.message}"
+        else:
+            error = f"Batch request {entry.result.type}"
+        if error:
+            results = [ReceiptResult(id=str(uuid.uuid4()), file_name=label, file_path=row["file_path"], error=error)]
+        _execute(
+            "UPDATE requests SET results = ?, error = ? WHERE job_id = ? AND custom_id = ?",
+            (_dump(results), error, job_id, entry.custom_id),
+        )
+
+
+def _finalize(job_id: str) -> None:
+    """Fill the OCR cache, category memo and results store from fully successful files, then close the job."""
+    rows = _execute(
+        "SELECT * FROM requests WHERE job_id = ? AND batch_id IS NOT NULL ORDER BY file_index, page", (job_id,)
+    )
+    by_file: dict[int, list] = {}
+    for row in rows:
+        by_file.setdefault(row["file_index"], []).append(row)
+    for file_rows in by_file.values():
+        if any(row["error"] or row["results"] is None for row in file_rows):
+            continue
+        first = file_rows[0]
+        results = [r for row in file_rows for r in _load(row["results"])]
+        category_service.learn(results, manual=False)
+        cache_service.put(first["cache_key"], first["kind"], first["file_name"], first["file_path"], results)
+        results_store.save_file_results(first["file_path"], duplicate_service.flag_results(results, first["file_path"]))
+
+    _execute(
+        "UPDATE jobs SET status = CASE WHEN status = 'canceling' THEN 'canceled' ELSE 'ended' END,"
+        " error = NULL, ended_at = ? WHERE id = ?",
+        (time.time(), job_id),
+    )
+
+
+async def cancel_job(job_id: str) -> bool:
+    if not _execute("SELECT id FROM jobs WHERE id = ? AND status IN ('submitting', 'processing')", (job_id,)):
+        return False
+    _execute("UPDATE jobs SET status = 'canceling' WHERE id = ?", (job_id,))
+    client = registry.anthropic()
+    for row in _execute("SELECT batch_id FROM batches WHERE job_id = ? AND status = 'in_progress'", (job_id,)):
+        await client.messages.batches.cancel(row["batch_id"])
+    return True
+
+
+def get_job(job_id: str) -> MessageBatchJob | None:
+    rows = _execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    if not rows:
+        return None
+    job = rows[0]
+    (counts,) = _execute(
+        "SELECT COUNT(*) AS total, COUNT(results) AS completed FROM requests WHERE job_id = ?", (job_id,)
+    )
+    batch_ids = [row["batch_id"] for row in _execute("SELECT batch_id FROM batches WHERE job_id = ? ORDER BY created_at", (job_id,))]
+    return MessageBatchJob(
+        id=job["id"],
+        folder=job["folder"],
+        status=job["status"],
+        error=job["error"],
+        file_count=job["file_count"],
+        request_count=counts["total"],
+        completed_requests=counts["completed"],
+        batch_ids=batch_ids,
+        created_at=job["created_at"],
+        ended_at=job["ended_at"],
+    )
+
+
+def get_results(job_id: str) -> list[ReceiptResult]:
+    rows = _execute(
+        "SELECT results FROM requests WHERE job_id = ? AND results IS NOT NULL ORDER BY file_index, page", (job_id,)
+    )
+    return [r for row in rows for r in _load(row["results"])]
+
+
+def _dump(results: list[ReceiptResult]) -> str:
+    return json.dumps([r.model_dump(mode="json") for r in results], ensure_ascii=False)
+
+
+def _load(payload: str) -> list[ReceiptResult]:
+    return [ReceiptResult.model_validate(data) for data in json.loads(payload)]
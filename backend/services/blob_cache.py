@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from config import settings
+
+
+@dataclass
+class Blob:
+    data: bytes
+    name: str
+    media_type: str
+    content_hash: str | None = None
+    rev: str | None = None
+    fetched_at: float = field(default_factory=time.monotonic)
+
+
+class BlobCache:
+    """
+    In-memory LRU of downloaded Dropbox files, bounded by total bytes and expiring after blob_cache_ttl.
+    Entries are scoped to the access token, so one login session fetches each file at most once,
+    whether for preview or OCR. Concurrent requests for the same file share a single download.
+    A validate callback passed to get_or_fetch is asked before a cached blob is served, so a file
+    replaced in Dropbox within the TTL is downloaded again rather than served stale.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], Blob] = OrderedDict()
+        self._inflight: dict[tuple[str, str], threading.Event] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(access_token: str, path: str) -> tuple[str, str]:
+        return hashlib.sha256(access_token.encode()).hexdigest(), path.lower()
+
+    def _get_fresh(self, key: tuple[str, str]) -> Blob | None:
+        blob = self._entries.get(key)
+        if blob is None:
+            return None
+        if time.monotonic() - blob.fetched_at > settings.blob_cache_ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return blob
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        blob = self._entries.pop(key, None)
+        if blob is not None:
+            self._size -= len(blob.data)
+
+    def get(self, access_token: str, path: str) -> Blob | None:
+        with self._lock:
+            blob = self._get_fresh(self._key(access_token, path))
+            if blob is not None:
+                self.hits += 1
+            return blob
+
+    def get_or_fetch(
+        self, access_token: str, path: str, fetch: Callable[[], Blob], validate: Callable[[Blob], bool] | None = None
+    ) -> Blob:
+        key = self._key(access_token, path)
+        while True:
+            with self._lock:
+                blob = self._get_fresh(key)
+                waiting = self._inflight.get(key)
+                if blob is None and waiting is None:
+                    self.misses += 1
+                    done = self._inflight[key] = threading.Event()
+                    break
+            if blob is not None:
+                if validate is None or validate(blob):
+                    with self._lock:
+                        self.hits += 1
+                    return blob
+                with self._lock:
+                    if self._entries.get(key) is blob:
+                        self._remove(key)
+                continue
+            # Another thread is downloading the same file; reuse its result
+            waiting.wait()
+
+        try:
+            blob = fetch()
+            self._put(key, blob)
+            return blob
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def put(self, access_token: str, path: str, blob: Blob) -> None:
+        self._put(self._key(access_token, path), blob)
+
+    def _put(self, key: tuple[str, str], blob: Blob) -> None:
+        if len(blob.data) > settings.blob_cache_max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = blob
+            self._size += len(blob.data)
+            while self._size > settings.blob_cache_max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, access_token: str, path: str) -> None:
+        with self._lock:
+            self._remove(self._key(access_token, path))
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": settings.blob_cache_max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+blob_cache = BlobCache()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from config import settings
+from models.cache_models import CacheEntry, CacheStats
+from models.receipt import ReceiptResult
+from services.ocr_service import route_prompt
+from utils.sqlite_utils import connect
+
+_lock = threading.Lock()
+_conn = None
+_hits = 0
+_misses = 0
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("ocr_cache.sqlite3")
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                model TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                results TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                result_count INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_lru ON ocr_cache (last_accessed)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_path ON ocr_cache (file_path)")
+    return _conn
+
+
+def content_hash(file_bytes: bytes) -> str:
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+def make_key(file_hash: str, kind: str) -> str:
+    """Cache key for one file: content hash + processing route + prompt text + model names."""
+    prompt_hash = hashlib.sha256(route_prompt(kind).encode()).hexdigest()
+    fast_model = settings.anthropic_fast_model if settings.model_routing_enabled else ""
+    raw = "\0".join([file_hash, kind, prompt_hash, settings.anthropic_model, fast_model, settings.pdf_text_layer_mode])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get(key: str, file_name: str, file_path: str) -> list[ReceiptResult] | None:
+    """
+    Look up cached results. On a hit, results are relabelled for the requested file
+    (new ids, current path and name) since identical content may live at several paths.
+    """
+    global _hits, _misses
+    if not settings.ocr_cache_enabled:
+        return None
+
+    with _lock:
+        row = _db().execute(
+            "SELECT file_name, results FROM ocr_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            _misses += 1
+            return None
+        _hits += 1
+        _db().execute(
+            "UPDATE ocr_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE key = ?",
+            (time.time(), key),
+        )
+
+    results: list[ReceiptResult] = []
+    for data in json.loads(row["results"]):
+        result = ReceiptResult.model_validate(data)
+        results.append(result.model_copy(update={
+            "id": str(uuid.uuid4()),
+            "file_name": result.file_name.replace(row["file_name"], file_name, 1),
+            "file_path": file_path,
+        }))
+    return results
+
+
+def iter_cached_results():
+    """Yield every cached ReceiptResult (used to seed the local category classifier)."""
+    with _lock:
+        rows = _db().execute("SELECT results FROM ocr_cache").fetchall()
+    for row in rows:
+        for data in json.loads(row["results"]):
+            yield ReceiptResult.model_validate(data)
+
+
+def put(key: str, kind: str, file_name: str, file_path: str, results: list[ReceiptResult]) -> None:
+    """Store results for a file and evict least-recently-used entries beyond the size limit."""
+    if not settings.ocr_cache_enabled:
+        return
+
+    payload = json.dumps([r.model_dump(mode="json") for r in results], ensure_ascii=False)
+    size = len(payload.encode())
+    now = time.time()
+    with _lock:
+        _db().execute(
+            """
+            INSERT OR REPLACE INTO ocr_cache
+                (key, kind, model, file_name, file_path, results, size, result_count, created_at, last_accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, kind, settings.anthropic_model, file_name, file_path, payload, size, len(results), now, now),
+        )
+        _evict()
+
+
+def _evict() -> None:
+    total = _db().execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+    if total <= settings.ocr_cache_max_bytes:
+        return
+    stale: list[str] = []
+    for row in _db().execute("SELECT key, size FROM ocr_cache ORDER BY last_accessed"):
+        if total <= settings.ocr_cache_max_bytes:
+            break
+        stale.append(row["key"])
+        total -= row["size"]
+    _db().executemany("DELETE FROM ocr_cache WHERE key = ?", [(k,) for k in stale])
+
+
+def stats() -> CacheStats:
+    with _lock:
+        count, total = _db().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache"
+        ).fetchone()
+    return CacheStats(
+        entries=count,
+        total_bytes=total,
+        max_bytes=settings.ocr_cache_max_bytes,
+        hits=_hits,
+        misses=_misses,
+    )
+
+
+def list_entries(limit: int = 100, file_path: str | None = None) -> list[CacheEntry]:
+    query = (
+        "SELECT key, kind, model, file_name, file_path, size, result_count, created_at, last_accessed, hit_count"
+        " FROM ocr_cache"
+    )
+    params: tuple = ()
+    if file_path:
+        query += " WHERE file_path = ?"
+        params = (file_path,)
+    query += " ORDER BY last_accessed DESC LIMIT ?"
+    with _lock:
+        rows = _db().execute(query, (*params, limit)).fetchall()
+    return [CacheEntry(**dict(row)) for row in rows]
+
+
+def invalidate(key: str | None = None, file_path: str | None = None) -> int:
+    """Delete one entry, all entries for a path, or everything when neither is given."""
+    with _lock:
+        if key:
+            cur = _db().execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+        elif file_path:
+            cur = _db().execute("DELETE FROM ocr_cache WHERE file_path = ?", (file_path,))
+        else:
+            cur = _db().execute("DELETE FROM ocr_cache")
+    return cur.rowcount
@@ -0,0 +1,301 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from config import settings
+from models.receipt import AccountingCategory, ReceiptResult
+from utils.sqlite_utils import connect
+
+# Weight of a manual edit in the text classifier, relative to one model answer
+MANUAL_WEIGHT = 5
+
+_COMPANY_SUFFIXES = re.compile(r"株式会社|有限会社|合同会社|\(株\)|\(有\)|\(同\)|㈱|㈲|inc\.?|co\.,?\s*ltd\.?|corp\.?")
+
+_lock = threading.Lock()
+_conn = None
+
+
+@dataclass
+class ClassificationStats:
+    """Per-batch counters for the local classification layer."""
+    lookups: int = 0
+    memo_hits: int = 0
+    classifier_hits: int = 0
+    model_calls: int = 0
+
+    @property
+    def model_calls_saved(self) -> int:
+        return self.memo_hits + self.classifier_hits
+
+    def as_dict(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "memo_hits": self.memo_hits,
+            "classifier_hits": self.classifier_hits,
+            "hit_rate": round(self.model_calls_saved / self.lookups, 3) if self.lookups else 0.0,
+            "model_calls": self.model_calls,
+            "model_calls_saved": self.model_calls_saved,
+        }
+
+
+_current_stats: ContextVar[ClassificationStats | None] = ContextVar("classification_stats", default=None)
+
+
+def start_stats() -> ClassificationStats:
+    """Begin collecting classification stats for the current batch (inherited by tasks created afterwards)."""
+    stats = ClassificationStats()
+    _current_stats.set(stats)
+    return stats
+
+
+def record_model_call() -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.model_calls += 1
+
+
+@dataclass
+class _NaiveBayes:
+    """Multinomial naive Bayes over character bigrams of vendor + description."""
+    class_counts: Counter = field(default_factory=Counter)
+    feature_counts: dict[str, Counter] = field(default_factory=dict)
+    vocabulary: set[str] = field(default_factory=set)
+
+    def learn(self, features: list[str], category: str, weight: int = 1) -> None:
+        self.class_counts[category] += weight
+        counts = self.feature_counts.setdefault(category, Counter())
+        for f in features:
+            counts[f] += weight
+        self.vocabulary.update(features)
+
+    def unlearn(self, features: list[str], category: str, weight: int = 1) -> None:
+        counts = self.feature_counts.get(category)
+        if counts is None:
+            return
+        counts.subtract({f: weight for f in features})
+        self.class_counts[category] -= weight
+        if self.class_counts[category] <= 0:
+            del self.class_counts[category], self.feature_counts[category]
+        else:
+            self.feature_counts[category] = +counts
+
+    def predict(self, features: list[str]) -> tuple[str, float] | None:
+        total = sum(self.class_counts.values())
+        if not total or not features:
+            return None
+        vocab_size = len(self.vocabulary) + 1
+        scores: dict[str, float] = {}
+        for category, count in self.class_counts.items():
+            counts = self.feature_counts[category]
+            denominator = sum(counts.values()) + vocab_size
+            score = math.log(count / total)
+            for f in features:
+                score += math.log((counts[f] + 1) / denominator)
+            scores[category] = score
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(s - scores[best]) for s in scores.values())
+        return best, 1.0 / norm
+
+
+_model = _NaiveBayes()
+_model_loaded = False
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("categories.sqlite3")
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vendor_memo (
+                vendor_key TEXT NOT NULL,
+                category TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                manual INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                manual_at REAL,
+                PRIMARY KEY (vendor_key, category)
+            )
+            """
+        )
+        if "manual_at" not in {row["name"] for row in _conn.execute("PRAGMA table_info(vendor_memo)")}:
+            _conn.execute("ALTER TABLE vendor_memo ADD COLUMN manual_at REAL")
+            _conn.execute("UPDATE vendor_memo SET manual_at = updated_at WHERE manual")
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS examples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                category TEXT NOT NULL,
+                weight INTEGER NOT NULL
+            )
+            """
+        )
+        columns = {row["name"] for row in _conn.execute("PRAGMA table_info(examples)")}
+        if "result_id" not in columns:
+            _conn.execute("ALTER TABLE examples ADD COLUMN result_id TEXT")
+            _conn.execute("ALTER TABLE examples ADD COLUMN vendor_key TEXT")
+        # One example per result: learning a result again replaces its example
+        _conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_examples_result ON examples (result_id)")
+    return _conn
+
+
+def _ensure_model() -> None:
+    """Load training examples into the in-memory classifier, seeding from cached OCR results on first run."""
+    global _model_loaded
+    if _model_loaded:
+        return
+    # Seeding only writes examples (the model is not loaded yet); the loop below learns each of them once
+    if _db().execute("SELECT COUNT(*) FROM vendor_memo").fetchone()[0] == 0:
+        _seed_from_cache()
+    for row in _db().execute("SELECT text, category, weight FROM examples"):
+        _model.learn(_features(row["text"]), row["category"], row["weight"])
+    _model_loaded = True
+
+
+def _seed_from_cache() -> None:
+    from services.cache_service import iter_cached_results
+
+    for result in iter_cached_results():
+        if result.category_source not in ("local", "default"):
+            _learn_locked(result, manual=False)
+
+
+def normalize_vendor(name: str | None) -> str:
+    if not name:
+        return ""
+    name = unicodedata.normalize("NFKC", name).lower()
+    name = _COMPANY_SUFFIXES.sub("", name)
+    return re.sub(r"[\s・･.,、。]+", "", name)
+
+
+def _text(company_name: str | None, description: str | None) -> str:
+    return f"{normalize_vendor(company_name)} {unicodedata.normalize('NFKC', description or '').lower()}".strip()
+
+
+def _features(text: str) -> list[str]:
+    compact = text.replace(" ", "")
+    return [compact[i:i + 2] for i in range(len(compact) - 1)] or ([compact] if compact else [])
+
+
+def _memo_lookup(vendor_key: str) -> tuple[AccountingCategory, float] | None:
+    rows = _db().execute(
+        "SELECT category, count, manual FROM vendor_memo WHERE vendor_key = ? ORDER BY manual_at DESC",
+        (vendor_key,),
+    ).fetchall()
+    if not rows:
+        return None
+    # The most recent manual edit always wins (manual_at only moves on manual edits)
+    for row in rows:
+        if row["manual"]:
+            return AccountingCategory(row["category"]), 1.0
+    counts = {row["category"]: row["count"] for row in rows}
+    best = max(counts, key=counts.get)
+    # Shrink towards zero for vendors seen only a few times
+    return AccountingCategory(best), counts[best] / (sum(counts.values()) + 1)
+
+
+def classify_local(extracted: dict, record_stats: bool = True) -> tuple[AccountingCategory, str] | None:
+    """
+    Classify from the vendor memo, then the local text classifier.
+    Returns None when neither is confident enough, meaning the model should be asked.
+    Pass record_stats=False for lookups that do not stand in for a model call, so the hit rate
+    only counts calls actually saved.
+    """
+    if not settings.local_category_enabled:
+        return None
+    stats = _current_stats.get() if record_stats else None
+    if stats is not None:
+        stats.lookups += 1
+
+    company_name = extracted.get("company_name")
+    description = extracted.get("description")
+    with _lock:
+        _ensure_model()
+        vendor_key = normalize_vendor(company_name)
+        memo = _memo_lookup(vendor_key) if vendor_key else None
+        if memo and memo[1] >= settings.local_category_threshold:
+            if stats is not None:
+                stats.memo_hits += 1
+            return memo[0], f"過去の分類実績に基づく（{company_name}）"
+
+        if sum(_model.class_counts.values()) < settings.local_category_min_examples:
+            return None
+        prediction = _model.predict(_features(_text(company_name, description)))
+
+    if prediction and prediction[1] >= settings.local_category_threshold:
+        if stats is not None:
+            stats.classifier_hits += 1
+        return AccountingCategory(prediction[0]), "類似する過去の取引に基づく"
+    return None
+
+
+def _learn_locked(result: ReceiptResult, manual: bool) -> None:
+    if result.category is None or not (result.company_name or result.description):
+        return
+    category = result.category.value
+    weight = MANUAL_WEIGHT if manual else 1
+    vendor_key = normalize_vendor(result.company_name)
+    text = _text(result.company_name, result.description)
+    previous = _db().execute(
+        "SELECT text, category, weight, vendor_key FROM examples WHERE result_id = ?", (result.id,)
+    ).fetchone()
+    if previous is not None:
+        if (previous["text"], previous["category"], previous["weight"]) == (text, category, weight):
+            return
+        _forget_locked(previous)
+    if vendor_key:
+        now = time.time()
+        _db().execute(
+            """
+            INSERT INTO vendor_memo (vendor_key, category, count, manual, updated_at, manual_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (vendor_key, category) DO UPDATE SET
+                count = count + excluded.count,
+                manual = MAX(manual, excluded.manual),
+                updated_at = excluded.updated_at,
+                manual_at = COALESCE(excluded.manual_at, manual_at)
+            """,
+            (vendor_key, category, 0 if manual else 1, int(manual), now, now if manual else None),
+        )
+    _db().execute(
+        "INSERT OR REPLACE INTO examples (text, category, weight, result_id, vendor_key) VALUES (?, ?, ?, ?, ?)",
+        (text, category, weight, result.id, vendor_key),
+    )
+    if _model_loaded:
+        _model.learn(_features(text), category, weight)
+
+
+def _forget_locked(example) -> None:
+    """Take back what an earlier example of the same result added to the memo count and the classifier."""
+    if example["weight"] != MANUAL_WEIGHT and example["vendor_key"]:
+        _db().execute(
+            "UPDATE vendor_memo SET count = MAX(count - 1, 0) WHERE vendor_key = ? AND category = ?",
+            (example["vendor_key"], example["category"]),
+        )
+    if _model_loaded:
+        _model.unlearn(_features(example["text"]), example["category"], example["weight"])
+
+
+def learn(results: list[ReceiptResult], manual: bool | None = None) -> int:
+    """
+    Record classified results in the memo and classifier, one example per result id.
+    With manual=None, each result's is_manually_edited flag decides its weight. Unedited results
+    are only learned from model answers: categories the local layer produced or the MISCELLANEOUS
+    default would otherwise reinforce themselves.
+    """
+    learned = 0
+    with _lock:
+        _ensure_model()
+        for result in results:
+            is_manual = result.is_manually_edited if manual is None else manual
+            if result.category is None or (not is_manual and result.category_source in ("local", "default")):
+                continue
+            _learn_locked(result, is_manual)
+            learned += 1
+    return learned
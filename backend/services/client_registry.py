@@ -0,0 +1,142 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+
+import anthropic
+import dropbox
+
+from config import settings
+
+# The HTTP package the SDK is built on: httpx in older releases, its httpx2 fork in newer ones.
+# The SDK rejects clients and transports from the other one, so pool objects come from here.
+sdk_httpx = sys.modules[anthropic.DefaultAsyncHttpxClient.__mro__[1].__module__.split(".")[0]]
+
+
+class ClientRegistry:
+    """
+    App-lifetime API clients. The Anthropic client shares one keep-alive httpx pool;
+    Dropbox clients are cached per access token (until dropbox_client_ttl) and share one requests session.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._http: sdk_httpx.AsyncClient | None = None
+        self._anthropic: anthropic.AsyncAnthropic | None = None
+        self._dropbox_session = None
+        self._dropbox_clients: dict[str, tuple[dropbox.Dropbox, float]] = {}
+        self._dropbox_factory: Callable[[str], dropbox.Dropbox] | None = None
+        self._counters: Counter = Counter()
+
+    def override(
+        self,
+        anthropic_client: anthropic.AsyncAnthropic | None = None,
+        dropbox_factory: Callable[[str], dropbox.Dropbox] | None = None,
+    ) -> None:
+        """Replace the real API clients, e.g. with the local stand-ins in fakes/."""
+        if anthropic_client is not None:
+            self._anthropic = anthropic_client
+        if dropbox_factory is not None:
+            self._dropbox_factory = dropbox_factory
+
+    def anthropic(self) -> anthropic.AsyncAnthropic:
+        if self._anthropic is None:
+            self._http = anthropic.DefaultAsyncHttpxClient(
+                limits=sdk_httpx.Limits(
+                    max_connections=settings.anthropic_max_connections,
+                    max_keepalive_connections=settings.anthropic_max_keepalive_connections,
+                ),
+                timeout=sdk_httpx.Timeout(settings.anthropic_timeout, connect=10.0),
+                event_hooks={"request": [self._trace_request]},
+            )
+            self._anthropic = anthropic.AsyncAnthropic(
+                api_key=settings.anthropic_api_key,
+                base_url=settings.anthropic_base_url,
+                http_client=self._http,
+                # Retries are handled by the shared scheduler in services.rate_limiter
+                max_retries=0,
+            )
+        return self._anthropic
+
+    async def _trace_request(self, request: sdk_httpx.Request) -> None:
+        self._counters["anthropic_requests"] += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        # httpcore reports a TCP connect only when no pooled connection could be reused
+        if event_name == "connection.connect_tcp.complete":
+            self._counters["anthropic_connections_opened"] += 1
+
+    def dropbox(self, access_token: str) -> dropbox.Dropbox:
+        if self._dropbox_factory is not None:
+            return self._dropbox_factory(access_token)
+        key = hashlib.sha256(access_token.encode()).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            if self._dropbox_session is None:
+                self._dropbox_session = dropbox.create_session(max_connections=settings.dropbox_max_connections)
+            cached = self._dropbox_clients.get(key)
+            if cached and cached[1] > now:
+                self._counters["dropbox_client_hits"] += 1
+                return cached[0]
+
+            self._counters["dropbox_clients_created"] += 1
+            client = dropbox.Dropbox(
+                access_token,
+                session=self._dropbox_session,
+                timeout=settings.dropbox_timeout,
+            )
+            self._dropbox_clients[key] = (client, now + settings.dropbox_client_ttl)
+            # Drop expired tokens so the cache stays bounded by active sessions
+            for k in [k for k, (_, expires) in self._dropbox_clients.items() if expires <= now]:
+                del self._dropbox_clients[k]
+            return client
+
+    def _dropbox_pool_stats(self) -> tuple[int, int]:
+        """(connections opened, requests sent) across the shared requests session's urllib3 pools."""
+        if self._dropbox_session is None:
+            return 0, 0
+        connections = requests_sent = 0
+        for adapter in self._dropbox_session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+        return connections, requests_sent
+
+    def metrics(self) -> dict:
+        anthropic_requests = self._counters["anthropic_requests"]
+        anthropic_connections = self._counters["anthropic_connections_opened"]
+        dropbox_connections, dropbox_requests = self._dropbox_pool_stats()
+        return {
+            "anthropic_requests": anthropic_requests,
+            "anthropic_connections_opened": anthropic_connections,
+            "anthropic_connection_reuse": max(0, anthropic_requests - anthropic_connections),
+            "dropbox_clients_cached": len(self._dropbox_clients),
+            "dropbox_clients_created": self._counters["dropbox_clients_created"],
+            "dropbox_client_hits": self._counters["dropbox_client_hits"],
+            "dropbox_requests": dropbox_requests,
+            "dropbox_connections_opened": dropbox_connections,
+            "dropbox_connection_reuse": max(0, dropbox_requests - dropbox_connections),
+        }
+
+    def start(self) -> None:
+        self.anthropic()
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+        self._http = None
+        self._anthropic = None
+        with self._lock:
+            self._dropbox_clients.clear()
+            if self._dropbox_session is not None:
+                self._dropbox_session.close()
+            self._dropbox_session = None
+
+
+registry = ClientRegistry()
@@ -1,61 +1,99 @@
 import csv
 import io
+from collections.abc import Iterable, Iterator
 
-from models.receipt import ReceiptResult
+from models.receipt import CategoryTotal, ReceiptResult
 
+HEADER = [
+    "No.",
+    "ファイル名",
+    "日付",
+    "会社名・店名",
+    "品目・但し書き",
+    "金額（税込）",
+    "消費税額",
+    "勘定科目",
+    "分類理由",
+    "信頼度",
+    "手動修正",
+]
 
-def generate_csv(results: list[ReceiptResult]) -> bytes:
-    """Generate CSV content encoded in CP932 (Shift-JIS) for Japanese Excel compatibility."""
+# Encoded output is handed out in chunks of about this size
+CHUNK_SIZE = 64 * 1024
+
+
+class CategoryTotals:
+    """Per-category count and amount, accumulated one result at a time."""
+
+    def __init__(self) -> None:
+        self._totals: dict = {}
+
+    def add(self, r: ReceiptResult) -> None:
+        if r.category and r.amount is not None:
+            count, total = self._totals.get(r.category, (0, 0))
+            self._totals[r.category] = (count + 1, total + r.amount)
+
+    def totals(self) -> list[CategoryTotal]:
+        return [
+            CategoryTotal(category=category, count=count, total_amount=total)
+            for category, (count, total) in sorted(self._totals.items(), key=lambda item: item[0].value)
+        ]
+
+    @property
+    def grand_total(self) -> int:
+        return sum(total for _, total in self._totals.values())
+
+
+def row_values(i: int, r: ReceiptResult) -> list:
+    """One detail row, in HEADER order."""
+    return [
+        i,
+        r.file_name,
+        r.date or "",
+        r.company_name or "",
+        r.description or "",
+        r.amount if r.amount is not None else "",
+        r.tax_amount if r.tax_amount is not None else "",
+        r.category.value if r.category else "",
+        r.category_reason or "",
+        f"{r.confidence:.0%}" if r.confidence is not None else "",
+        "○" if r.is_manually_edited else "",
+    ]
+
+
+def iter_csv(results: Iterable[ReceiptResult]) -> Iterator[bytes]:
+    """
+    Generate CSV content encoded in CP932 (Shift-JIS) for Japanese Excel compatibility, chunk by chunk.
+    Results are consumed one at a time and category totals kept incrementally, so memory stays flat.
+    """
     output = io.StringIO()
     writer = csv.writer(output)
 
-    # Header row
-    writer.writerow([
-        "No.",
-        "ファイル名",
-        "日付",
-        "会社名・店名",
-        "品目・但し書き",
-        "金額（税込）",
-        "消費税額",
-        "勘定科目",
-        "分類理由",
-        "信頼度",
-        "手動修正",
-    ])
+    def flush() -> bytes:
+        data = output.getvalue()
+        output.seek(0)
+        output.truncate()
+        return data.encode("cp932", errors="replace")
 
+    writer.writerow(HEADER)
+    totals = CategoryTotals()
     for i, r in enumerate(results, 1):
-        writer.writerow([
-            i,
-            r.file_name,
-            r.date or "",
-            r.company_name or "",
-            r.description or "",
-            r.amount if r.amount is not None else "",
-            r.tax_amount if r.tax_amount is not None else "",
-            r.category.value if r.category else "",
-            r.category_reason or "",
-            f"{r.confidence:.0%}" if r.confidence is not None else "",
-            "○" if r.is_manually_edited else "",
-        ])
+        writer.writerow(row_values(i, r))
+        totals.add(r)
+        if output.tell() >= CHUNK_SIZE:
+            yield flush()
 
     # Category summary section
     writer.writerow([])
     writer.writerow(["勘定科目別集計"])
     writer.writerow(["勘定科目", "件数", "合計金額"])
+    for t in totals.totals():
+        writer.writerow([t.category.value, t.count, t.total_amount])
+    writer.writerow(["合計", "", totals.grand_total])
 
-    category_totals: dict[str, tuple[int, int]] = {}
-    for r in results:
-        if r.category and r.amount is not None:
-            cat = r.category.value
-            count, total = category_totals.get(cat, (0, 0))
-            category_totals[cat] = (count + 1, total + r.amount)
-
-    grand_total = 0
-    for cat, (count, total) in sorted(category_totals.items()):
-        writer.writerow([cat, count, total])
-        grand_total += total
+    yield flush()
 
-    writer.writerow(["合計", "", grand_total])
 
-    return output.getvalue().encode("cp932", errors="replace")
+def generate_csv(results: Iterable[ReceiptResult]) -> bytes:
+    """Generate the whole CSV in memory (see iter_csv for the streaming version)."""
+    return b"".join(iter_csv(results))
@@ -1,12 +1,20 @@
+import asyncio
 import base64
 import hashlib
 import secrets
+import threading
+import time
+from collections.abc import Iterator
 
 import dropbox
-from dropbox.files import FileMetadata, FolderMetadata
+from dropbox.exceptions import ApiError
+from dropbox.files import DeletedMetadata, FileMetadata, FolderMetadata, ListFolderContinueError
 
 from config import settings
 from models.dropbox_models import DropboxFile
+from services.blob_cache import Blob, blob_cache
+from services.client_registry import registry
+from utils.sqlite_utils import connect
 
 # PKCE state storage (in-production, use Redis or DB)
 _pkce_store: dict[str, str] = {}
@@ -60,43 +68,268 @@ def exchange_code_for_token(code: str, state: str) -> str:
     return resp.json()["access_token"]
 
 
-def list_files(access_token: str, path: str) -> list[DropboxFile]:
-    """List image files in a Dropbox folder."""
-    dbx = dropbox.Dropbox(access_token)
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".pdf"}
+
+_cursor_lock = threading.Lock()
+_cursor_conn = None
+# Dropbox account id per access token (by SHA-256), so cursors are looked up without an API call each time
+_account_ids: dict[str, str] = {}
+
+
+def _normalize_path(path: str) -> str:
     # Dropbox API requires "" for root, not "/"
     if path == "/" or not path:
-        path = ""
-    result = dbx.files_list_folder(path)
+        return ""
+    return path
 
-    files: list[DropboxFile] = []
-    image_extensions = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".pdf"}
-
-    for entry in result.entries:
-        if isinstance(entry, FolderMetadata):
-            files.append(
-                DropboxFile(
-                    name=entry.name,
-                    path=entry.path_display or entry.path_lower or "",
-                    size=0,
-                    is_folder=True,
-                )
+
+def _to_dropbox_file(entry) -> DropboxFile | None:
+    """Convert a folder or image-file metadata entry; other entries are skipped."""
+    if isinstance(entry, FolderMetadata):
+        return DropboxFile(
+            name=entry.name,
+            path=entry.path_display or entry.path_lower or "",
+            size=0,
+            is_folder=True,
+        )
+    if isinstance(entry, FileMetadata):
+        ext = "." + entry.name.rsplit(".", 1)[-1].lower() if "." in entry.name else ""
+        if ext in IMAGE_EXTENSIONS:
+            return DropboxFile(
+                name=entry.name,
+                path=entry.path_display or entry.path_lower or "",
+                size=entry.size,
+                is_folder=False,
+                content_hash=entry.content_hash,
+                rev=entry.rev,
+                server_modified=entry.server_modified.isoformat() if entry.server_modified else None,
             )
-        elif isinstance(entry, FileMetadata):
-            ext = "." + entry.name.rsplit(".", 1)[-1].lower() if "." in entry.name else ""
-            if ext in image_extensions:
-                files.append(
-                    DropboxFile(
-                        name=entry.name,
-                        path=entry.path_display or entry.path_lower or "",
-                        size=entry.size,
-                        is_folder=False,
-                    )
-                )
+    return None
+
+
+def _collect(dbx: dropbox.Dropbox, result) -> tuple[list, str]:
+    """Follow has_more across all pages of a list_folder result. Returns (entries, final cursor)."""
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return entries, result.cursor
+
+
+def list_files(access_token: str, path: str, recursive: bool = False) -> list[DropboxFile]:
+    """List image files in a Dropbox folder (all pages; optionally including subfolders)."""
+    dbx = registry.dropbox(access_token)
+    entries, _ = _collect(dbx, dbx.files_list_folder(_normalize_path(path), recursive=recursive))
+
+    files: list[DropboxFile] = []
+    for entry in entries:
+        file = _to_dropbox_file(entry)
+        if file is not None:
+            files.append(file)
     return files
 
 
+def _cursor_db():
+    global _cursor_conn
+    if _cursor_conn is None:
+        _cursor_conn = connect("dropbox.sqlite3")
+        # Cursors from before they were keyed by account cannot be attributed to one; the next
+        # list_changes for each folder starts over with a full listing
+        _cursor_conn.execute("DROP TABLE IF EXISTS list_cursors")
+        _cursor_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS account_cursors (
+                account_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                recursive INTEGER NOT NULL,
+                cursor TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account_id, path, recursive)
+            )
+            """
+        )
+    return _cursor_conn
+
+
+def account_id(access_token: str) -> str:
+    """The Dropbox account an access token belongs to."""
+    key = hashlib.sha256(access_token.encode()).hexdigest()
+    with _cursor_lock:
+        cached = _account_ids.get(key)
+    if cached is not None:
+        return cached
+    account = registry.dropbox(access_token).users_get_current_account().account_id
+    with _cursor_lock:
+        _account_ids[key] = account
+    return account
+
+
+def get_cursor(access_token: str, path: str, recursive: bool) -> str | None:
+    key = (account_id(access_token), _normalize_path(path).lower(), int(recursive))
+    with _cursor_lock:
+        row = _cursor_db().execute(
+            "SELECT cursor FROM account_cursors WHERE account_id = ? AND path = ? AND recursive = ?", key
+        ).fetchone()
+    return row["cursor"] if row else None
+
+
+def save_cursor(access_token: str, path: str, recursive: bool, cursor: str | None) -> None:
+    """Store the account's cursor for a folder, or forget it when cursor is None."""
+    key = (account_id(access_token), _normalize_path(path).lower(), int(recursive))
+    with _cursor_lock:
+        if cursor is None:
+            _cursor_db().execute(
+                "DELETE FROM account_cursors WHERE account_id = ? AND path = ? AND recursive = ?", key
+            )
+        else:
+            _cursor_db().execute(
+                "INSERT OR REPLACE INTO account_cursors (account_id, path, recursive, cursor, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (*key, cursor, time.time()),
+            )
+
+
+def list_changes(access_token: str, path: str, recursive: bool = True) -> tuple[list[DropboxFile], list[str], str, bool]:
+    """
+    List what changed in a folder since the last call, using the cursor stored for the token's account.
+    The first call (or one after the cursor expired) returns a full listing.
+    Returns (added or modified entries, deleted paths, new cursor, is_full_listing).
+    """
+    files, deleted, cursor, is_full_listing = changes_since(
+        access_token, path, recursive, get_cursor(access_token, path, recursive)
+    )
+    save_cursor(access_token, path, recursive, cursor)
+    return files, deleted, cursor, is_full_listing
+
+
+def changes_since(
+    access_token: str, path: str, recursive: bool, cursor: str | None
+) -> tuple[list[DropboxFile], list[str], str, bool]:
+    """list_changes with the cursor passed in and returned instead of stored."""
+    dbx = registry.dropbox(access_token)
+    entries = None
+    if cursor:
+        try:
+            entries, cursor = _collect(dbx, dbx.files_list_folder_continue(cursor))
+        except ApiError as e:
+            if not (isinstance(e.error, ListFolderContinueError) and e.error.is_reset()):
+                raise
+    is_full_listing = entries is None
+    if is_full_listing:
+        entries, cursor = _collect(dbx, dbx.files_list_folder(_normalize_path(path), recursive=recursive))
+
+    files: list[DropboxFile] = []
+    deleted: list[str] = []
+    for entry in entries:
+        if isinstance(entry, DeletedMetadata):
+            deleted.append(entry.path_display or entry.path_lower or "")
+            continue
+        file = _to_dropbox_file(entry)
+        if file is not None:
+            files.append(file)
+
+    # Changed or deleted files must not be served from the session blob cache
+    for changed_path in [f.path for f in files if not f.is_folder] + deleted:
+        blob_cache.invalidate(access_token, changed_path)
+    return files, deleted, cursor, is_full_listing
+
+
+def latest_cursor(access_token: str, path: str, recursive: bool = True) -> str:
+    """A cursor for the folder as it is now, without listing it."""
+    dbx = registry.dropbox(access_token)
+    return dbx.files_list_folder_get_latest_cursor(_normalize_path(path), recursive=recursive).cursor
+
+
+def wait_for_changes(access_token: str, cursor: str, timeout: int) -> tuple[bool, float | None]:
+    """Block until the folder behind cursor changes or timeout seconds pass. Returns (changes, backoff seconds)."""
+    dbx = registry.dropbox(access_token)
+    result = dbx.files_list_folder_longpoll(cursor, timeout=timeout)
+    return result.changes, result.backoff
+
+
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+    "tiff": "image/tiff",
+    "pdf": "application/pdf",
+}
+
+
+def media_type_for(file_name: str) -> str:
+    ext = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    return MEDIA_TYPES.get(ext, "application/octet-stream")
+
+
+def get_file_metadata(access_token: str, file_path: str) -> FileMetadata:
+    """Current metadata of a file (name, size, rev, content_hash) without downloading it."""
+    metadata = registry.dropbox(access_token).files_get_metadata(file_path)
+    if not isinstance(metadata, FileMetadata):
+        raise ValueError(f"Not a file: {file_path}")
+    return metadata
+
+
+def download_blob(access_token: str, file_path: str) -> Blob:
+    """
+    Download a file with its metadata, served from the session blob cache when already fetched.
+    A cached blob is served only while its content_hash still matches the file in Dropbox.
+    """
+
+    def fetch() -> Blob:
+        dbx = registry.dropbox(access_token)
+        metadata, response = dbx.files_download(file_path)
+        return Blob(
+            data=response.content,
+            name=metadata.name,
+            media_type=media_type_for(metadata.name),
+            content_hash=metadata.content_hash,
+            rev=metadata.rev,
+        )
+
+    def unchanged(blob: Blob) -> bool:
+        metadata = get_file_metadata(access_token, file_path)
+        return (metadata.content_hash, metadata.rev) == (blob.content_hash, blob.rev)
+
+    return blob_cache.get_or_fetch(access_token, file_path, fetch, validate=unchanged)
+
+
+def iter_download(
+    access_token: str, metadata: FileMetadata, start: int, end: int, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Stream bytes start..end (inclusive) of a file as Dropbox sends them, pinned to metadata.rev.
+    A read of the whole file is kept in the session blob cache, so OCR after a preview does not download it again.
+    """
+    whole = start == 0 and end == metadata.size - 1
+    _, response = registry.dropbox(access_token).files_download(
+        metadata.path_lower, rev=metadata.rev, extra_headers=None if whole else {"Range": f"bytes={start}-{end}"}
+    )
+    data = bytearray() if whole and metadata.size <= settings.blob_cache_max_bytes else None
+    try:
+        for chunk in response.iter_content(chunk_size):
+            if data is not None:
+                data += chunk
+            yield chunk
+    finally:
+        response.close()
+    if data is not None and len(data) == metadata.size:
+        blob_cache.put(access_token, metadata.path_lower, Blob(
+            data=bytes(data),
+            name=metadata.name,
+            media_type=media_type_for(metadata.name),
+            content_hash=metadata.content_hash,
+            rev=metadata.rev,
+        ))
+
+
 def download_file(access_token: str, file_path: str) -> tuple[bytes, str]:
     """Download a file from Dropbox. Returns (file_bytes, file_name)."""
-    dbx = dropbox.Dropbox(access_token)
-    metadata, response = dbx.files_download(file_path)
-    return response.content, metadata.name
+    blob = download_blob(access_token, file_path)
+    return blob.data, blob.name
+
+
+async def download_file_async(access_token: str, file_path: str) -> tuple[bytes, str]:
+    """Download a file from Dropbox without blocking the event loop."""
+    return await asyncio.to_thread(download_file, access_token, file_path)
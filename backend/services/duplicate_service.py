@@ -0,0 +1,177 @@
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+
+from config import settings
+from models.receipt import ReceiptResult
+from services.category_service import normalize_vendor
+from utils.image_utils import DHASH_SIZE
+from utils.sqlite_utils import connect
+
+# The 256-bit hash is split into HASH_BANDS bands of 16 bits. Two hashes within
+# HASH_BANDS - 1 bits of each other share at least one band exactly (pigeonhole),
+# so candidates come from indexed equality lookups instead of a scan of every hash.
+HASH_BITS = DHASH_SIZE * DHASH_SIZE
+HASH_BANDS = 16
+BAND_BITS = HASH_BITS // HASH_BANDS
+# Vendor names on statement lines that say nothing about the shop
+GENERIC_VENDORS = {"", "不明", "物販", "チャージ", "その他"}
+
+_lock = threading.Lock()
+_conn = None
+
+
+@dataclass
+class ImageMatch:
+    file_path: str
+    file_name: str
+    distance: int
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("duplicates.sqlite3")
+        _conn.executescript(
+            f"""
+            -- 64-bit whole-image hashes from before receipt_hashes; not comparable with the new ones
+            DROP TABLE IF EXISTS image_hashes;
+            CREATE TABLE IF NOT EXISTS receipt_hashes (
+                file_path TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                {", ".join(f"band{i} INTEGER NOT NULL" for i in range(HASH_BANDS))},
+                created_at REAL NOT NULL
+            );
+            {"".join(f"CREATE INDEX IF NOT EXISTS idx_receipt_hashes_band{i} ON receipt_hashes (band{i});" for i in range(HASH_BANDS))}
+            CREATE TABLE IF NOT EXISTS receipt_keys (
+                file_path TEXT NOT NULL,
+                date TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                vendor_key TEXT NOT NULL,
+                first_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_receipt_keys_match ON receipt_keys (date, amount);
+            CREATE INDEX IF NOT EXISTS idx_receipt_keys_file ON receipt_keys (file_path);
+            """
+        )
+    return _conn
+
+
+def _bands(image_hash: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(image_hash >> (i * BAND_BITS)) & mask for i in range(HASH_BANDS)]
+
+
+def find_similar_image(image_hash: int, file_path: str) -> ImageMatch | None:
+    """
+    Closest image indexed before this file within settings.duplicate_hash_distance bits, if any.
+    A match is only a candidate (see confirm_image_match): receipts printed in the same layout hash alike.
+    """
+    if not settings.duplicate_detection_enabled:
+        return None
+    where = " OR ".join(f"band{i} = ?" for i in range(HASH_BANDS))
+    with _lock:
+        own = _db().execute("SELECT created_at FROM receipt_hashes WHERE file_path = ?", (file_path,)).fetchone()
+        rows = _db().execute(
+            f"SELECT file_path, file_name, hash FROM receipt_hashes"
+            f" WHERE ({where}) AND file_path != ? AND created_at < ?",
+            (*_bands(image_hash), file_path, own["created_at"] if own else time.time()),
+        ).fetchall()
+
+    best: ImageMatch | None = None
+    for row in rows:
+        distance = (int(row["hash"], 16) ^ image_hash).bit_count()
+        if distance <= settings.duplicate_hash_distance and (best is None or distance < best.distance):
+            best = ImageMatch(row["file_path"], row["file_name"], distance)
+    return best
+
+
+def register_image(image_hash: int, file_path: str, file_name: str) -> None:
+    if not settings.duplicate_detection_enabled:
+        return
+    columns = [f"band{i}" for i in range(HASH_BANDS)]
+    placeholders = ", ".join("?" for _ in columns)
+    # created_at is kept on update, so a file keeps its place as the earlier copy
+    updates = ", ".join(f"{column} = excluded.{column}" for column in ["file_name", "hash", *columns])
+    with _lock:
+        _db().execute(
+            f"INSERT INTO receipt_hashes (file_path, file_name, hash, {', '.join(columns)}, created_at)"
+            f" VALUES (?, ?, ?, {placeholders}, ?) ON CONFLICT (file_path) DO UPDATE SET {updates}",
+            (file_path, file_name, f"{image_hash:0{HASH_BITS // 4}x}", *_bands(image_hash), time.time()),
+        )
+
+
+def confirm_image_match(results: list[ReceiptResult], match: ImageMatch) -> list[ReceiptResult]:
+    """
+    Mark results as duplicates of a similar-looking image only when their extracted (date, amount)
+    also match a receipt indexed for that image's file; the vendor is not compared, since the image
+    already looks the same.
+    """
+    with _lock:
+        keys = {
+            (row["date"], row["amount"])
+            for row in _db().execute("SELECT date, amount FROM receipt_keys WHERE file_path = ?", (match.file_path,))
+        }
+    for result in results:
+        if (normalize_date(result.date), result.amount) in keys:
+            result.duplicate_of = match.file_path
+    return results
+
+
+def normalize_date(value: str | None) -> str | None:
+    if not value:
+        return None
+    match = re.match(r"(\d{4})\D(\d{1,2})\D(\d{1,2})", unicodedata.normalize("NFKC", value))
+    if not match:
+        return None
+    return f"{match.group(1)}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
+
+
+def _vendors_match(a: str, b: str) -> bool:
+    """Same shop, or at least one side (typically a Suica line) does not name one."""
+    if a in GENERIC_VENDORS or b in GENERIC_VENDORS:
+        return True
+    return a in b or b in a
+
+
+def flag_results(results: list[ReceiptResult], file_path: str) -> list[ReceiptResult]:
+    """
+    Mark results whose (date, amount, vendor) match a receipt from a file indexed earlier with duplicate_of,
+    then index this file's results (replacing what was indexed for it before). Only the later copy is
+    flagged, however often either file is processed again.
+    Lookups use the (date, amount) index, so the cost does not grow with the number of receipts.
+    """
+    if not settings.duplicate_detection_enabled:
+        return results
+
+    keys = []
+    with _lock:
+        (first_seen,) = _db().execute(
+            "SELECT MIN(first_seen) FROM receipt_keys WHERE file_path = ?", (file_path,)
+        ).fetchone()
+        first_seen = first_seen or time.time()
+        for result in results:
+            date = normalize_date(result.date)
+            if date is None or result.amount is None:
+                continue
+            vendor_key = normalize_vendor(result.company_name)
+            keys.append((file_path, date, result.amount, vendor_key, first_seen))
+            if result.duplicate_of:
+                continue
+            for row in _db().execute(
+                "SELECT file_path, vendor_key FROM receipt_keys"
+                " WHERE date = ? AND amount = ? AND file_path != ? AND first_seen < ?",
+                (date, result.amount, file_path, first_seen),
+            ):
+                if _vendors_match(vendor_key, row["vendor_key"]):
+                    result.duplicate_of = row["file_path"]
+                    break
+
+        _db().execute("DELETE FROM receipt_keys WHERE file_path = ?", (file_path,))
+        _db().executemany(
+            "INSERT INTO receipt_keys (file_path, date, amount, vendor_key, first_seen) VALUES (?, ?, ?, ?, ?)", keys
+        )
+    return results
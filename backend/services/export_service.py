@@ -0,0 +1,123 @@
+import json
+import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+from models.receipt import ReceiptResult
+from services.csv_service import CHUNK_SIZE, HEADER, CategoryTotals, iter_csv, row_values
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 5000
+# Exports larger than this are spooled to disk before streaming
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+@dataclass
+class Export:
+    chunks: Iterator[bytes]
+    media_type: str
+    file_name: str
+
+
+def export(results: Iterable[ReceiptResult], fmt: str = "csv") -> Export:
+    """
+    Export results as csv (CP932), jsonl, xlsx or parquet.
+    CSV and JSONL are generated while streaming; XLSX and Parquet are written to a spooled
+    temporary file first (both formats need the whole file before it can be read) and then streamed.
+    xlsx needs openpyxl and parquet needs pyarrow.
+    """
+    if fmt == "csv":
+        return Export(iter_csv(results), "text/csv; charset=shift_jis", "receipts.csv")
+    if fmt == "jsonl":
+        return Export(iter_jsonl(results), "application/x-ndjson", "receipts.jsonl")
+    if fmt == "xlsx":
+        return Export(
+            _read_chunks(write_xlsx(results)),
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            "receipts.xlsx",
+        )
+    if fmt == "parquet":
+        return Export(_read_chunks(write_parquet(results)), "application/vnd.apache.parquet", "receipts.parquet")
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def iter_jsonl(results: Iterable[ReceiptResult]) -> Iterator[bytes]:
+    lines: list[str] = []
+    size = 0
+    for r in results:
+        line = json.dumps(r.model_dump(mode="json"), ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(lines).encode()
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines).encode()
+
+
+def write_xlsx(results: Iterable[ReceiptResult]):
+    """Write 明細 and 勘定科目別集計 sheets with openpyxl's write-only (streaming) mode."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    details = workbook.create_sheet("明細")
+    details.append(HEADER)
+    totals = CategoryTotals()
+    for i, r in enumerate(results, 1):
+        details.append(row_values(i, r))
+        totals.add(r)
+
+    summary = workbook.create_sheet("勘定科目別集計")
+    summary.append(["勘定科目", "件数", "合計金額"])
+    for t in totals.totals():
+        summary.append([t.category.value, t.count, t.total_amount])
+    summary.append(["合計", None, totals.grand_total])
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    workbook.save(output)
+    return output
+
+
+def write_parquet(results: Iterable[ReceiptResult]):
+    """Write results as Parquet, one row group per PARQUET_ROW_GROUP_SIZE results."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("file_name", pa.string()),
+        ("file_path", pa.string()),
+        ("date", pa.string()),
+        ("company_name", pa.string()),
+        ("description", pa.string()),
+        ("amount", pa.int64()),
+        ("tax_amount", pa.int64()),
+        ("category", pa.string()),
+        ("category_reason", pa.string()),
+        ("confidence", pa.float64()),
+        ("error", pa.string()),
+        ("is_manually_edited", pa.bool_()),
+        ("duplicate_of", pa.string()),
+    ])
+
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    with pq.ParquetWriter(output, schema) as writer:
+        rows: list[dict] = []
+        for r in results:
+            row = r.model_dump(mode="json", include=set(schema.names))
+            rows.append(row)
+            if len(rows) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+    return output
+
+
+def _read_chunks(file) -> Iterator[bytes]:
+    try:
+        file.seek(0)
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections.abc import AsyncIterator, Iterator
+
+from models.job_models import Job, JobFile
+from models.receipt import ReceiptResult
+from services import category_service, usage_metrics
+from services.pipeline_service import file_name_from_path, iter_file_events
+from utils import image_utils
+from utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+# Seconds between job status checks while an event stream waits for new events
+STREAM_RECHECK_INTERVAL = 15.0
+ACTIVE_STATUSES = ("running",)
+
+_lock = threading.Lock()
+_conn = None
+_runners: dict[str, asyncio.Task] = {}
+_signals: dict[str, asyncio.Event] = {}
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("jobs.sqlite3")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                error TEXT,
+                total INTEGER NOT NULL,
+                concurrency INTEGER,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id TEXT NOT NULL,
+                file_index INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                results TEXT,
+                error TEXT,
+                usage TEXT,
+                PRIMARY KEY (job_id, file_index)
+            );
+            CREATE TABLE IF NOT EXISTS job_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id);
+            """
+        )
+    return _conn
+
+
+def _execute(sql: str, params: tuple = ()) -> list:
+    with _lock:
+        return _db().execute(sql, params).fetchall()
+
+
+def _append_event(job_id: str, event: str, data: dict) -> None:
+    _execute(
+        "INSERT INTO job_events (job_id, event, data) VALUES (?, ?, ?)",
+        (job_id, event, json.dumps(data, ensure_ascii=False)),
+    )
+    # Wake every stream waiting on this job; the next waiter gets a fresh Event
+    signal = _signals.pop(job_id, None)
+    if signal is not None:
+        signal.set()
+
+
+def _set_status(job_id: str, status: str, error: str | None = None) -> None:
+    _execute(
+        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+        (status, error, time.time(), job_id),
+    )
+
+
+def create_job(access_token: str, file_paths: list[str], concurrency: int | None = None) -> str:
+    """Persist a job for file_paths and start processing it in the background."""
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    _execute(
+        "INSERT INTO jobs (id, status, total, concurrency, created_at, updated_at) VALUES (?, 'running', ?, ?, ?, ?)",
+        (job_id, len(file_paths), concurrency, now, now),
+    )
+    with _lock:
+        _db().executemany(
+            "INSERT INTO job_files (job_id, file_index, file_path, file_name, status) VALUES (?, ?, ?, ?, 'pending')",
+            [(job_id, index, path, file_name_from_path(path)) for index, path in enumerate(file_paths)],
+        )
+    _append_event(job_id, "job", {"job_id": job_id, "total": len(file_paths)})
+    _start_runner(job_id, access_token)
+    return job_id
+
+
+def _start_runner(job_id: str, access_token: str) -> None:
+    task = asyncio.create_task(_run(job_id, access_token))
+    _runners[job_id] = task
+
+    def forget(done: asyncio.Task) -> None:
+        if _runners.get(job_id) is done:
+            del _runners[job_id]
+
+    task.add_done_callback(forget)
+
+
+def _counts(job_id: str) -> dict[str, int]:
+    rows = _execute("SELECT status, COUNT(*) AS n FROM job_files WHERE job_id = ? GROUP BY status", (job_id,))
+    return {row["status"]: row["n"] for row in rows}
+
+
+async def _run(job_id: str, access_token: str) -> None:
+    (job,) = _execute("SELECT total, concurrency FROM jobs WHERE id = ?", (job_id,))
+    files = [
+        (row["file_index"], row["file_path"])
+        for row in _execute(
+            "SELECT file_index, file_path FROM job_files WHERE job_id = ? AND status = 'pending' ORDER BY file_index",
+            (job_id,),
+        )
+    ]
+    counts = _counts(job_id)
+    completed = counts.get("done", 0) + counts.get("error", 0)
+    classification = category_service.start_stats()
+    preprocess = image_utils.start_timings()
+    usage = usage_metrics.start_batch()
+
+    def finish(status: str, error: str | None = None) -> None:
+        # Anything still marked running was interrupted and will be picked up again on resume
+        _execute(
+            "UPDATE job_files SET status = 'pending' WHERE job_id = ? AND status = 'running'", (job_id,)
+        )
+        _append_event(job_id, "done", {
+            "job_id": job_id,
+            "status": status,
+            "total": job["total"],
+            "classification": classification.as_dict(),
+            "preprocess_ms": {stage: round(seconds * 1000, 1) for stage, seconds in preprocess.items()},
+            "usage": usage.as_dict(),
+        })
+        _set_status(job_id, status, error)
+
+    try:
+        async for event in iter_file_events(access_token, files, job["concurrency"]):
+            if event.kind == "started":
+                _execute(
+                    "UPDATE job_files SET status = 'running' WHERE job_id = ? AND file_index = ?",
+                    (job_id, event.index),
+                )
+                _append_event(job_id, "progress", {
+                    "completed": completed, "total": job["total"],
+                    "current_file": event.file_name, "index": event.index,
+                })
+                continue
+
+            completed += 1
+            _execute(
+                "UPDATE job_files SET usage = ? WHERE job_id = ? AND file_index = ?",
+                (json.dumps(event.usage), job_id, event.index),
+            )
+            if event.error is not None:
+                _execute(
+                    "UPDATE job_files SET status = 'error', results = NULL, error = ? WHERE job_id = ? AND file_index = ?",
+                    (event.error, job_id, event.index),
+                )
+                _append_event(job_id, "error", {"index": event.index, "file_name": event.file_name, "error": event.error})
+            else:
+                _execute(
+                    "UPDATE job_files SET status = 'done', results = ?, error = NULL WHERE job_id = ? AND file_index = ?",
+                    (_dump(event.results), job_id, event.index),
+                )
+                for result in event.results:
+                    _append_event(job_id, "result", {**result.model_dump(mode="json"), "index": event.index})
+            _execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+    except asyncio.CancelledError:
+        finish("canceled")
+        raise
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        finish("failed", str(e))
+        return
+    finish("completed")
+
+
+async def cancel_job(job_id: str) -> bool:
+    task = _runners.get(job_id)
+    if task is None or task.done():
+        return False
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return True
+
+
+def resume_job(job_id: str, access_token: str, retry_errors: bool = False) -> bool:
+    """Continue a stopped job with its pending files (and failed ones when retry_errors is set)."""
+    rows = _execute("SELECT status FROM jobs WHERE id = ?", (job_id,))
+    if not rows or rows[0]["status"] in ACTIVE_STATUSES:
+        return False
+    if retry_errors:
+        _execute(
+            "UPDATE job_files SET status = 'pending', error = NULL WHERE job_id = ? AND status = 'error'", (job_id,)
+        )
+    _set_status(job_id, "running")
+    _start_runner(job_id, access_token)
+    return True
+
+
+def recover_jobs() -> None:
+    """Mark jobs left running by a previous process as interrupted (called from lifespan)."""
+    # Resuming needs the user's access token, which is never persisted
+    for row in _execute("SELECT id FROM jobs WHERE status = 'running'"):
+        _execute(
+            "UPDATE job_files SET status = 'pending' WHERE job_id = ? AND status = 'running'", (row["id"],)
+        )
+        _append_event(row["id"], "done", {"job_id": row["id"], "status": "interrupted"})
+        _set_status(row["id"], "interrupted", "Server restarted while the job was running")
+
+
+def get_job(job_id: str) -> Job | None:
+    rows = _execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    if not rows:
+        return None
+    job = rows[0]
+    counts = _counts(job_id)
+    return Job(
+        id=job["id"],
+        status=job["status"],
+        error=job["error"],
+        total=job["total"],
+        pending=counts.get("pending", 0) + counts.get("running", 0),
+        done=counts.get("done", 0),
+        errors=counts.get("error", 0),
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
+
+
+def get_files(job_id: str) -> list[JobFile]:
+    rows = _execute(
+        "SELECT file_index, file_path, file_name, status, error, usage FROM job_files WHERE job_id = ? ORDER BY file_index",
+        (job_id,),
+    )
+    return [
+        JobFile(
+            index=row["file_index"],
+            file_path=row["file_path"],
+            file_name=row["file_name"],
+            status=row["status"],
+            error=row["error"],
+            usage=json.loads(row["usage"]) if row["usage"] else None,
+        )
+        for row in rows
+    ]
+
+
+def get_results(job_id: str) -> list[ReceiptResult]:
+    return list(iter_results(job_id))
+
+
+def iter_results(job_id: str, page_size: int = 200) -> Iterator[ReceiptResult]:
+    """Stored results in file order, read page by page so memory does not grow with the job size."""
+    last_index = -1
+    while True:
+        rows = _execute(
+            "SELECT file_index, results FROM job_files WHERE job_id = ? AND status = 'done' AND file_index > ?"
+            " ORDER BY file_index LIMIT ?",
+            (job_id, last_index, page_size),
+        )
+        if not rows:
+            return
+        for row in rows:
+            yield from _load(row["results"])
+        last_index = rows[-1]["file_index"]
+
+
+async def stream_events(job_id: str, last_event_id: int = 0) -> AsyncIterator[dict]:
+    """
+    SSE events for a job after last_event_id: stored events are replayed, then new ones are
+    tailed until the job stops running. Each event's id is its row id, for Last-Event-ID.
+    """
+    while True:
+        signal = _signals.setdefault(job_id, asyncio.Event())
+        # Read the status first: the final event is always stored before the status changes
+        status_rows = _execute("SELECT status FROM jobs WHERE id = ?", (job_id,))
+        rows = _execute(
+            "SELECT id, event, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, last_event_id)
+        )
+        for row in rows:
+            last_event_id = row["id"]
+            yield {"id": str(row["id"]), "event": row["event"], "data": row["data"]}
+        if not status_rows or status_rows[0]["status"] not in ACTIVE_STATUSES:
+            return
+        try:
+            await asyncio.wait_for(signal.wait(), STREAM_RECHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _dump(results: list[ReceiptResult]) -> str:
+    return json.dumps([r.model_dump(mode="json") for r in results], ensure_ascii=False)
+
+
+def _load(payload: str) -> list[ReceiptResult]:
+    return [ReceiptResult.model_validate(data) for data in json.loads(payload)]
@@ -1,86 +1,379 @@
+import asyncio
 import json
 import re
 import uuid
+from collections import Counter
+from datetime import date
+from collections.abc import AsyncIterable
 
 import anthropic
+from pydantic import BaseModel
 
 from config import settings
+from models.extraction_models import (
+    CategoryAnswer,
+    CategoryAnswers,
+    ReceiptExtraction,
+    ReceiptExtractionWithCategory,
+    SuicaTransactions,
+)
 from models.receipt import AccountingCategory, ReceiptResult
-from utils.image_utils import prepare_image_base64
-
-EXTRACTION_PROMPT = """この画像は日本の領収書です。以下の情報をJSON形式で抽出してください。
-
-注意事項:
+from services import category_service, usage_metrics
+from services.client_registry import registry
+from services.rate_limiter import estimate_text_tokens, scheduler
+from services.structured_output import StructuredOutputError, parse_output, tool_for, tool_params
+from utils.image_utils import TEXT_MEDIA_TYPE
+from utils.layout_utils import TableBand
+
+# Consumption tax included in a total: 8/108 at the reduced rate, 10/110 at the standard rate
+TAX_RATIO_MIN = 8 / 108
+TAX_RATIO_MAX = 10 / 110
+TAX_ROUNDING_YEN = 2
+
+# One limit for the calls a single file fans out (receipts of a multi-receipt PDF, Suica table bands),
+# shared across files: pipeline workers already run files in parallel, so a semaphore per file would
+# allow up to workers x ocr_concurrency calls at once
+_fanout_limit: asyncio.Semaphore | None = None
+
+# Static material shared by the extraction and classification prompts. It sits in the system block with the
+# instructions, so together with the tool schema it forms one prefix per call kind that is long enough for the
+# API to cache (see _system).
+CATEGORY_GUIDE = """勘定科目の判定基準:
+- 交通費: 日常業務での近距離の移動。電車・地下鉄・バスの運賃、タクシー代、時間貸し駐車場、高速道路料金（ETC含む）、ガソリン代、交通系ICカードへのチャージ
+- 旅費交通費: 出張に伴う移動と宿泊。新幹線・特急・飛行機のチケット、ホテル・旅館の宿泊費、出張先でのレンタカー、出張日当。宿泊を伴う、または遠方への移動は交通費ではなく旅費交通費
+- 消耗品費: 取得価額10万円未満または使用可能期間1年未満の備品・日用品。パソコン周辺機器（マウス、キーボード、ケーブル、USBメモリ）、家具、電池、電球、洗剤、ティッシュ、作業用品、ソフトウェアのパッケージ
+- 事務用品費: 事務作業で使う文房具と紙類。ボールペン、ノート、ファイル、コピー用紙、プリンターのインク・トナー、封筒、付箋、印鑑、ゴム印。文房具店・100円ショップでの文房具の購入もここ
+- 接待交際費: 取引先・顧客との飲食や贈答。会食（1人あたり1万円を超えるもの）、手土産、お中元・お歳暮、祝い金・香典・供花、ゴルフ接待。居酒屋・料亭・レストランで取引先と利用したもの
+- 会議費: 打合せ・会議に伴う飲食と場所代。1人あたり1万円以下の打合せ中の飲食、喫茶店での打合せ、会議用の弁当・お茶・茶菓子、貸会議室の利用料
+- 通信費: 情報の伝達にかかる費用。携帯電話・固定電話の料金、インターネット回線、切手・はがき、郵便料金、宅配便・レターパックの送料、サーバー・ドメイン費用
+- 地代家賃: 継続して借りている場所の賃料。事務所・店舗の家賃、月極駐車場、レンタルオフィス・コワーキングスペースの月額利用料、倉庫・トランクルーム
+- 水道光熱費: 電気・ガス・水道の料金、灯油・プロパンガスの購入
+- 新聞図書費: 情報収集のための書籍・刊行物。書籍、雑誌、新聞の購読料、電子書籍、地図、有料のニュースサイト・データベースの購読
+- 広告宣伝費: 不特定多数に向けた宣伝。Web広告・SNS広告、チラシ・ポスター・パンフレットの印刷、看板、展示会の出展料、ノベルティ・販促品、名刺の印刷
+- 保険料: 事業用の保険。火災保険、自動車保険（任意保険）、賠償責任保険、店舗総合保険。自賠責保険は自動車の保有に伴う保険として保険料
+- 修繕費: 資産を元の状態に戻すための支出。パソコン・機械・車両の修理、事務所の補修、定期メンテナンス、部品交換、原状回復工事
+- 租税公課: 税金と公的な手数料。収入印紙、自動車税・自動車重量税、固定資産税、登録免許税、住民票・印鑑証明書・登記事項証明書などの発行手数料、パスポート申請手数料
+- 外注費: 業務の一部を外部の個人・会社に委託した報酬。デザイン・イラスト・翻訳・記事執筆・システム開発の委託料、クラウドソーシングの支払い、配送や清掃の業務委託
+- 福利厚生費: 従業員全員を対象とした支出。健康診断、社員旅行・忘年会などの社内行事、慶弔見舞金、常備薬、職場で飲むお茶・コーヒー、制服
+- 雑費: 上記のどれにも当てはまらない、少額で頻度の低い支出。振込手数料、クリーニング代、ゴミ処理券など
+
+判断が分かれる場合の目安:
+- 同じ店でも品目で判断する。コンビニ・スーパーで文房具なら事務用品費、電池や日用品なら消耗品費、弁当・飲み物は打合せ用なら会議費
+- 郵便局では、切手・はがき・送料は通信費、収入印紙は租税公課
+- 駐車場は、時間貸し（コインパーキング）なら交通費、月極なら地代家賃
+- 飲食店は人数と金額で判断する。1人あたり1万円以下の打合せは会議費、それを超える会食や取引先の接待は接待交際費
+- 新幹線・飛行機・ホテルは旅費交通費、近距離の電車・バス・タクシーは交通費
+- Amazonや家電量販店などの通販・量販店は購入した品目で判断する（書籍なら新聞図書費、文房具なら事務用品費、機器類なら消耗品費）
+- 品目が読み取れず店名からも判断できない場合は推測せず、判断できないものとして扱う"""
+
+VENDOR_HINTS = """よく見る発行元と通常の勘定科目（品目が明らかに別の科目の場合は品目を優先）:
+- JR東日本・JR東海・JR西日本（在来線の運賃、近距離の切符）→ 交通費
+- JR東海・JR西日本・JR九州（新幹線の特急券・乗車券、えきねっと・スマートEX）→ 旅費交通費
+- 東京メトロ・都営地下鉄・大阪メトロ・名古屋市交通局（地下鉄運賃）→ 交通費
+- 東急電鉄・小田急電鉄・京王電鉄・西武鉄道・東武鉄道・京急電鉄・阪急電鉄（私鉄運賃）→ 交通費
+- 都営バス・京王バス・神奈中バス・西鉄バス（路線バス）→ 交通費
+- 高速バス・夜行バス（ウィラー、バスタ新宿発の長距離路線）→ 旅費交通費
+- 日本交通・国際自動車・大和自動車交通・GO・S.RIDE・DiDi（タクシー）→ 交通費
+- タイムズ・三井のリパーク・名鉄協商・NPC24H（時間貸し駐車場）→ 交通費
+- NEXCO東日本・NEXCO中日本・NEXCO西日本・首都高速道路・阪神高速（通行料金）→ 交通費
+- ENEOS・出光・apollostation・コスモ石油・宇佐美（ガソリン・軽油）→ 交通費
+- タイムズカー・オリックスレンタカー・トヨタレンタカー・ニッポンレンタカー（出張先での利用）→ 旅費交通費
+- ANA・JAL・ピーチ・ジェットスター・スカイマーク（航空券）→ 旅費交通費
+- 東横イン・アパホテル・ルートイン・ドーミーイン・スーパーホテル・じゃらん・楽天トラベル（宿泊）→ 旅費交通費
+- ヨドバシカメラ・ビックカメラ・ケーズデンキ・エディオン・ヤマダデンキ（家電・PC周辺機器）→ 消耗品費
+- ニトリ・IKEA・無印良品（机・椅子・収納などの備品）→ 消耗品費
+- カインズ・コーナン・DCM・コメリ（工具・作業用品・日用品）→ 消耗品費
+- モノタロウ（工具・作業用品・部品）→ 消耗品費
+- マツモトキヨシ・ウエルシア・ツルハドラッグ・スギ薬局（洗剤・ティッシュなどの日用品）→ 消耗品費（常備薬は福利厚生費）
+- アスクル・カウネット・たのめーる（オフィス用品の通販）→ 事務用品費
+- 伊東屋・ロフト・東急ハンズ（文房具）→ 事務用品費
+- ダイソー・セリア・キャンドゥ（100円ショップ）→ 品目で判断（文房具は事務用品費、日用品は消耗品費）
+- セブン-イレブン・ファミリーマート・ローソン（コンビニ）→ 品目で判断（文房具は事務用品費、打合せの飲み物は会議費、切手は通信費、収入印紙は租税公課）
+- スターバックス・ドトール・タリーズ・コメダ珈琲店・ルノアール（喫茶店での打合せ）→ 会議費
+- 貸会議室・スペースマーケット・TKP（会議室の利用）→ 会議費
+- 料亭・割烹・高級レストラン・寿司店（取引先との会食）→ 接待交際費
+- 居酒屋・焼肉店（人数と金額で判断。1人あたり1万円以下の打合せは会議費、それを超える会食は接待交際費）
+- 高島屋・三越・伊勢丹・大丸・松坂屋（御中元・御歳暮・手土産）→ 接待交際費
+- 花キューブ・日比谷花壇（供花・祝い花）→ 接待交際費
+- NTTドコモ・au（KDDI）・ソフトバンク・楽天モバイル・ワイモバイル（携帯電話料金）→ 通信費
+- NTT東日本・NTT西日本・フレッツ光・ソフトバンク光（固定電話・インターネット回線）→ 通信費
+- さくらインターネット・エックスサーバー・お名前.com・AWS・Google Cloud（サーバー・ドメイン）→ 通信費
+- 日本郵便・郵便局（切手・はがき・ゆうパック・レターパック）→ 通信費（収入印紙は租税公課）
+- ヤマト運輸・佐川急便・西濃運輸・福山通運（宅配便・送料）→ 通信費
+- 東京電力・関西電力・中部電力・九州電力・各地の新電力（電気料金）→ 水道光熱費
+- 東京ガス・大阪ガス・東邦ガス・各地のプロパンガス販売店（ガス料金）→ 水道光熱費
+- 各市区町村の水道局（上下水道料金）→ 水道光熱費
+- 紀伊國屋書店・丸善・ジュンク堂書店・TSUTAYA・有隣堂（書籍・雑誌）→ 新聞図書費
+- 日本経済新聞社・朝日新聞社・読売新聞社（新聞・電子版の購読）→ 新聞図書費
+- Kindle・楽天Kobo（電子書籍）→ 新聞図書費
+- Google広告・Meta広告・Yahoo!広告・LINEヤフー（Web広告）→ 広告宣伝費
+- ラクスル・プリントパック・グラフィック（チラシ・名刺・パンフレットの印刷）→ 広告宣伝費
+- 損害保険ジャパン・東京海上日動・三井住友海上・あいおいニッセイ同和損保（損害保険・自動車保険）→ 保険料
+- オートバックス・イエローハット（車両の点検・修理・部品交換）→ 修繕費（カー用品の購入は消耗品費）
+- パソコン修理店・家電の修理受付・スマートフォン修理店（修理代）→ 修繕費
+- 法務局（登記事項証明書・印鑑証明書）→ 租税公課
+- 市役所・区役所・町村役場（住民票・印鑑登録証明書・納税証明書）→ 租税公課
+- 都道府県税事務所・自動車税の納付書 → 租税公課
+- ランサーズ・クラウドワークス・ココナラ（業務委託の報酬）→ 外注費
+- 税理士事務所・社会保険労務士事務所（顧問料・申告代行）→ 外注費
+- 健診センター・クリニック（従業員の健康診断）→ 福利厚生費
+- ウォーターサーバー・オフィスコーヒー（職場の飲料）→ 福利厚生費
+- 銀行・信用金庫（振込手数料）→ 雑費
+- クリーニング店（制服以外のクリーニング）→ 雑費"""
+
+_EXTRACTION_NOTES = """注意事項:
 - 「様」の前に書かれている名前は宛名であり、会社名・店名ではありません
 - 会社名・店名は領収書の発行元（下部や印鑑の近く）を確認してください
 - 金額は税込み総額を抽出してください
 - 手書きの領収書にも対応してください
 - 日付は注文確定日または商品購入日をYYYY-MM-DD形式に変換してください。発行日や印刷日ではなく、実際に注文・購入した日付を優先してください
-- 品目・但し書きがない場合はnullとしてください
+- 品目・但し書きがない場合はnullとしてください"""
+
+_EXTRACTION_EXAMPLES = [
+    (
+        """手書きの領収書。上部に「山田太郎 様」、金額欄に「¥5,500-」、但し書きに「お品代として」、
+日付欄に「令和7年4月3日」、下部に「有限会社 森田文具店」の社判と「内消費税額 500円」の記載。""",
+        {"company_name": "有限会社 森田文具店", "amount": 5500, "tax_amount": 500, "date": "2025-04-03",
+         "description": "お品代", "category": "事務用品費", "category_reason": "文具店での購入のため", "confidence": 0.85},
+    ),
+    (
+        """ネット通販の領収書。「注文日 2025年3月28日」「発行日 2025年4月10日」、宛名「株式会社サンプル 御中」、
+品目「USBケーブル 2本」「ワイヤレスマウス」、ご請求額「¥4,378（うち消費税 ¥398）」、発行元「アマゾンジャパン合同会社」。""",
+        {"company_name": "アマゾンジャパン合同会社", "amount": 4378, "tax_amount": 398, "date": "2025-03-28",
+         "description": "USBケーブル、ワイヤレスマウス", "category": "消耗品費", "category_reason": "パソコン周辺機器の購入のため",
+         "confidence": 0.9},
+    ),
+    (
+        """レシート。「カフェ・ド・モリ 渋谷店」、2025/04/15 14:32、ブレンドコーヒー 2点 ¥1,100、
+合計 ¥1,100（10%対象 ¥1,100 内消費税 ¥100）、但し書きなし。""",
+        {"company_name": "カフェ・ド・モリ 渋谷店", "amount": 1100, "tax_amount": 100, "date": "2025-04-15",
+         "description": "ブレンドコーヒー 2点", "category": "会議費", "category_reason": "喫茶店での少額の飲食で、打合せと考えられるため",
+         "confidence": 0.75},
+    ),
+    (
+        """郵便局の領収証書。2025年5月7日、「収入印紙 200円 ×5」「切手 110円 ×10」、合計 2,100円、非課税・不課税の表示あり。""",
+        {"company_name": "日本郵便株式会社", "amount": 2100, "tax_amount": None, "date": "2025-05-07",
+         "description": "収入印紙、切手", "category": "租税公課", "category_reason": "金額の大部分が収入印紙のため",
+         "confidence": 0.7},
+    ),
+    (
+        """タクシーの領収書（印字）。「日本交通株式会社」「乗車日 2025/06/02 23:48」「降車日 2025/06/03 00:12」、
+運賃 ¥3,400、迎車料金 ¥300、合計 ¥3,700、宛名欄は空白。""",
+        {"company_name": "日本交通株式会社", "amount": 3700, "tax_amount": None, "date": "2025-06-02",
+         "description": "タクシー運賃", "category": "交通費", "category_reason": "タクシーでの近距離の移動のため",
+         "confidence": 0.9},
+    ),
+]
+
+
+def _extraction_examples(with_category: bool) -> str:
+    """Worked examples in the tool's output format (without the category fields for the two-step path)."""
+    parts = ["抽出例（画像の内容を文章で示したもの）:"]
+    for n, (receipt, answer) in enumerate(_EXTRACTION_EXAMPLES, 1):
+        if not with_category:
+            answer = {k: v for k, v in answer.items() if k not in ("category", "category_reason")}
+        parts.append(f"例{n}: {receipt}\n出力: {json.dumps(answer, ensure_ascii=False)}")
+    return "\n\n".join(parts)
+
 
-出力JSON形式:
-{
-  "company_name": "会社名・店名 または null",
-  "amount": 税込金額(整数) または null,
-  "tax_amount": 消費税額(整数) または null,
-  "date": "YYYY-MM-DD" または null,
-  "description": "品目・但し書き または null",
-  "confidence": 0.0〜1.0の信頼度
-}
+EXTRACTION_PROMPT = f"""この画像は日本の領収書です。以下の情報を抽出してください。
 
-JSONのみを出力してください。"""
+{_EXTRACTION_NOTES}
 
-SUICA_EXTRACTION_PROMPT = """この画像はモバイルSuicaの利用明細です。
-表に記載されている全ての取引（利用履歴）を1件ずつJSON配列で抽出してください。
+{_extraction_examples(with_category=False)}"""
 
-注意事項:
+SUICA_NOTES = """注意事項:
 - 「入金・利用金額」列の金額を各取引のamountとして抽出してください
 - 月日はYYYY-MM-DD形式に変換してください（年は明細の期間情報から判断）
 - 種別・利用場所からdescriptionを生成してください（例: "JR東日本 渋谷→新宿"、"物販 コンビニ"）
 - 会社名は利用場所や種別から判断してください（例: "JR東日本"、"バス"等）
-- チャージ（入金）の行も含めてください。その場合descriptionは"チャージ"としてください
+- チャージ（入金）の行も含めてください。その場合descriptionは"チャージ"としてください"""
+
+SUICA_EXAMPLES = """抽出例:
+明細の期間「2025年04月01日～2025年04月30日」、表の行:
+「04 01 入 渋谷 出 新宿 ¥4,822 -178」
+「04 02 入 表参道 出 大手町 ¥4,642 -180」
+「04 03 物販 ¥4,102 -540」
+「04 05 現金 チャージ ¥7,102 +3,000」
+「04 07 バス 都営 ¥6,892 -210」
+「04 10 入 東京 出 品川 ¥6,722 -170」
+出力: [
+{"company_name": "JR東日本", "amount": 178, "balance": 4822, "tax_amount": null, "date": "2025-04-01", "description": "JR東日本 渋谷→新宿", "confidence": 0.95},
+{"company_name": "東京メトロ", "amount": 180, "balance": 4642, "tax_amount": null, "date": "2025-04-02", "description": "東京メトロ 表参道→大手町", "confidence": 0.9},
+{"company_name": "コンビニ", "amount": 540, "balance": 4102, "tax_amount": null, "date": "2025-04-03", "description": "物販 コンビニ", "confidence": 0.85},
+{"company_name": "モバイルSuica", "amount": 3000, "balance": 7102, "tax_amount": null, "date": "2025-04-05", "description": "チャージ", "confidence": 0.95},
+{"company_name": "都営バス", "amount": 210, "balance": 6892, "tax_amount": null, "date": "2025-04-07", "description": "バス 都営", "confidence": 0.9},
+{"company_name": "JR東日本", "amount": 170, "balance": 6722, "tax_amount": null, "date": "2025-04-10", "description": "JR東日本 東京→品川", "confidence": 0.95}
+]
+- 駅名の組み合わせから事業者を判断してください（地下鉄の駅同士なら東京メトロ・都営地下鉄、JRの駅同士ならJR東日本）
+- 残高は直前の行の残高から利用金額を引いた（チャージなら足した）値になります。読み取った金額がこれと合わない場合は、数字を読み直してください"""
+
+SUICA_EXTRACTION_PROMPT = f"""この画像はモバイルSuicaの利用明細です。
+表に記載されている全ての取引（利用履歴）を1件ずつ抽出してください。
+
+{SUICA_NOTES}
 - 全ページの全行を漏れなく抽出してください
 
-出力JSON形式:
-[
-  {
-    "company_name": "会社名・利用先",
-    "amount": 利用金額(整数),
-    "tax_amount": null,
-    "date": "YYYY-MM-DD",
-    "description": "種別・利用区間の説明",
-    "confidence": 0.0〜1.0の信頼度
-  }
-]
+{SUICA_EXAMPLES}"""
+
+SUICA_BAND_PROMPT = f"""最後の画像はモバイルSuicaの利用明細の表を、上から順に横長の帯に切り分けたうちの1枚です。
+画像が2枚ある場合、1枚目は明細の見出し部分（タイトル・期間）です。
+帯に写っている取引（利用履歴）を上から順に1件ずつ抽出してください。
+
+{SUICA_NOTES}
+- 表の列は月日・種別・利用場所・残高・入金・利用金額です（帯によっては列名の行がありません）
+- 「残高」列の金額をbalanceとして抽出してください
+- 年は見出しの期間情報から判断してください
+- 帯の上端・下端で切れて金額が読み取れない行は含めないでください（隣の帯に含まれています）
 
-JSON配列のみを出力してください。"""
+{SUICA_EXAMPLES}"""
 
-CATEGORY_PROMPT_TEMPLATE = """以下の領収書情報から、最適な勘定科目を1つ選んでください。
+CATEGORY_CHOICES = """勘定科目の選択肢:
+交通費, 消耗品費, 接待交際費, 通信費, 地代家賃, 水道光熱費, 新聞図書費, 広告宣伝費, 保険料, 修繕費, 租税公課, 外注費, 福利厚生費, 事務用品費, 旅費交通費, 会議費, 雑費"""
 
-領収書情報:
+CATEGORY_EXAMPLES = """分類例:
+- ENEOS / 6,200円 / レギュラーガソリン → 交通費（業務用車両の燃料のため）
+- 東横イン 大阪駅前 / 8,800円 / 宿泊料 → 旅費交通費（出張の宿泊のため）
+- ヨドバシカメラ / 12,980円 / 外付けSSD → 消耗品費（10万円未満のパソコン周辺機器のため）
+- 東京電力エナジーパートナー / 9,430円 / 電気料金 → 水道光熱費（電気料金のため）
+- 紀伊國屋書店 / 3,080円 / 書籍 → 新聞図書費（業務用の書籍のため）
+- 株式会社デザインラボ / 110,000円 / ロゴ制作 → 外注費（デザイン制作の委託のため）
+- 高島屋 / 5,400円 / 御中元 → 接待交際費（取引先への贈答のため）
+- 法務局 / 600円 / 登記事項証明書 → 租税公課（証明書の発行手数料のため）
+- 三井のリパーク / 900円 / 駐車料金 → 交通費（時間貸し駐車場のため）
+- ヤマト運輸 / 1,060円 / 宅急便 → 通信費（送料のため）
+- スターバックス / 1,540円 / ドリンク 3点 → 会議費（喫茶店での打合せのため）
+- 銀座 鮨 さかい / 48,000円 / お食事代 4名 → 接待交際費（1人あたり1万円を超える会食のため）
+- 鳥貴族 / 12,000円 / 飲食代 3名 → 会議費（1人あたり1万円以下の飲食のため）
+- JR東海 / 14,720円 / 新幹線 東京→新大阪 → 旅費交通費（出張での新幹線利用のため）
+- 東京メトロ / 210円 / 運賃 → 交通費（近距離の移動のため）
+- アスクル / 3,520円 / コピー用紙 A4 5冊 → 事務用品費（コピー用紙の購入のため）
+- ダイソー / 330円 / 乾電池 → 消耗品費（日用品の購入のため）
+- 日本郵便 / 4,000円 / 収入印紙 → 租税公課（収入印紙の購入のため）
+- NTTドコモ / 7,150円 / ご利用料金 → 通信費（携帯電話料金のため）
+- 不明 / 880円 / 不明 → 判断できない（会社名・品目から判断できないため）"""
+
+CATEGORY_PROMPT = f"""与えられた領収書情報から、最適な勘定科目を1つ選んでください。
+
+{CATEGORY_CHOICES}
+
+{CATEGORY_GUIDE}
+
+{VENDOR_HINTS}
+
+{CATEGORY_EXAMPLES}"""
+
+CATEGORY_FIELDS_TEMPLATE = """領収書情報:
 - 会社名: {company_name}
 - 金額: {amount}円
-- 品目: {description}
+- 品目: {description}"""
+
+EXTRACTION_WITH_CATEGORY_PROMPT = f"""この画像は日本の領収書です。以下の情報を抽出し、最適な勘定科目を1つ選んでください。
+
+{_EXTRACTION_NOTES}
+- 勘定科目は会社名・品目・金額から判断し、判断できない場合はnullとしてください
+
+{CATEGORY_CHOICES}
+
+{CATEGORY_GUIDE}
+
+{VENDOR_HINTS}
+
+{_extraction_examples(with_category=True)}"""
 
-勘定科目の選択肢:
-交通費, 消耗品費, 接待交際費, 通信費, 地代家賃, 水道光熱費, 新聞図書費, 広告宣伝費, 保険料, 修繕費, 租税公課, 外注費, 福利厚生費, 事務用品費, 旅費交通費, 会議費, 雑費
+CATEGORY_BATCH_PROMPT = f"""与えられた取引一覧について、取引ごとに最適な勘定科目を1つずつ選んでください。
 
-出力JSON形式:
-{{"category": "勘定科目名", "reason": "分類理由"}}
+{CATEGORY_CHOICES}
 
-JSONのみを出力してください。"""
+{CATEGORY_GUIDE}
 
+{VENDOR_HINTS}
 
-def _extract_json(text: str) -> dict:
-    """Extract JSON from text that may contain markdown code blocks."""
-    text = text.strip()
-    if text.startswith("```"):
-        lines = text.split("\n")
-        lines = lines[1:]  # Remove opening ```json or ```
-        if lines and lines[-1].strip() == "```":
-            lines = lines[:-1]
-        text = "\n".join(lines)
-    return json.loads(text)
+{CATEGORY_EXAMPLES}"""
+
+CATEGORY_BATCH_TEMPLATE = """取引一覧（番号: 会社名 / 金額 / 品目）:
+{transactions}"""
+
+
+def _fanout() -> asyncio.Semaphore:
+    global _fanout_limit
+    if _fanout_limit is None:
+        _fanout_limit = asyncio.Semaphore(settings.ocr_concurrency)
+    return _fanout_limit
+
+
+def _system(prompt: str, model: str, output_model: type[BaseModel]) -> list[dict]:
+    """
+    Static instructions as a system block. Tools and system come before the messages, so with the
+    block marked as a cache breakpoint every call of the same kind reuses the cached prefix and
+    only the images or fields in the message are processed anew. The breakpoint is only set when
+    tools and instructions reach the model's minimum cacheable length; below it the API caches nothing.
+    """
+    block = {"type": "text", "text": prompt}
+    prefix = json.dumps([tool_for(output_model)], ensure_ascii=False) + prompt
+    if settings.prompt_caching_enabled and estimate_text_tokens(prefix) >= usage_metrics.cache_min_tokens(model):
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+
+def fast_model() -> str:
+    """Model for first-pass receipt extraction and for classification; the main model when routing is off."""
+    if settings.model_routing_enabled and settings.anthropic_fast_model:
+        return settings.anthropic_fast_model
+    return settings.anthropic_model
+
+
+def escalation_reason(extracted: ReceiptExtraction) -> str | None:
+    """Why an extraction should be redone with the main model, or None when it passes the local checks."""
+    if extracted.amount is None:
+        return "missing_amount"
+    try:
+        date.fromisoformat(extracted.date or "")
+    except ValueError:
+        return "missing_date"
+    if extracted.confidence is None or extracted.confidence < settings.escalation_confidence:
+        return "low_confidence"
+    if extracted.tax_amount:
+        low = extracted.amount * TAX_RATIO_MIN - TAX_ROUNDING_YEN
+        high = extracted.amount * TAX_RATIO_MAX + TAX_ROUNDING_YEN
+        if not low <= extracted.tax_amount <= high:
+            return "tax_mismatch"
+    return None
+
+
+def _extraction_model() -> type[ReceiptExtraction]:
+    return ReceiptExtractionWithCategory if settings.single_call_extraction else ReceiptExtraction
+
+
+def route_prompt(kind: str) -> str:
+    """Prompt text and output schemas that determine the output of a processing route (part of the OCR cache key)."""
+    if kind == "suica":
+        category_prompts = CATEGORY_BATCH_PROMPT + CATEGORY_BATCH_TEMPLATE if settings.single_call_extraction else ""
+        band_prompt = SUICA_BAND_PROMPT if settings.suica_tiling_enabled else ""
+        prompt = SUICA_EXTRACTION_PROMPT + band_prompt + category_prompts + CATEGORY_PROMPT + CATEGORY_FIELDS_TEMPLATE
+        schemas = [SuicaTransactions, CategoryAnswers, CategoryAnswer]
+    elif settings.single_call_extraction:
+        prompt = EXTRACTION_WITH_CATEGORY_PROMPT + CATEGORY_PROMPT + CATEGORY_FIELDS_TEMPLATE
+        schemas = [ReceiptExtractionWithCategory, CategoryAnswer]
+    else:
+        prompt = EXTRACTION_PROMPT + CATEGORY_PROMPT + CATEGORY_FIELDS_TEMPLATE
+        schemas = [ReceiptExtraction, CategoryAnswer]
+    return prompt + json.dumps([tool_for(schema) for schema in schemas], ensure_ascii=False, sort_keys=True)
+
+
+async def _create_structured(client: anthropic.AsyncAnthropic, purpose: str, params: dict, output_model):
+    """
+    One model call answered through output_model's tool, parsed with local repair. A response that
+    cannot be read at all is requested again (up to settings.structured_output_retries times).
+    """
+    for attempt in range(settings.structured_output_retries + 1):
+        response = await scheduler.create_message(client, purpose=purpose, **params)
+        try:
+            return parse_output(response, output_model, purpose)
+        except StructuredOutputError:
+            if attempt == settings.structured_output_retries:
+                raise
+            usage_metrics.record_output(purpose, "retried")
 
 
 def is_suica_statement(file_name: str) -> bool:
@@ -97,37 +390,113 @@ def is_multi_receipt_pdf(file_name: str) -> bool:
     return bool(re.match(r"\d{4}-\d{2}-\d{2} \d{2}\.\d{2}\.\d{2}\.pdf$", file_name))
 
 
-async def _classify_category(client: anthropic.Anthropic, extracted: dict) -> tuple[AccountingCategory | None, str | None]:
+# (category, reason, source) with source as in ReceiptResult.category_source
+Classification = tuple[AccountingCategory | None, str | None, str | None]
+
+
+def _local_classification(extracted: dict, record_stats: bool = True) -> Classification | None:
+    local = category_service.classify_local(extracted, record_stats)
+    return (*local, "local") if local is not None else None
+
+
+async def _classify_category(client: anthropic.AsyncAnthropic, extracted: dict) -> Classification:
     """Classify receipt into accounting category."""
     if not extracted.get("company_name") and not extracted.get("description"):
-        return None, None
+        return None, None, None
 
-    category_prompt = CATEGORY_PROMPT_TEMPLATE.format(
+    local = _local_classification(extracted)
+    if local is not None:
+        return local
+
+    category_fields = CATEGORY_FIELDS_TEMPLATE.format(
         company_name=extracted.get("company_name") or "不明",
         amount=extracted.get("amount") or "不明",
         description=extracted.get("description") or "不明",
     )
 
-    category_response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=256,
-        messages=[{"role": "user", "content": category_prompt}],
+    answer = await _create_structured(
+        client,
+        "category",
+        {
+            "model": fast_model(),
+            "max_tokens": 256,
+            "system": _system(CATEGORY_PROMPT, fast_model(), CategoryAnswer),
+            "messages": [{"role": "user", "content": category_fields}],
+            **tool_params(CategoryAnswer),
+        },
+        CategoryAnswer,
     )
 
-    cat_data = _extract_json(category_response.content[0].text)
+    category_service.record_model_call()
+    if answer.category is None:
+        return AccountingCategory.MISCELLANEOUS, answer.reason, "default"
+    return answer.category, answer.reason, "model"
+
+
+def _parse_category(value) -> AccountingCategory | None:
     try:
-        category = AccountingCategory(cat_data["category"])
-    except (ValueError, KeyError):
-        category = AccountingCategory.MISCELLANEOUS
-    return category, cat_data.get("reason")
+        return AccountingCategory(value)
+    except ValueError:
+        return None
 
 
-async def process_receipt(image_data: list[tuple[str, str]], file_name: str, file_path: str) -> ReceiptResult:
-    """Process a single receipt image through extraction and classification."""
-    client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
+def _needs_category_fallback(extracted: dict, category: AccountingCategory | None) -> bool:
+    """Whether a single-call result should be re-classified with the dedicated category prompt."""
+    if category is None:
+        return True
+    confidence = extracted.get("confidence")
+    return confidence is not None and confidence < settings.category_fallback_confidence
+
 
+async def _classify_categories_batch(client: anthropic.AsyncAnthropic, transactions: list[dict]) -> list[Classification]:
+    """
+    Classify many transactions with at most one model call: the local layer answers what it can,
+    the rest go into a single batched prompt, with a per-item fallback when an answer is missing.
+    """
+    classified: list[Classification | None] = [_local_classification(tx) for tx in transactions]
+    unresolved = [i for i, c in enumerate(classified) if c is None]
+    if not unresolved:
+        return classified
+
+    lines = [
+        f"{n}: {tx.get('company_name') or '不明'} / {tx.get('amount') or '不明'}円 / {tx.get('description') or '不明'}"
+        for n, tx in enumerate(transactions[i] for i in unresolved)
+    ]
+    category_response = await scheduler.create_message(
+        client,
+        purpose="category_batch",
+        model=fast_model(),
+        max_tokens=max(256, 64 * len(unresolved)),
+        system=_system(CATEGORY_BATCH_PROMPT, fast_model(), CategoryAnswers),
+        messages=[{"role": "user", "content": CATEGORY_BATCH_TEMPLATE.format(transactions="\n".join(lines))}],
+        **tool_params(CategoryAnswers),
+    )
+    category_service.record_model_call()
+
+    answers: dict[int, CategoryAnswer] = {}
+    try:
+        answers = {item.index: item for item in parse_output(category_response, CategoryAnswers, "category_batch").answers}
+    except StructuredOutputError:
+        # Unreadable answers are not retried as a whole: each transaction falls back to its own call
+        pass
+
+    for n, i in enumerate(unresolved):
+        answer = answers.get(n)
+        category = answer.category if answer else None
+        if _needs_category_fallback(transactions[i], category):
+            classified[i] = await _classify_category(client, transactions[i])
+        else:
+            classified[i] = (category, answer.reason, "model")
+    return classified
+
+
+def _image_content(image_data: list[tuple[str, str]]) -> list[dict]:
+    """Content blocks for (base64_data, media_type) images and (text, TEXT_MEDIA_TYPE) PDF text layers."""
     content = []
     for b64_data, media_type in image_data:
+        if media_type == TEXT_MEDIA_TYPE:
+            content.append({"type": "text", "text": f"PDFのテキスト:\n{b64_data}"})
+            continue
         content.append({
             "type": "image",
             "source": {
@@ -136,16 +505,69 @@ async def process_receipt(image_data: list[tuple[str, str]], file_name: str, fil
                 "data": b64_data,
             },
         })
-    content.append({"type": "text", "text": EXTRACTION_PROMPT})
+    return content
 
-    extraction_response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1024,
-        messages=[{"role": "user", "content": content}],
-    )
 
-    extracted = _extract_json(extraction_response.content[0].text)
-    category, category_reason = await _classify_category(client, extracted)
+def build_receipt_request(image_data: list[tuple[str, str]], model: str | None = None) -> dict:
+    """
+    messages.create parameters for extracting one receipt (also used for Message Batches requests).
+    model defaults to the main model.
+    """
+    prompt = EXTRACTION_WITH_CATEGORY_PROMPT if settings.single_call_extraction else EXTRACTION_PROMPT
+    model = model or settings.anthropic_model
+    return {
+        "model": model,
+        "max_tokens": 1024,
+        "system": _system(prompt, model, _extraction_model()),
+        "messages": [{"role": "user", "content": _image_content(image_data)}],
+        **tool_params(_extraction_model()),
+    }
+
+
+def build_suica_request(image_data: list[tuple[str, str]]) -> dict:
+    """messages.create parameters for extracting all transactions of a Suica statement."""
+    return {
+        "model": settings.anthropic_model,
+        "max_tokens": 4096,
+        "system": _system(SUICA_EXTRACTION_PROMPT, settings.anthropic_model, SuicaTransactions),
+        "messages": [{"role": "user", "content": _image_content(image_data)}],
+        **tool_params(SuicaTransactions),
+    }
+
+
+def build_suica_band_request(band: TableBand) -> dict:
+    """messages.create parameters for extracting the transactions in one band of a Suica statement table."""
+    content = _image_content([band.header, band.image] if band.header else [band.image])
+    return {
+        "model": settings.anthropic_model,
+        "max_tokens": 4096,
+        "system": _system(SUICA_BAND_PROMPT, settings.anthropic_model, SuicaTransactions),
+        "messages": [{"role": "user", "content": content}],
+        **tool_params(SuicaTransactions),
+    }
+
+
+async def receipt_from_response(client: anthropic.AsyncAnthropic, response, file_name: str, file_path: str) -> ReceiptResult:
+    """Build a ReceiptResult from an extraction response, classifying separately when needed."""
+    extracted = parse_output(response, _extraction_model(), "extraction")
+    return await receipt_from_extraction(client, extracted, file_name, file_path)
+
+
+async def receipt_from_extraction(
+    client: anthropic.AsyncAnthropic, extraction: ReceiptExtraction, file_name: str, file_path: str
+) -> ReceiptResult:
+    extracted = extraction.model_dump()
+    category = _parse_category(extracted.get("category"))
+    category_reason = extracted.get("category_reason")
+    category_source = "model" if category is not None else None
+    # The single call already answered, so no call is saved here, but a vendor the user has corrected
+    # (or that the local layer knows well) keeps its learned category
+    local = _local_classification(extracted, record_stats=False) if settings.single_call_extraction else None
+    if local is not None:
+        category, category_reason, category_source = local
+    elif not settings.single_call_extraction or _needs_category_fallback(extracted, category):
+        # Two-step path: dedicated classification call
+        category, category_reason, category_source = await _classify_category(client, extracted)
 
     return ReceiptResult(
         id=str(uuid.uuid4()),
@@ -158,39 +580,25 @@ async def process_receipt(image_data: list[tuple[str, str]], file_name: str, fil
         description=extracted.get("description"),
         category=category,
         category_reason=category_reason,
+        category_source=category_source,
         confidence=extracted.get("confidence"),
     )
 
 
-async def process_suica_statement(image_data: list[tuple[str, str]], file_name: str, file_path: str) -> list[ReceiptResult]:
-    """Process a Mobile Suica statement PDF, extracting all transactions."""
-    client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
-
-    content = []
-    for b64_data, media_type in image_data:
-        content.append({
-            "type": "image",
-            "source": {
-                "type": "base64",
-                "media_type": media_type,
-                "data": b64_data,
-            },
-        })
-    content.append({"type": "text", "text": SUICA_EXTRACTION_PROMPT})
+async def suica_results_from_response(client: anthropic.AsyncAnthropic, response, file_name: str, file_path: str) -> list[ReceiptResult]:
+    """Build one ReceiptResult per transaction from a Suica extraction response."""
+    transactions = parse_output(response, SuicaTransactions, "suica").transactions
+    return await _suica_results(client, [tx.model_dump() for tx in transactions], file_name, file_path)
 
-    extraction_response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        messages=[{"role": "user", "content": content}],
-    )
 
-    transactions = _extract_json(extraction_response.content[0].text)
-    if not isinstance(transactions, list):
-        transactions = [transactions]
+async def _suica_results(client: anthropic.AsyncAnthropic, transactions: list[dict], file_name: str, file_path: str) -> list[ReceiptResult]:
+    if settings.single_call_extraction and transactions:
+        categories = await _classify_categories_batch(client, transactions)
+    else:
+        categories = [await _classify_category(client, tx) for tx in transactions]
 
     results: list[ReceiptResult] = []
-    for i, tx in enumerate(transactions):
-        category, category_reason = await _classify_category(client, tx)
+    for i, (tx, (category, category_reason, category_source)) in enumerate(zip(transactions, categories)):
         amount = tx.get("amount")
         if amount is not None:
             amount = abs(int(amount))
@@ -205,16 +613,120 @@ async def process_suica_statement(image_data: list[tuple[str, str]], file_name:
             description=tx.get("description"),
             category=category,
             category_reason=category_reason,
+            category_source=category_source,
             confidence=tx.get("confidence"),
         ))
     return results
 
 
-async def process_multi_receipt_pdf(image_pages: list[tuple[str, str]], file_name: str, file_path: str) -> list[ReceiptResult]:
-    """Process a PDF with multiple receipts, one per page."""
-    results: list[ReceiptResult] = []
-    for i, (b64_data, media_type) in enumerate(image_pages):
-        page_label = f"{file_name} (p{i + 1})"
-        result = await process_receipt([(b64_data, media_type)], page_label, file_path)
-        results.append(result)
-    return results
+def _row_key(tx: dict) -> tuple:
+    amount = tx.get("amount")
+    if isinstance(amount, (int, float)):
+        amount = abs(int(amount))
+    return tx.get("date"), amount, tx.get("balance")
+
+
+def merge_band_rows(bands: list[TableBand], band_rows: list[list[dict]]) -> list[dict]:
+    """
+    Concatenate the transactions of each band in table order. Leading rows of a band that repeat
+    the previous band's last rows (the overlap) are dropped; the running balance makes repeated
+    fares on the same day distinguishable.
+    """
+    merged: list[dict] = []
+    previous: list[dict] = []
+    previous_page = None
+    for band, rows in zip(bands, band_rows):
+        skip = 0
+        if band.page == previous_page and band.overlap_rows:
+            # One extra row of slack for a row the cut left in both bands
+            tail = Counter(_row_key(tx) for tx in previous[-(band.overlap_rows + 1):])
+            for tx in rows:
+                key = _row_key(tx)
+                if not tail[key]:
+                    break
+                tail[key] -= 1
+                skip += 1
+        merged += rows[skip:]
+        previous, previous_page = rows, band.page
+    return merged
+
+
+async def process_receipt(image_data: list[tuple[str, str]], file_name: str, file_path: str) -> ReceiptResult:
+    """
+    Process a single receipt image through extraction and classification. With model routing the fast
+    model reads it first, and the main model only redoes receipts that fail escalation_reason.
+    """
+    client = registry.anthropic()
+    model = fast_model()
+    extracted = None
+    if model != settings.anthropic_model:
+        try:
+            extracted = await _create_structured(client, "extraction", build_receipt_request(image_data, model), _extraction_model())
+            reason = escalation_reason(extracted)
+        except StructuredOutputError:
+            reason = "unreadable"
+        usage_metrics.record_route("extraction", reason)
+        if reason is not None:
+            extracted = None
+    if extracted is None:
+        extracted = await _create_structured(client, "extraction", build_receipt_request(image_data), _extraction_model())
+    return await receipt_from_extraction(client, extracted, file_name, file_path)
+
+
+async def process_suica_statement(image_data: list[tuple[str, str]], file_name: str, file_path: str) -> list[ReceiptResult]:
+    """Process a Mobile Suica statement PDF, extracting all transactions."""
+    client = registry.anthropic()
+    extracted = await _create_structured(client, "suica", build_suica_request(image_data), SuicaTransactions)
+    return await _suica_results(client, [tx.model_dump() for tx in extracted.transactions], file_name, file_path)
+
+
+async def process_suica_bands(bands: list[TableBand], file_name: str, file_path: str) -> list[ReceiptResult]:
+    """Process a Mobile Suica statement cut into table bands: one call per band in parallel, rows merged in order."""
+    client = registry.anthropic()
+
+    async def extract(band: TableBand) -> list[dict]:
+        async with _fanout():
+            extracted = await _create_structured(client, "suica_band", build_suica_band_request(band), SuicaTransactions)
+        return [tx.model_dump() for tx in extracted.transactions]
+
+    tasks = [asyncio.create_task(extract(band)) for band in bands]
+    try:
+        band_rows = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return await _suica_results(client, merge_band_rows(bands, band_rows), file_name, file_path)
+
+
+async def process_multi_receipt_pdf(
+    image_groups: AsyncIterable[list[tuple[str, str]]] | list[list[tuple[str, str]]],
+    file_name: str,
+    file_path: str,
+    page_numbers: list[list[int]] | None = None,
+) -> list[ReceiptResult]:
+    """
+    Process a PDF with multiple receipts, one model call per receipt (a group of one or more pages).
+    image_groups may be an async iterator, so extraction of the first receipt starts while later pages are still rendering.
+    page_numbers gives each group's 1-based pages for the result labels; by default group i is page i + 1.
+    """
+    def label(i: int) -> str:
+        pages = page_numbers[i] if page_numbers else [i + 1]
+        return f"{file_name} (p{pages[0]})" if len(pages) == 1 else f"{file_name} (p{pages[0]}-{pages[-1]})"
+
+    async def process_group(i: int, images: list[tuple[str, str]]) -> ReceiptResult:
+        async with _fanout():
+            return await process_receipt(images, label(i), file_path)
+
+    tasks: list[asyncio.Task] = []
+    try:
+        if isinstance(image_groups, list):
+            tasks = [asyncio.create_task(process_group(i, images)) for i, images in enumerate(image_groups)]
+        else:
+            async for images in image_groups:
+                tasks.append(asyncio.create_task(process_group(len(tasks), images)))
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,190 @@
+import asyncio
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from config import settings
+from models.receipt import ReceiptResult
+from services import cache_service, category_service, duplicate_service, results_store, routing_service, usage_metrics
+from services.dropbox_service import download_file_async
+from services.ocr_service import process_multi_receipt_pdf, process_receipt, process_suica_bands, process_suica_statement
+from services.routing_service import RoutePlan
+from utils.image_utils import aiter_pdf_page_parts, pdf_text_layer, prepare_image_with_hash_async, run_in_image_pool
+from utils.layout_utils import tile_pdf_tables
+
+
+def file_name_from_path(file_path: str) -> str:
+    return file_path.rsplit("/", 1)[-1] if "/" in file_path else file_path
+
+
+def is_pdf(file_name: str) -> bool:
+    return file_name.lower().endswith(".pdf")
+
+
+def _all_text(texts: list[str], pages: list[int] | None) -> bool:
+    """Every page to be sent has a text layer."""
+    return bool(texts) and all(page <= len(texts) and texts[page - 1] for page in pages or range(1, len(texts) + 1))
+
+
+async def _aiter_page_groups(
+    file_bytes: bytes, groups: list[list[int]] | None, texts: list[str], stats: dict[str, int]
+) -> AsyncIterator[list[tuple[str, str]]]:
+    """
+    Content parts of a PDF's pages (text layer or rendered image), one list per group; only the pages
+    in groups are prepared. With groups=None every page is its own group.
+    """
+    if groups is None:
+        async for parts in aiter_pdf_page_parts(file_bytes, texts, stats=stats):
+            yield parts
+        return
+    pages = aiter_pdf_page_parts(file_bytes, texts, [page for group in groups for page in group], stats)
+    for group in groups:
+        yield [part for _ in group for part in await anext(pages)]
+
+
+async def process_file(access_token: str, file_path: str, kind: str | None = None) -> list[ReceiptResult]:
+    """
+    Download, route and extract one Dropbox file, serving unchanged files from the OCR cache.
+    Unless kind is forced, the route and page grouping come from local layout analysis.
+    The results are kept in results_store; a file edited there by hand returns the edited results.
+    """
+    file_bytes, file_name = await download_file_async(access_token, file_path)
+    digest = cache_service.content_hash(file_bytes)
+    plan = RoutePlan(kind, None, "requested") if kind else await routing_service.plan_route(file_bytes, file_name, digest)
+    kind = plan.kind
+
+    cache_key = cache_service.make_key(digest, kind)
+    cached = await asyncio.to_thread(cache_service.get, cache_key, file_name, file_path)
+    if cached is not None:
+        return await asyncio.to_thread(_save_results, file_path, cached)
+
+    image_match = None
+    # Digital PDFs are sent as their text layer; only scanned pages are rendered as images
+    texts = plan.texts
+    if texts is None:
+        texts = await run_in_image_pool(pdf_text_layer, file_bytes) if is_pdf(file_name) else []
+    text_stats: dict[str, int] = {}
+    if kind == "multi" and is_pdf(file_name):
+        # Multi-receipt PDF: one model call per receipt, pages prepared lazily and processed as they arrive
+        results = await process_multi_receipt_pdf(
+            _aiter_page_groups(file_bytes, plan.groups, texts, text_stats), file_name, file_path, plan.groups
+        )
+    elif kind == "suica" and is_pdf(file_name) and settings.suica_tiling_enabled and not _all_text(texts, plan.pages):
+        # Scanned statement: table cropped and cut into overlapping row bands, extracted in parallel at full resolution
+        bands = await run_in_image_pool(
+            tile_pdf_tables, file_bytes, plan.pages,
+            settings.suica_tile_width, settings.suica_band_height, settings.suica_band_overlap,
+        )
+        results = await process_suica_bands(bands, file_name, file_path)
+    elif is_pdf(file_name):
+        # Only the pages kept by the plan (blank pages dropped) are prepared and sent
+        pages = aiter_pdf_page_parts(file_bytes, texts, plan.pages, text_stats)
+        image_data = [part async for parts in pages for part in parts]
+        if kind == "suica":
+            results = await process_suica_statement(image_data, file_name, file_path)
+        else:
+            results = [await process_receipt(image_data, file_name, file_path)]
+    else:
+        image_data, image_hash = await prepare_image_with_hash_async(file_bytes, file_name)
+        if image_hash is not None:
+            # Looks like an image processed before (another photo or copy of the same receipt?); confirmed below
+            image_match = await asyncio.to_thread(_match_image, image_hash, file_path, file_name)
+        if kind == "suica":
+            # Mobile Suica statement: extract all transactions
+            results = await process_suica_statement(image_data, file_name, file_path)
+        elif kind == "multi":
+            results = await process_multi_receipt_pdf([[page] for page in image_data], file_name, file_path)
+        else:
+            # Single receipt image
+            results = [await process_receipt(image_data, file_name, file_path)]
+
+    if text_stats:
+        usage_metrics.record_text_layer(**text_stats)
+    # The SQLite writes run in one thread hop, off the event loop the other files' calls share
+    return await asyncio.to_thread(_record_results, cache_key, kind, file_name, file_path, results, image_match)
+
+
+def _match_image(image_hash: int, file_path: str, file_name: str) -> duplicate_service.ImageMatch | None:
+    image_match = duplicate_service.find_similar_image(image_hash, file_path)
+    duplicate_service.register_image(image_hash, file_path, file_name)
+    return image_match
+
+
+def _record_results(
+    cache_key: str,
+    kind: str,
+    file_name: str,
+    file_path: str,
+    results: list[ReceiptResult],
+    image_match: duplicate_service.ImageMatch | None,
+) -> list[ReceiptResult]:
+    category_service.learn(results, manual=False)
+    cache_service.put(cache_key, kind, file_name, file_path, results)
+    if image_match is not None:
+        duplicate_service.confirm_image_match(results, image_match)
+    return _save_results(file_path, results)
+
+
+def _save_results(file_path: str, results: list[ReceiptResult]) -> list[ReceiptResult]:
+    return results_store.save_file_results(file_path, duplicate_service.flag_results(results, file_path))
+
+
+@dataclass
+class FileEvent:
+    """A file starting ("started") or finishing ("finished") in iter_file_events."""
+    kind: str
+    index: int
+    file_path: str
+    file_name: str
+    results: list[ReceiptResult] = field(default_factory=list)
+    error: str | None = None
+    usage: dict | None = None
+
+
+async def iter_file_events(access_token: str, files: list[tuple[int, str]], concurrency: int | None = None) -> AsyncIterator[FileEvent]:
+    """
+    Process (index, file_path) pairs with a bounded pool of workers.
+    Start and finish events are yielded as they happen, so files may finish out of order;
+    closing the iterator cancels in-flight work.
+    """
+    workers = max(1, min(concurrency or settings.ocr_concurrency, settings.ocr_max_concurrency, len(files) or 1))
+
+    pending: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
+    for item in files:
+        pending.put_nowait(item)
+    events: asyncio.Queue[FileEvent | None] = asyncio.Queue()
+
+    async def worker() -> None:
+        try:
+            while True:
+                try:
+                    index, file_path = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                file_name = file_name_from_path(file_path)
+                await events.put(FileEvent("started", index, file_path, file_name))
+                with usage_metrics.file_scope() as usage:
+                    try:
+                        results = await process_file(access_token, file_path)
+                    except Exception as e:
+                        finished = FileEvent("finished", index, file_path, file_name, error=str(e))
+                    else:
+                        finished = FileEvent("finished", index, file_path, file_name, results=results)
+                finished.usage = usage.as_dict()
+                await events.put(finished)
+        finally:
+            await events.put(None)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        running = len(tasks)
+        while running:
+            event = await events.get()
+            if event is None:
+                running -= 1
+                continue
+            yield event
+    finally:
+        # Consumer stopped (cancel or disconnect): stop in-flight work
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
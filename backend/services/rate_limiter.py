@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+import anthropic
+
+from config import settings
+from services import usage_metrics
+
+logger = logging.getLogger(__name__)
+
+# The API downsizes images to ~1.15 megapixels, i.e. at most ~1600 tokens per image
+IMAGE_TOKEN_ESTIMATE = 1600
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class TokenBucket:
+    """
+    Budget that refills continuously up to capacity (per-minute limits become capacity/60 per second).
+    The level may go negative when actual usage turns out higher than the reservation.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, rate_factor: float) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60 * rate_factor)
+        self.updated = now
+
+    def wait_time(self, amount: float, rate_factor: float) -> float:
+        self._refill(rate_factor)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60 * rate_factor)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def give(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelScheduler:
+    """
+    Shared scheduler for every messages.create call. Requests wait for request, input-token and
+    output-token budget; retryable errors back off with full jitter (or retry-after when given),
+    and a 429 halves the effective rate, which then recovers gradually on success.
+    """
+
+    def __init__(self) -> None:
+        self.requests = TokenBucket(settings.anthropic_requests_per_minute)
+        self.input_tokens = TokenBucket(settings.anthropic_input_tokens_per_minute)
+        self.output_tokens = TokenBucket(settings.anthropic_output_tokens_per_minute)
+        self.rate_factor = 1.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._counters: Counter = Counter()
+
+    async def _reserve(self, input_tokens: int, output_tokens: int) -> None:
+        async with self._lock:
+            while True:
+                wait = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.wait_time(1, self.rate_factor),
+                    self.input_tokens.wait_time(input_tokens, self.rate_factor),
+                    self.output_tokens.wait_time(output_tokens, self.rate_factor),
+                )
+                if wait <= 0:
+                    break
+                self._counters["throttled_waits"] += 1
+                self._counters["throttled_seconds"] += wait
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.input_tokens.take(input_tokens)
+            self.output_tokens.take(output_tokens)
+
+    def _settle(self, estimated_input: int, reserved_output: int, usage) -> None:
+        """Correct the reservations with the tokens the response actually used."""
+        if usage is None:
+            return
+        # Cache writes count against the input-token limit, cache reads do not
+        counted = usage.input_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        self.input_tokens.take(counted - estimated_input)
+        self.output_tokens.give(reserved_output - usage.output_tokens)
+
+    def _backoff(self, attempt: int, error: anthropic.APIError) -> float:
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after
+        cap = min(settings.anthropic_retry_max_delay, settings.anthropic_retry_base_delay * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    async def create_message(self, client: anthropic.AsyncAnthropic, purpose: str = "other", **kwargs):
+        """
+        messages.create with rate limiting and retries. Returns the Message.
+        Every call is recorded in usage_metrics under purpose (e.g. "extraction", "category").
+        """
+        estimated_input = estimate_input_tokens(kwargs.get("messages", []), kwargs.get("system"), kwargs.get("tools"))
+        reserved_output = kwargs.get("max_tokens", 1024)
+        images, image_bytes = usage_metrics.count_images(kwargs.get("messages", []))
+        started = time.perf_counter()
+
+        def record(ok: bool, attempt: int, call_started: float, usage=None) -> None:
+            latency = time.perf_counter() - call_started
+            usage_metrics.record(usage_metrics.CallMetrics(
+                model=kwargs.get("model", ""),
+                purpose=purpose,
+                ok=ok,
+                input_tokens=usage.input_tokens if usage is not None else 0,
+                output_tokens=usage.output_tokens if usage is not None else 0,
+                cache_read_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+                cache_write_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+                images=images,
+                image_bytes=image_bytes,
+                latency=latency,
+                queued=call_started - started,
+                retries=attempt,
+            ))
+
+        for attempt in range(settings.anthropic_max_retries + 1):
+            await self._reserve(estimated_input, reserved_output)
+            self._counters["requests"] += 1
+            call_started = time.perf_counter()
+            try:
+                response = await client.messages.create(**kwargs)
+            except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+                # Nothing was generated, so the output reservation is returned
+                self.output_tokens.give(reserved_output)
+                if not _is_retryable(e) or attempt == settings.anthropic_max_retries:
+                    self._counters["failures"] += 1
+                    record(False, attempt, call_started)
+                    raise
+                delay = self._backoff(attempt, e)
+                self._counters["retries"] += 1
+                if getattr(e, "status_code", None) == 429:
+                    self._counters["rate_limited"] += 1
+                    self.rate_factor = max(0.1, self.rate_factor / 2)
+                    # Everyone waits: the limit is account-wide
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning("Model call failed (%s), retry %d in %.1fs", e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            self.rate_factor = min(1.0, self.rate_factor + 0.05)
+            usage = getattr(response, "usage", None)
+            self._settle(estimated_input, reserved_output, usage)
+            record(True, attempt, call_started, usage)
+            return response
+
+    def metrics(self) -> dict:
+        return {
+            "requests": self._counters["requests"],
+            "retries": self._counters["retries"],
+            "rate_limited": self._counters["rate_limited"],
+            "failures": self._counters["failures"],
+            "throttled_waits": self._counters["throttled_waits"],
+            "throttled_seconds": round(self._counters["throttled_seconds"], 2),
+            "rate_factor": round(self.rate_factor, 3),
+            "budget": {
+                "requests": round(self.requests.level, 1),
+                "input_tokens": round(self.input_tokens.level),
+                "output_tokens": round(self.output_tokens.level),
+            },
+        }
+
+
+def estimate_input_tokens(messages: list[dict], system=None, tools: list[dict] | None = None) -> int:
+    """
+    Rough input size: ~1 token per character of text (Japanese-heavy prompts) plus a flat cost per image.
+    Tool definitions count by the length of their JSON.
+    """
+    tokens = sum(len(json.dumps(tool, ensure_ascii=False)) for tool in tools or [])
+    blocks: list = []
+    if isinstance(system, str):
+        tokens += len(system)
+    elif system:
+        blocks.extend(system)
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content)
+        else:
+            blocks.extend(content or [])
+    for block in blocks:
+        if block.get("type") == "image":
+            tokens += IMAGE_TOKEN_ESTIMATE
+        elif block.get("type") == "text":
+            tokens += len(block.get("text", ""))
+    return tokens
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Closer estimate for deciding whether a prefix is long enough to cache: about four characters
+    per token for ASCII (JSON schemas), one per character for Japanese.
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def _retry_after_seconds(error: anthropic.APIError) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return min(float(value), settings.anthropic_retry_max_delay) if value is not None else None
+    except ValueError:
+        return None
+
+
+scheduler = ModelScheduler()
@@ -0,0 +1,291 @@
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from itertools import islice
+
+from config import settings
+from models.receipt import AccountingCategory, CategoryTotal, ReceiptResult
+from models.result_models import MonthlyTotal, ResultUpdate
+from services.category_service import normalize_vendor
+from services.duplicate_service import normalize_date
+from utils.sqlite_utils import connect
+
+# Results are kept one row per receipt with the filter columns (month, category, vendor, amount)
+# broken out and indexed. The totals table holds count and amount per (month, category) and is
+# adjusted in the same transaction as every insert, replacement and edit, so summaries read at most
+# a few hundred rows however many receipts are stored.
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("results.sqlite3")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                date TEXT,
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                vendor_key TEXT NOT NULL,
+                amount INTEGER,
+                is_manually_edited INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_file ON results (file_path);
+            CREATE INDEX IF NOT EXISTS idx_results_month ON results (month, category, date);
+            CREATE INDEX IF NOT EXISTS idx_results_category ON results (category, date);
+            CREATE INDEX IF NOT EXISTS idx_results_vendor ON results (vendor_key);
+            CREATE INDEX IF NOT EXISTS idx_results_amount ON results (amount);
+            CREATE INDEX IF NOT EXISTS idx_results_date ON results (date);
+            CREATE TABLE IF NOT EXISTS totals (
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                total_amount INTEGER NOT NULL,
+                PRIMARY KEY (month, category)
+            );
+            """
+        )
+    return _conn
+
+
+@contextmanager
+def _transaction():
+    with _lock:
+        conn = _db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _columns(result: ReceiptResult) -> dict:
+    date = normalize_date(result.date)
+    return {
+        "id": result.id,
+        "file_path": result.file_path,
+        "date": date,
+        "month": date[:7] if date else "",
+        "category": result.category.value if result.category else "",
+        "vendor_key": normalize_vendor(result.company_name),
+        "amount": result.amount,
+        "is_manually_edited": int(result.is_manually_edited),
+        "data": result.model_dump_json(),
+        "updated_at": time.time(),
+    }
+
+
+def _add_to_totals(conn, month: str, category: str, amount: int | None, sign: int) -> None:
+    # Same rule as csv_service.CategoryTotals: only results with an amount are counted
+    if amount is None:
+        return
+    conn.execute(
+        "INSERT INTO totals (month, category, count, total_amount) VALUES (?, ?, ?, ?)"
+        " ON CONFLICT (month, category) DO UPDATE SET"
+        " count = count + excluded.count, total_amount = total_amount + excluded.total_amount",
+        (month, category, sign, sign * amount),
+    )
+
+
+def _insert(conn, result: ReceiptResult) -> None:
+    row = _columns(result)
+    conn.execute(
+        f"INSERT INTO results ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})", tuple(row.values())
+    )
+    _add_to_totals(conn, row["month"], row["category"], row["amount"], 1)
+
+
+def _delete(conn, rows: list) -> None:
+    for row in rows:
+        conn.execute("DELETE FROM results WHERE id = ?", (row["id"],))
+        _add_to_totals(conn, row["month"], row["category"], row["amount"], -1)
+
+
+def save_file_results(file_path: str, results: list[ReceiptResult]) -> list[ReceiptResult]:
+    """
+    Store a file's results in place of what was stored for it before, and return what the store now holds.
+    A file with a hand-edited result keeps its stored results, so reprocessing never discards corrections.
+    """
+    if not settings.results_store_enabled:
+        return results
+    with _transaction() as conn:
+        stored = conn.execute(
+            "SELECT id, month, category, amount, is_manually_edited, data FROM results WHERE file_path = ? ORDER BY rowid",
+            (file_path,),
+        ).fetchall()
+        if any(row["is_manually_edited"] for row in stored):
+            return [ReceiptResult.model_validate_json(row["data"]) for row in stored]
+        _delete(conn, stored)
+        for result in results:
+            _insert(conn, result)
+    return results
+
+
+def delete_file_results(path: str) -> int:
+    """Remove the results of a deleted file, or of every file under a deleted folder. Returns how many."""
+    if not settings.results_store_enabled:
+        return 0
+    prefix = path.rstrip("/").lower()
+    with _transaction() as conn:
+        stored = conn.execute(
+            "SELECT id, month, category, amount FROM results WHERE lower(file_path) = ? OR lower(file_path) LIKE ? ESCAPE '\\'",
+            (prefix, prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%"),
+        ).fetchall()
+        _delete(conn, stored)
+    return len(stored)
+
+
+def get_result(result_id: str) -> ReceiptResult | None:
+    with _lock:
+        row = _db().execute("SELECT data FROM results WHERE id = ?", (result_id,)).fetchone()
+    return ReceiptResult.model_validate_json(row["data"]) if row else None
+
+
+def with_stored_edits(results: Iterable[ReceiptResult], page_size: int = 200) -> Iterator[ReceiptResult]:
+    """Each result as the store now holds it (with manual edits), or as given when it is not stored."""
+    results = iter(results)
+    while page := list(islice(results, page_size)):
+        with _lock:
+            rows = _db().execute(
+                f"SELECT id, data FROM results WHERE id IN ({', '.join('?' for _ in page)})",
+                [result.id for result in page],
+            ).fetchall()
+        stored = {row["id"]: row["data"] for row in rows}
+        for result in page:
+            yield ReceiptResult.model_validate_json(stored[result.id]) if result.id in stored else result
+
+
+def update_result(result_id: str, update: ResultUpdate) -> ReceiptResult | None:
+    """Apply a manual edit, moving the result's contribution between totals. None when it is not stored."""
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT id, month, category, amount, data FROM results WHERE id = ?", (result_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        result = ReceiptResult.model_validate_json(row["data"]).model_copy(
+            update={**update.model_dump(exclude_unset=True), "is_manually_edited": True}
+        )
+        _delete(conn, [row])
+        _insert(conn, result)
+    return result
+
+
+def _where(
+    month: str | None = None,
+    category: AccountingCategory | None = None,
+    vendor: str | None = None,
+    min_amount: int | None = None,
+    max_amount: int | None = None,
+) -> tuple[str, list]:
+    clauses, params = [], []
+    if month:
+        clauses.append("month = ?")
+        params.append(month)
+    if category:
+        clauses.append("category = ?")
+        params.append(category.value)
+    if vendor and normalize_vendor(vendor):
+        # Vendors starting with the name, as a range on the vendor_key index
+        prefix = normalize_vendor(vendor)
+        clauses.append("vendor_key >= ? AND vendor_key < ?")
+        params.extend([prefix, prefix + "\U0010ffff"])
+    if min_amount is not None:
+        clauses.append("amount >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        clauses.append("amount <= ?")
+        params.append(max_amount)
+    return (f" WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+def query_results(limit: int = 100, offset: int = 0, **filters) -> tuple[list[ReceiptResult], int]:
+    """One page of results matching filters (see _where), by date, and the number of matches."""
+    where, params = _where(**filters)
+    with _lock:
+        (total,) = _db().execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()
+        rows = _db().execute(
+            f"SELECT data FROM results{where} ORDER BY date IS NULL, date, rowid LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+    return [ReceiptResult.model_validate_json(row["data"]) for row in rows], total
+
+
+def iter_results(page_size: int = 200, **filters) -> Iterator[ReceiptResult]:
+    """
+    Every result matching filters, by date, read page by page so memory stays flat.
+    Pages continue from the last (date, rowid) read, dated results first and then undated ones,
+    so each page is an index range rather than a scan past everything read before.
+    """
+    where, params = _where(**filters)
+    where = f"{where} AND" if where else " WHERE"
+    after = None
+    while True:
+        if after is None:
+            seek, seek_params = "date IS NOT NULL", []
+        else:
+            seek, seek_params = "(date, rowid) > (?, ?)", list(after)
+        with _lock:
+            rows = _db().execute(
+                f"SELECT rowid, date, data FROM results{where} {seek} ORDER BY date, rowid LIMIT ?",
+                (*params, *seek_params, page_size),
+            ).fetchall()
+        yield from (ReceiptResult.model_validate_json(row["data"]) for row in rows)
+        if len(rows) < page_size:
+            break
+        after = (rows[-1]["date"], rows[-1]["rowid"])
+
+    last_rowid = 0
+    while True:
+        with _lock:
+            rows = _db().execute(
+                f"SELECT rowid, data FROM results{where} date IS NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                (*params, last_rowid, page_size),
+            ).fetchall()
+        yield from (ReceiptResult.model_validate_json(row["data"]) for row in rows)
+        if len(rows) < page_size:
+            return
+        last_rowid = rows[-1]["rowid"]
+
+
+def monthly_totals(year: str | None = None) -> list[MonthlyTotal]:
+    """Count and amount per month (undated results left out), from the pre-aggregated totals."""
+    where, params = ("WHERE month LIKE ?", [f"{year}-%"]) if year else ("WHERE month != ''", [])
+    with _lock:
+        rows = _db().execute(
+            f"SELECT month, SUM(count) AS count, SUM(total_amount) AS total_amount FROM totals {where}"
+            " GROUP BY month HAVING SUM(count) > 0 ORDER BY month",
+            params,
+        ).fetchall()
+    return [MonthlyTotal(month=row["month"], count=row["count"], total_amount=row["total_amount"]) for row in rows]
+
+
+def category_totals(from_month: str | None = None, to_month: str | None = None) -> list[CategoryTotal]:
+    """Count and amount per category over an inclusive month range, from the pre-aggregated totals."""
+    clauses, params = ["category != ''"], []
+    if from_month:
+        clauses.append("month >= ?")
+        params.append(from_month)
+    if to_month:
+        clauses.append("month <= ? AND month != ''")
+        params.append(to_month)
+    with _lock:
+        rows = _db().execute(
+            f"SELECT category, SUM(count) AS count, SUM(total_amount) AS total_amount FROM totals"
+            f" WHERE {' AND '.join(clauses)} GROUP BY category HAVING SUM(count) > 0 ORDER BY category",
+            params,
+        ).fetchall()
+    return [
+        CategoryTotal(category=AccountingCategory(row["category"]), count=row["count"], total_amount=row["total_amount"])
+        for row in rows
+    ]
@@ -0,0 +1,164 @@
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from config import settings
+from services.ocr_service import is_multi_receipt_pdf, is_suica_statement
+from utils.image_utils import pdf_text_layer, run_in_image_pool
+from utils.layout_utils import PageLayout, analyze_pdf
+
+logger = logging.getLogger(__name__)
+
+# Pages with less ink than this are blank (separator sheets, empty backs) and are not sent
+BLANK_INK = 0.002
+# Statement rows in a text layer: a date (MM/DD, optionally with the year) and two amounts at the end of
+# the line, the charge and the running balance in either order. A statement needs STATEMENT_MIN_ROWS of
+# them, with the balance moving by the charge between at least STATEMENT_MIN_CONSISTENCY of consecutive rows.
+STATEMENT_ROW = re.compile(
+    r"^\s*(?:\d{4}\s*[/.年-]\s*)?\d{1,2}\s*[/.月-]\s*\d{1,2}日?\s.*?([-+]?[\d,]+)\s+[¥\\]?([-+]?[\d,]+)\s*円?\s*$"
+)
+STATEMENT_MIN_ROWS = 8
+STATEMENT_MIN_CONSISTENCY = 0.6
+# Content closer than this to the top/bottom edge runs over the page break
+EDGE_MARGIN = 0.03
+# Content filling more than this of the page width is a cropped scan or photo, one receipt per page
+SCAN_FILL = 0.9
+PLAN_MEMO_SIZE = 4096
+
+_memo: OrderedDict[tuple[str, str], "RoutePlan"] = OrderedDict()
+
+
+@dataclass
+class RoutePlan:
+    """
+    How a file is sent to the model: kind picks the prompt ("suica", "multi" or "single") and
+    each group lists the 1-based pages that go into one model call.
+    groups is None when pages were not analysed (every page is sent, as before).
+    texts is the PDF text layer read while routing, for the caller to reuse; None when it was not read.
+    """
+    kind: str
+    groups: list[list[int]] | None
+    reason: str
+    texts: list[str] | None = None
+
+    @property
+    def pages(self) -> list[int] | None:
+        return [page for group in self.groups for page in group] if self.groups is not None else None
+
+
+def filename_plan(file_name: str) -> RoutePlan:
+    """The previous filename-only routing, used when layout analysis is off or fails."""
+    if is_suica_statement(file_name):
+        return RoutePlan("suica", None, "filename")
+    if is_multi_receipt_pdf(file_name):
+        return RoutePlan("multi", None, "filename")
+    return RoutePlan("single", None, "filename")
+
+
+def _amount(text: str) -> int | None:
+    digits = text.replace(",", "")
+    return int(digits) if digits.lstrip("+-").isdigit() else None
+
+
+def is_statement_text(texts: list[str]) -> bool:
+    """
+    Positive evidence of a transaction statement in a PDF's text layer: dated rows whose running
+    balance moves by the row's amount. Itemized invoices have dated or priced rows, but no balance column.
+    """
+    rows = []
+    for line in "\n".join(texts).splitlines():
+        match = STATEMENT_ROW.match(line)
+        if match:
+            first, second = _amount(match.group(1)), _amount(match.group(2))
+            if first is not None and second is not None:
+                rows.append((first, second))
+    if len(rows) < STATEMENT_MIN_ROWS:
+        return False
+
+    def consistent(amount_index: int) -> int:
+        balance_index = 1 - amount_index
+        return sum(
+            abs(row[balance_index] - previous[balance_index]) == abs(row[amount_index])
+            for previous, row in zip(rows, rows[1:])
+        )
+
+    return max(consistent(0), consistent(1)) >= STATEMENT_MIN_CONSISTENCY * (len(rows) - 1)
+
+
+def _is_photo_page(layout: PageLayout) -> bool:
+    """Content fills the page: a photo or tightly cropped scan, which holds one receipt."""
+    return layout.content_width >= SCAN_FILL and layout.content_height >= SCAN_FILL
+
+
+def _continues(previous: PageLayout, page: PageLayout) -> bool:
+    """A document page whose content runs over the page break into the next one."""
+    return (
+        previous.content_width < SCAN_FILL
+        and page.content_width < SCAN_FILL
+        and previous.bottom_margin < EDGE_MARGIN
+        and page.top_margin < EDGE_MARGIN
+    )
+
+
+def plan_from_layouts(layouts: list[PageLayout], file_name: str, texts: list[str] | None = None) -> RoutePlan:
+    """
+    Decide statement vs single vs multi-receipt and group pages so each call carries one receipt.
+    Like filename routing, a PDF stays one document unless there is evidence otherwise: the statement
+    prompt needs the filename or statement rows in the text layer, and pages are split into separate
+    receipts only for multi-receipt filenames or when every page is a photo of its own.
+    """
+    content_pages = [page for page, layout in enumerate(layouts, 1) if layout.ink >= BLANK_INK] or [1]
+
+    if is_suica_statement(file_name):
+        return RoutePlan("suica", [content_pages], "filename")
+    if texts and is_statement_text(texts):
+        return RoutePlan("suica", [content_pages], "statement rows")
+
+    if is_multi_receipt_pdf(file_name):
+        reason = "filename"
+    elif len(content_pages) > 1 and all(_is_photo_page(layouts[page - 1]) for page in content_pages):
+        reason = "photo pages"
+    else:
+        return RoutePlan("single", [content_pages], "one document")
+
+    groups: list[list[int]] = []
+    for page in content_pages:
+        if groups and groups[-1][-1] == page - 1 and _continues(layouts[page - 2], layouts[page - 1]):
+            groups[-1].append(page)
+        else:
+            groups.append([page])
+    if len(groups) == 1:
+        return RoutePlan("single", groups, "one receipt")
+    return RoutePlan("multi", groups, f"{len(groups)} receipts ({reason})")
+
+
+async def plan_route(file_bytes: bytes, file_name: str, content_hash: str) -> RoutePlan:
+    """
+    Route a PDF from its page layout and text layer, analysed locally before any model call (memoized by content).
+    Images are a single page, so only the filename can still mark them as a statement.
+    """
+    if not settings.layout_routing_enabled or not file_name.lower().endswith(".pdf"):
+        return filename_plan(file_name)
+
+    # The filename can force a statement or multi-receipt plan, so it is part of the key
+    key = (content_hash, filename_plan(file_name).kind)
+    plan = _memo.get(key)
+    if plan is not None:
+        _memo.move_to_end(key)
+        return plan
+
+    try:
+        layouts = await run_in_image_pool(analyze_pdf, file_bytes)
+        texts = await run_in_image_pool(pdf_text_layer, file_bytes)
+    except Exception:
+        logger.warning("Layout analysis failed for %s, routing by filename", file_name, exc_info=True)
+        return filename_plan(file_name)
+
+    plan = plan_from_layouts(layouts, file_name, texts)
+    logger.debug("Routed %s as %s %s (%s)", file_name, plan.kind, plan.groups, plan.reason)
+    _memo[key] = plan
+    if len(_memo) > PLAN_MEMO_SIZE:
+        _memo.popitem(last=False)
+    # Text layers are not kept in the memo; a memoized plan is mostly used for a file the OCR cache serves
+    return replace(plan, texts=texts)
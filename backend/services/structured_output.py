@@ -0,0 +1,133 @@
+import json
+import logging
+import re
+
+from pydantic import BaseModel, ValidationError
+
+from services import usage_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StructuredOutputError(ValueError):
+    """The response held nothing that could be read as the requested schema, even after repair."""
+
+
+def _inline_refs(schema: dict) -> dict:
+    """Replace $ref with the referenced $defs entry, so the tool schema is self-contained."""
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(defs[node["$ref"].rsplit("/", 1)[-1]])
+            # Schema titles only repeat the names; a property called "title" would be a dict
+            return {k: resolve(v) for k, v in node.items() if not (k == "title" and isinstance(v, str))}
+        if isinstance(node, list):
+            return [resolve(item) for item in node]
+        return node
+
+    return resolve(schema)
+
+
+def tool_for(output_model: type[BaseModel]) -> dict:
+    """Tool definition whose input schema is output_model's JSON schema."""
+    schema = _inline_refs(output_model.model_json_schema())
+    return {
+        "name": output_model.__name__,
+        "description": schema.pop("description", output_model.__name__),
+        "input_schema": schema,
+    }
+
+
+def tool_params(output_model: type[BaseModel]) -> dict:
+    """messages.create parameters that force the answer through output_model's tool."""
+    return {
+        "tools": [tool_for(output_model)],
+        "tool_choice": {"type": "tool", "name": output_model.__name__},
+    }
+
+
+def _json_from_text(text: str):
+    """
+    Best-effort JSON from free text: strips markdown fences and surrounding prose, then
+    fixes trailing commas and full-width quotes before parsing.
+    """
+    text = text.strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, flags=re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = max(text.rfind("}"), text.rfind("]"))
+        text = text[start:end + 1]
+    try:
+        return json.loads(text)
+    except ValueError:
+        text = text.replace("“", '"').replace("”", '"')
+        text = re.sub(r",\s*([}\]])", r"\1", text)
+        return json.loads(text)
+
+
+def _drop_invalid(data: dict, error: ValidationError) -> dict:
+    """Null out invalid top-level fields and drop invalid list items, as reported by error."""
+    data = dict(data)
+    dropped_items: dict[str, set[int]] = {}
+    for problem in error.errors():
+        loc = problem["loc"]
+        if not loc or not isinstance(loc[0], str):
+            continue
+        if len(loc) >= 2 and isinstance(loc[1], int) and isinstance(data.get(loc[0]), list):
+            dropped_items.setdefault(loc[0], set()).add(loc[1])
+        else:
+            data[loc[0]] = None
+    for name, indexes in dropped_items.items():
+        data[name] = [item for i, item in enumerate(data[name]) if i not in indexes]
+    return data
+
+
+def parse_output(response, output_model: type[BaseModel], purpose: str):
+    """
+    Read output_model from a response: the forced tool call's input, or else JSON found in the text.
+    Fields that fail validation are nulled (list items dropped) rather than failing the file.
+    The outcome ("tool", "repaired" or "failed") is counted under purpose in usage_metrics.
+    Raises StructuredOutputError when nothing usable is found.
+    """
+    repaired = False
+    data = None
+    for block in response.content:
+        if block.type == "tool_use" and block.name == output_model.__name__:
+            data = block.input
+            break
+    if data is None:
+        text = "".join(block.text for block in response.content if block.type == "text")
+        try:
+            data = _json_from_text(text)
+        except ValueError:
+            usage_metrics.record_output(purpose, "failed")
+            raise StructuredOutputError(f"No {output_model.__name__} in the model output: {text[:200]!r}")
+        repaired = True
+
+    fields = list(output_model.model_fields)
+    if isinstance(data, list) and len(fields) == 1:
+        # A bare array for a single-list schema ({"transactions": [...]} etc.)
+        data = {fields[0]: data}
+        repaired = True
+    if not isinstance(data, dict):
+        usage_metrics.record_output(purpose, "failed")
+        raise StructuredOutputError(f"Expected an object for {output_model.__name__}, got {type(data).__name__}")
+
+    try:
+        parsed = output_model.model_validate(data)
+    except ValidationError as e:
+        logger.info("Repairing %s output: %s", output_model.__name__, e)
+        try:
+            parsed = output_model.model_validate(_drop_invalid(data, e))
+        except ValidationError as again:
+            usage_metrics.record_output(purpose, "failed")
+            raise StructuredOutputError(str(again)) from again
+        repaired = True
+
+    usage_metrics.record_output(purpose, "repaired" if repaired else "tool")
+    return parsed
@@ -0,0 +1,308 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+# USD per million input / output tokens, matched by model-name prefix
+MODEL_PRICES = {
+    "claude-opus-4": (15.0, 75.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-3-5-haiku": (0.8, 4.0),
+}
+# Message Batches requests are billed at half price
+BATCH_DISCOUNT = 0.5
+# Prompt-cache writes and reads, as multiples of the input token price
+CACHE_WRITE_PRICE = 1.25
+CACHE_READ_PRICE = 0.1
+# Shortest prompt prefix the API caches, matched by model-name prefix; shorter prefixes are billed as plain input
+CACHE_MIN_TOKENS = {
+    "claude-haiku-4-5": 4096,
+    "claude-3-5-haiku": 2048,
+}
+DEFAULT_CACHE_MIN_TOKENS = 1024
+LATENCY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def price_for(model: str) -> tuple[float, float] | None:
+    for prefix, price in MODEL_PRICES.items():
+        if model.startswith(prefix):
+            return price
+    return None
+
+
+def cache_min_tokens(model: str) -> int:
+    for prefix, tokens in CACHE_MIN_TOKENS.items():
+        if model.startswith(prefix):
+            return tokens
+    return DEFAULT_CACHE_MIN_TOKENS
+
+
+def count_images(messages: list[dict]) -> tuple[int, int]:
+    """(image count, decoded image bytes) of the base64 images in a request."""
+    images = image_bytes = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+        for block in content or []:
+            if block.get("type") == "image" and block.get("source", {}).get("type") == "base64":
+                data = block["source"]["data"]
+                images += 1
+                image_bytes += len(data) * 3 // 4 - data[-2:].count("=")
+    return images, image_bytes
+
+
+@dataclass
+class CallMetrics:
+    """
+    One model call: tokens, images, time on the wire, time spent waiting for budget or backoff, and retries.
+    input_tokens excludes the prompt-cache tokens, which are counted separately.
+    """
+    model: str
+    purpose: str
+    ok: bool
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    images: int = 0
+    image_bytes: int = 0
+    latency: float = 0.0
+    queued: float = 0.0
+    retries: int = 0
+    batch: bool = False
+
+    @property
+    def cost_usd(self) -> float:
+        price = price_for(self.model)
+        if price is None:
+            return 0.0
+        input_tokens = (
+            self.input_tokens + self.cache_write_tokens * CACHE_WRITE_PRICE + self.cache_read_tokens * CACHE_READ_PRICE
+        )
+        cost = (input_tokens * price[0] + self.output_tokens * price[1]) / 1_000_000
+        return cost * BATCH_DISCOUNT if self.batch else cost
+
+
+@dataclass
+class UsageStats:
+    """Model usage summed over a file, a batch or the whole process."""
+    calls: int = 0
+    failed_calls: int = 0
+    retries: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    images: int = 0
+    image_bytes: int = 0
+    latency_seconds: float = 0.0
+    queued_seconds: float = 0.0
+    cost_usd: float = 0.0
+    repaired_outputs: int = 0
+    failed_outputs: int = 0
+    output_retries: int = 0
+    routed: int = 0
+    escalated: int = 0
+    pdf_text_pages: int = 0
+    pdf_image_pages: int = 0
+    image_tokens_saved: int = 0
+    escalation_reasons: dict[str, int] = field(default_factory=dict)
+    by_purpose: dict[str, int] = field(default_factory=dict)
+
+    def add(self, call: CallMetrics) -> None:
+        self.calls += 1
+        self.failed_calls += 0 if call.ok else 1
+        self.retries += call.retries
+        self.input_tokens += call.input_tokens
+        self.output_tokens += call.output_tokens
+        self.cache_read_tokens += call.cache_read_tokens
+        self.cache_write_tokens += call.cache_write_tokens
+        self.images += call.images
+        self.image_bytes += call.image_bytes
+        self.latency_seconds += call.latency
+        self.queued_seconds += call.queued
+        self.cost_usd += call.cost_usd
+        self.by_purpose[call.purpose] = self.by_purpose.get(call.purpose, 0) + 1
+
+    def add_output(self, outcome: str) -> None:
+        if outcome == "repaired":
+            self.repaired_outputs += 1
+        elif outcome == "failed":
+            self.failed_outputs += 1
+        elif outcome == "retried":
+            self.output_retries += 1
+
+    def add_route(self, reason: str | None) -> None:
+        self.routed += 1
+        if reason is not None:
+            self.escalated += 1
+            self.escalation_reasons[reason] = self.escalation_reasons.get(reason, 0) + 1
+
+    def add_text_layer(self, text_pages: int, image_pages: int, image_tokens_saved: int) -> None:
+        self.pdf_text_pages += text_pages
+        self.pdf_image_pages += image_pages
+        self.image_tokens_saved += image_tokens_saved
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failed_calls": self.failed_calls,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "images": self.images,
+            "image_bytes": self.image_bytes,
+            "latency_seconds": round(self.latency_seconds, 3),
+            "queued_seconds": round(self.queued_seconds, 3),
+            "cost_usd": round(self.cost_usd, 6),
+            "repaired_outputs": self.repaired_outputs,
+            "failed_outputs": self.failed_outputs,
+            "output_retries": self.output_retries,
+            "routed": self.routed,
+            "escalated": self.escalated,
+            "escalation_rate": round(self.escalated / self.routed, 3) if self.routed else 0.0,
+            "escalation_reasons": dict(self.escalation_reasons),
+            "pdf_text_pages": self.pdf_text_pages,
+            "pdf_image_pages": self.pdf_image_pages,
+            "image_tokens_saved": self.image_tokens_saved,
+            "by_purpose": dict(self.by_purpose),
+        }
+
+
+_current_batch: ContextVar[UsageStats | None] = ContextVar("usage_batch", default=None)
+_current_file: ContextVar[UsageStats | None] = ContextVar("usage_file", default=None)
+
+_lock = threading.Lock()
+_total = UsageStats()
+_by_label: dict[tuple[str, str], UsageStats] = defaultdict(UsageStats)
+_latency_buckets: dict[str, list[int]] = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+_latency_sum: dict[str, float] = defaultdict(float)
+_outputs: Counter = Counter()
+_routes: Counter = Counter()
+
+
+def start_batch() -> UsageStats:
+    """Begin collecting usage for the current batch (inherited by tasks created afterwards)."""
+    stats = UsageStats()
+    _current_batch.set(stats)
+    return stats
+
+
+@contextmanager
+def file_scope():
+    """Collect usage of the model calls made for one file inside the with block."""
+    stats = UsageStats()
+    token = _current_file.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_file.reset(token)
+
+
+def record(call: CallMetrics) -> None:
+    with _lock:
+        _total.add(call)
+        _by_label[(call.model, call.purpose)].add(call)
+        if call.ok:
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if call.latency <= bound), len(LATENCY_BUCKETS))
+            _latency_buckets[call.model][bucket] += 1
+            _latency_sum[call.model] += call.latency
+    for stats in (_current_batch.get(), _current_file.get()):
+        if stats is not None:
+            stats.add(call)
+
+
+def record_output(purpose: str, outcome: str) -> None:
+    """
+    Count how a structured response was read: "tool" (valid tool input), "repaired" (fixed up locally),
+    "failed" (unreadable) or "retried" (the call was made again because of it).
+    """
+    with _lock:
+        _outputs[(purpose, outcome)] += 1
+        _total.add_output(outcome)
+    for stats in (_current_batch.get(), _current_file.get()):
+        if stats is not None:
+            stats.add_output(outcome)
+
+
+def record_route(purpose: str, reason: str | None) -> None:
+    """Count a fast-model answer that was kept (reason None) or escalated to the main model for reason."""
+    with _lock:
+        _routes[(purpose, reason or "none")] += 1
+        _total.add_route(reason)
+    for stats in (_current_batch.get(), _current_file.get()):
+        if stats is not None:
+            stats.add_route(reason)
+
+
+def record_text_layer(text_pages: int, image_pages: int, image_tokens_saved: int) -> None:
+    """Count PDF pages sent as their text layer vs rendered, and the estimated image tokens that saved."""
+    with _lock:
+        _total.add_text_layer(text_pages, image_pages, image_tokens_saved)
+    for stats in (_current_batch.get(), _current_file.get()):
+        if stats is not None:
+            stats.add_text_layer(text_pages, image_pages, image_tokens_saved)
+
+
+def totals() -> dict:
+    with _lock:
+        return _total.as_dict()
+
+
+def prometheus_lines() -> list[str]:
+    """Usage counters and the per-model latency histogram in Prometheus text format."""
+    counters = [
+        ("anthropic_calls_total", "Model calls", "calls"),
+        ("anthropic_failed_calls_total", "Model calls that failed after retries", "failed_calls"),
+        ("anthropic_retries_total", "Retried attempts", "retries"),
+        ("anthropic_input_tokens_total", "Input tokens", "input_tokens"),
+        ("anthropic_output_tokens_total", "Output tokens", "output_tokens"),
+        ("anthropic_cache_read_tokens_total", "Input tokens read from the prompt cache", "cache_read_tokens"),
+        ("anthropic_cache_write_tokens_total", "Input tokens written to the prompt cache", "cache_write_tokens"),
+        ("anthropic_images_total", "Images sent", "images"),
+        ("anthropic_image_bytes_total", "Decoded bytes of images sent", "image_bytes"),
+        ("anthropic_queued_seconds_total", "Seconds waiting for rate-limit budget or backoff", "queued_seconds"),
+        ("anthropic_cost_usd_total", "Estimated cost in USD", "cost_usd"),
+    ]
+    lines: list[str] = []
+    with _lock:
+        for name, help_text, attr in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (model, purpose), stats in sorted(_by_label.items()):
+                lines.append(f'{name}{{model="{model}",purpose="{purpose}"}} {getattr(stats, attr)}')
+
+        name = "anthropic_structured_outputs_total"
+        lines += [f"# HELP {name} Structured responses by how they were read", f"# TYPE {name} counter"]
+        for (purpose, outcome), count in sorted(_outputs.items()):
+            lines.append(f'{name}{{purpose="{purpose}",outcome="{outcome}"}} {count}')
+
+        name = "anthropic_routed_total"
+        lines += [f"# HELP {name} Fast-model answers by escalation reason (none = kept)", f"# TYPE {name} counter"]
+        for (purpose, reason), count in sorted(_routes.items()):
+            lines.append(f'{name}{{purpose="{purpose}",escalation="{reason}"}} {count}')
+
+        name = "pdf_pages_total"
+        lines += [f"# HELP {name} PDF pages sent, by text layer or rendered image", f"# TYPE {name} counter"]
+        lines.append(f'{name}{{mode="text"}} {_total.pdf_text_pages}')
+        lines.append(f'{name}{{mode="image"}} {_total.pdf_image_pages}')
+        name = "pdf_image_tokens_saved_total"
+        lines += [f"# HELP {name} Estimated image tokens not sent thanks to PDF text layers", f"# TYPE {name} counter"]
+        lines.append(f"{name} {_total.image_tokens_saved}")
+
+        name = "anthropic_request_duration_seconds"
+        lines += [f"# HELP {name} Latency of successful model calls", f"# TYPE {name} histogram"]
+        for model, buckets in sorted(_latency_buckets.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{{model="{model}",le="{bound}"}} {cumulative}')
+            cumulative += buckets[-1]
+            lines.append(f'{name}_bucket{{model="{model}",le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{model="{model}"}} {_latency_sum[model]}')
+            lines.append(f'{name}_count{{model="{model}"}} {cumulative}')
+    return lines
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+
+from config import settings
+from services import job_service, results_store
+from services.dropbox_service import changes_since, latest_cursor, wait_for_changes
+from utils.sqlite_utils import connect
+
+logger = logging.getLogger(__name__)
+
+# Watch mode: one longpoll loop per folder in settings.watch_folders records added or changed files
+# as pending, and a flush loop turns the pending set into a job once uploads have been quiet for
+# watch_debounce_seconds (or the oldest file has waited watch_max_delay_seconds). Cursors and pending
+# files are stored, so nothing is lost or processed twice across restarts. The OAuth flow only hands
+# out short-lived tokens that are never stored, so watch_access_token must be a long-lived one.
+
+# Seconds to wait after a failed longpoll or listing before trying again
+RETRY_DELAY = 30.0
+
+_lock = threading.Lock()
+_conn = None
+_tasks: list[asyncio.Task] = []
+_changed: asyncio.Event | None = None
+_stats: Counter = Counter()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect("watch.sqlite3")
+        _conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS watch_cursors (
+                folder TEXT NOT NULL,
+                recursive INTEGER NOT NULL,
+                cursor TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (folder, recursive)
+            );
+            CREATE TABLE IF NOT EXISTS watch_pending (
+                file_path TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS watch_jobs (
+                job_id TEXT PRIMARY KEY,
+                files INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            """
+        )
+    return _conn
+
+
+def _execute(sql: str, params: tuple = ()) -> list:
+    with _lock:
+        return _db().execute(sql, params).fetchall()
+
+
+def _get_cursor(folder: str) -> str | None:
+    rows = _execute(
+        "SELECT cursor FROM watch_cursors WHERE folder = ? AND recursive = ?",
+        (folder.lower(), int(settings.watch_recursive)),
+    )
+    return rows[0]["cursor"] if rows else None
+
+
+def _save_cursor(folder: str, cursor: str) -> None:
+    _execute(
+        "INSERT OR REPLACE INTO watch_cursors (folder, recursive, cursor, updated_at) VALUES (?, ?, ?, ?)",
+        (folder.lower(), int(settings.watch_recursive), cursor, time.time()),
+    )
+
+
+def _queue(file_paths: list[str], deleted: list[str]) -> None:
+    """Record changed files as pending and drop deleted ones, here and from the results store."""
+    now = time.time()
+    with _lock:
+        _db().executemany(
+            "INSERT INTO watch_pending (file_path, first_seen, last_seen) VALUES (?, ?, ?)"
+            " ON CONFLICT (file_path) DO UPDATE SET last_seen = excluded.last_seen",
+            [(path, now, now) for path in file_paths],
+        )
+        _db().executemany("DELETE FROM watch_pending WHERE file_path = ?", [(path,) for path in deleted])
+    for path in deleted:
+        results_store.delete_file_results(path)
+    _stats["files_seen"] += len(file_paths)
+    _stats["files_deleted"] += len(deleted)
+    if file_paths and _changed is not None:
+        _changed.set()
+
+
+async def _in_daemon_thread(fn, *args):
+    """
+    Run a blocking call in a daemon thread. Unlike asyncio.to_thread, a longpoll still waiting
+    for its timeout when the app shuts down does not hold up interpreter exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run() -> None:
+        try:
+            result, error = fn(*args), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # the loop has closed
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+async def _watch_folder(folder: str) -> None:
+    token = settings.watch_access_token
+    recursive = settings.watch_recursive
+    cursor = _get_cursor(folder)
+    while True:
+        try:
+            if cursor is None and not settings.watch_process_existing:
+                # Start from the folder as it is now; files already there are left to manual batches
+                cursor = await asyncio.to_thread(latest_cursor, token, folder, recursive)
+                _save_cursor(folder, cursor)
+            changes, backoff = False, None
+            if cursor is not None:
+                changes, backoff = await _in_daemon_thread(
+                    wait_for_changes, token, cursor, settings.watch_longpoll_timeout
+                )
+                _stats["longpolls"] += 1
+            if cursor is None or changes:
+                files, deleted, cursor, _ = await asyncio.to_thread(changes_since, token, folder, recursive, cursor)
+                _queue([f.path for f in files if not f.is_folder], deleted)
+                _save_cursor(folder, cursor)
+            if backoff:
+                # Dropbox asks for this pause before the next longpoll
+                await asyncio.sleep(backoff)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Watching %s failed; retrying in %ss", folder, RETRY_DELAY)
+            _stats["errors"] += 1
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def _flush() -> str:
+    _settle_jobs()
+    paths = [row["file_path"] for row in _execute("SELECT file_path FROM watch_pending ORDER BY first_seen, file_path")]
+    job_id = job_service.create_job(settings.watch_access_token, paths, settings.watch_concurrency)
+    with _lock:
+        _db().execute(
+            "INSERT INTO watch_jobs (job_id, files, created_at) VALUES (?, ?, ?)", (job_id, len(paths), time.time())
+        )
+        _db().executemany("DELETE FROM watch_pending WHERE file_path = ?", [(path,) for path in paths])
+    _stats["jobs"] += 1
+    _stats["files_queued"] += len(paths)
+    logger.info("Watch job %s started for %d files", job_id, len(paths))
+    return job_id
+
+
+async def _flush_loop() -> None:
+    """Start a job for the pending files once uploads pause, so a burst becomes one job."""
+    while True:
+        (row,) = _execute("SELECT COUNT(*) AS n, MIN(first_seen) AS first, MAX(last_seen) AS last FROM watch_pending")
+        wait = None
+        if row["n"]:
+            due = min(row["last"] + settings.watch_debounce_seconds, row["first"] + settings.watch_max_delay_seconds)
+            wait = due - time.time()
+            if wait <= 0:
+                _flush()
+                continue
+        _changed.clear()
+        try:
+            await asyncio.wait_for(_changed.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _settle_jobs() -> None:
+    """
+    Settle the watch jobs that are no longer running: resume the ones a restart interrupted (the watcher,
+    unlike a browser session, still has its token), queue the unprocessed files of failed ones again,
+    and forget every job that has reached a final status.
+    """
+    for row in _execute("SELECT job_id FROM watch_jobs"):
+        job = job_service.get_job(row["job_id"])
+        if job is not None and job.status in job_service.ACTIVE_STATUSES:
+            continue
+        if job is not None and job.status == "interrupted":
+            job_service.resume_job(job.id, settings.watch_access_token)
+            continue
+        if job is not None and job.status == "failed":
+            unprocessed = [f.file_path for f in job_service.get_files(job.id) if f.status in ("pending", "running")]
+            _queue(unprocessed, [])
+            _stats["jobs_requeued"] += 1
+        _execute("DELETE FROM watch_jobs WHERE job_id = ?", (row["job_id"],))
+
+
+def start() -> None:
+    """Start watching settings.watch_folders (called from lifespan); does nothing when watch mode is not configured."""
+    global _changed
+    if not settings.watch_folders or not settings.watch_access_token or _tasks:
+        return
+    _changed = asyncio.Event()
+    _settle_jobs()
+    _tasks.append(asyncio.create_task(_flush_loop()))
+    for folder in settings.watch_folders:
+        _tasks.append(asyncio.create_task(_watch_folder(folder)))
+
+
+async def stop() -> None:
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+def status() -> dict:
+    (pending,) = _execute("SELECT COUNT(*) AS n FROM watch_pending")
+    return {
+        "running": bool(_tasks),
+        "folders": settings.watch_folders,
+        "pending": pending["n"],
+        **_stats,
+    }
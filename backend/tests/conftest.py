@@ -0,0 +1,17 @@
+import pytest
+
+from config import settings
+from services import category_service, duplicate_service, results_store
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Give each test its own data directory and fresh connections to the SQLite stores."""
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    modules = (category_service, duplicate_service, results_store)
+    for module in modules:
+        monkeypatch.setattr(module, "_conn", None)
+    yield tmp_path
+    for module in modules:
+        if module._conn is not None:
+            module._conn.close()
@@ -0,0 +1,87 @@
+import threading
+
+from config import settings
+from services.blob_cache import Blob, BlobCache
+
+
+class Fetcher:
+    def __init__(self, rev: str = "1") -> None:
+        self.rev = rev
+        self.calls = 0
+
+    def __call__(self) -> Blob:
+        self.calls += 1
+        return Blob(data=f"rev {self.rev}".encode(), name="a.jpg", media_type="image/jpeg", rev=self.rev)
+
+
+def test_cached_blob_is_served_while_it_validates():
+    cache, fetch = BlobCache(), Fetcher()
+    checked = []
+
+    def validate(blob: Blob) -> bool:
+        checked.append(blob.rev)
+        return blob.rev == fetch.rev
+
+    assert cache.get_or_fetch("token", "/A.jpg", fetch, validate).data == b"rev 1"
+    assert cache.get_or_fetch("token", "/a.jpg", fetch, validate).data == b"rev 1"
+    assert fetch.calls == 1
+    assert checked == ["1"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_replaced_file_is_downloaded_again():
+    cache, fetch = BlobCache(), Fetcher()
+    cache.get_or_fetch("token", "/a.jpg", fetch)
+    fetch.rev = "2"
+    blob = cache.get_or_fetch("token", "/a.jpg", fetch, validate=lambda blob: blob.rev == fetch.rev)
+    assert blob.data == b"rev 2"
+    assert fetch.calls == 2
+    # The stale blob was replaced, not kept alongside
+    assert cache.metrics()["entries"] == 1
+    assert cache.get("token", "/a.jpg").rev == "2"
+
+
+def test_entries_are_scoped_to_the_access_token():
+    cache, fetch = BlobCache(), Fetcher()
+    cache.get_or_fetch("token", "/a.jpg", fetch)
+    cache.get_or_fetch("other token", "/a.jpg", fetch)
+    assert fetch.calls == 2
+
+
+def test_expired_blob_is_fetched_again(monkeypatch):
+    cache, fetch = BlobCache(), Fetcher()
+    cache.get_or_fetch("token", "/a.jpg", fetch)
+    monkeypatch.setattr(settings, "blob_cache_ttl", -1)
+    cache.get_or_fetch("token", "/a.jpg", fetch)
+    assert fetch.calls == 2
+
+
+def test_concurrent_requests_share_one_download():
+    cache, release = BlobCache(), threading.Event()
+    fetch = Fetcher()
+
+    def slow_fetch() -> Blob:
+        release.wait(5)
+        return fetch()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_fetch("token", "/a.jpg", slow_fetch)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert fetch.calls == 1
+    assert [blob.data for blob in results] == [b"rev 1"] * 4
+
+
+def test_size_bound_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(settings, "blob_cache_max_bytes", 10)
+    cache = BlobCache()
+    for path in ("/a.jpg", "/b.jpg", "/c.jpg"):
+        cache.put("token", path, Blob(data=b"12345", name=path, media_type="image/jpeg"))
+    assert cache.get("token", "/a.jpg") is None
+    assert cache.metrics()["bytes"] == 10
@@ -0,0 +1,89 @@
+import csv
+import io
+
+from models.receipt import AccountingCategory, ReceiptResult
+from services import export_service
+from services.csv_service import CHUNK_SIZE, generate_csv, iter_csv
+
+
+def baseline_csv(results: list[ReceiptResult]) -> bytes:
+    """generate_csv as it was before it streamed, kept as the reference for the output format."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([
+        "No.", "ファイル名", "日付", "会社名・店名", "品目・但し書き", "金額（税込）",
+        "消費税額", "勘定科目", "分類理由", "信頼度", "手動修正",
+    ])
+    for i, r in enumerate(results, 1):
+        writer.writerow([
+            i,
+            r.file_name,
+            r.date or "",
+            r.company_name or "",
+            r.description or "",
+            r.amount if r.amount is not None else "",
+            r.tax_amount if r.tax_amount is not None else "",
+            r.category.value if r.category else "",
+            r.category_reason or "",
+            f"{r.confidence:.0%}" if r.confidence is not None else "",
+            "○" if r.is_manually_edited else "",
+        ])
+    writer.writerow([])
+    writer.writerow(["勘定科目別集計"])
+    writer.writerow(["勘定科目", "件数", "合計金額"])
+    category_totals: dict[str, tuple[int, int]] = {}
+    for r in results:
+        if r.category and r.amount is not None:
+            count, total = category_totals.get(r.category.value, (0, 0))
+            category_totals[r.category.value] = (count + 1, total + r.amount)
+    grand_total = 0
+    for cat, (count, total) in sorted(category_totals.items()):
+        writer.writerow([cat, count, total])
+        grand_total += total
+    writer.writerow(["合計", "", grand_total])
+    return output.getvalue().encode("cp932", errors="replace")
+
+
+def sample(count: int) -> list[ReceiptResult]:
+    categories = [*AccountingCategory, None]
+    return [
+        ReceiptResult(
+            id=str(i),
+            file_name=f"receipt_{i}.jpg",
+            file_path=f"/receipts/receipt_{i}.jpg",
+            company_name=["株式会社テスト", "Café, \"Bar\"", None][i % 3],
+            amount=None if i % 7 == 0 else i * 110,
+            tax_amount=None if i % 5 == 0 else i * 10,
+            date=None if i % 11 == 0 else f"2025-{i % 12 + 1:02d}-01",
+            # 🍣 is outside CP932 and is replaced the same way as before
+            description=["ランチ\n2名", "🍣", "", None][i % 4],
+            category=categories[i % len(categories)],
+            category_reason="過去の分類実績に基づく" if i % 2 else None,
+            confidence=None if i % 6 == 0 else (i % 100) / 100,
+            is_manually_edited=i % 9 == 0,
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def test_csv_matches_the_baseline_byte_for_byte():
+    results = sample(60)
+    assert generate_csv(results) == baseline_csv(results)
+
+
+def test_streamed_csv_matches_the_baseline_across_chunks():
+    results = sample(2000)
+    chunks = list(iter_csv(iter(results)))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= CHUNK_SIZE for chunk in chunks[:-1])
+    assert b"".join(chunks) == baseline_csv(results)
+
+
+def test_csv_export_matches_the_baseline():
+    results = sample(300)
+    export = export_service.export(iter(results), "csv")
+    assert b"".join(export.chunks) == baseline_csv(results)
+
+
+def test_empty_csv_matches_the_baseline():
+    assert generate_csv([]) == baseline_csv([])
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from config import settings
+from models.receipt import ReceiptResult
+from services import duplicate_service
+from services.duplicate_service import BAND_BITS, HASH_BITS, confirm_image_match, find_similar_image, register_image
+
+HASH = random.Random(0).getrandbits(HASH_BITS)
+
+
+def flip(image_hash: int, bands: int) -> int:
+    """Flip one bit in each of the first `bands` bands, so the hash differs in `bands` bits and bands."""
+    for band in range(bands):
+        image_hash ^= 1 << (band * BAND_BITS + band % BAND_BITS)
+    return image_hash
+
+
+def receipt(file_path: str, date: str | None, amount: int | None) -> ReceiptResult:
+    return ReceiptResult(id=f"{file_path}:{date}:{amount}", file_name=file_path, file_path=file_path, date=date, amount=amount)
+
+
+@pytest.fixture(autouse=True)
+def distance(monkeypatch):
+    monkeypatch.setattr(settings, "duplicate_detection_enabled", True)
+    monkeypatch.setattr(settings, "duplicate_hash_distance", 12)
+
+
+def test_near_hash_is_found_through_a_shared_band():
+    register_image(HASH, "/a.jpg", "a.jpg")
+    # 12 of the 16 bands differ; the candidate comes from one of the other four
+    near = flip(HASH, 12)
+    register_image(near, "/b.jpg", "b.jpg")
+    match = find_similar_image(near, "/b.jpg")
+    assert (match.file_path, match.distance) == ("/a.jpg", 12)
+
+
+def test_hash_beyond_the_distance_is_not_a_match():
+    register_image(HASH, "/a.jpg", "a.jpg")
+    far = flip(HASH, 13)
+    register_image(far, "/b.jpg", "b.jpg")
+    assert find_similar_image(far, "/b.jpg") is None
+
+
+def test_only_the_later_copy_is_matched():
+    register_image(HASH, "/a.jpg", "a.jpg")
+    register_image(flip(HASH, 2), "/b.jpg", "b.jpg")
+    assert find_similar_image(HASH, "/a.jpg") is None
+    # Registering the first file again keeps its place as the earlier copy
+    register_image(HASH, "/a.jpg", "a.jpg")
+    assert find_similar_image(flip(HASH, 2), "/b.jpg").file_path == "/a.jpg"
+
+
+def test_closest_candidate_wins():
+    register_image(flip(HASH, 8), "/far.jpg", "far.jpg")
+    register_image(flip(HASH, 3), "/near.jpg", "near.jpg")
+    match = find_similar_image(HASH, "/new.jpg")
+    assert (match.file_path, match.distance) == ("/near.jpg", 3)
+
+
+def test_match_is_confirmed_by_date_and_amount():
+    register_image(HASH, "/a.jpg", "a.jpg")
+    duplicate_service.flag_results([receipt("/a.jpg", "2025-04-01", 1100)], "/a.jpg")
+    register_image(flip(HASH, 1), "/b.jpg", "b.jpg")
+    match = find_similar_image(flip(HASH, 1), "/b.jpg")
+
+    same = receipt("/b.jpg", "2025/4/1", 1100)
+    other_amount = receipt("/b.jpg", "2025-04-01", 1200)
+    other_date = receipt("/b.jpg", "2025-04-02", 1100)
+    unread = receipt("/b.jpg", None, None)
+    confirm_image_match([same, other_amount, other_date, unread], match)
+    assert same.duplicate_of == "/a.jpg"
+    assert other_amount.duplicate_of is other_date.duplicate_of is unread.duplicate_of is None
+
+
+def test_disabled_detection_finds_nothing(monkeypatch):
+    register_image(HASH, "/a.jpg", "a.jpg")
+    monkeypatch.setattr(settings, "duplicate_detection_enabled", False)
+    assert find_similar_image(HASH, "/b.jpg") is None
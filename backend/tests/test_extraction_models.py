@@ -0,0 +1,36 @@
+import pytest
+
+from models.extraction_models import ReceiptExtraction, SuicaTransaction, _to_int
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("¥1,100", 1100),
+        ("1100.0", 1100),
+        ("1,100円", 1100),
+        ("１，１００円", 1100),
+        ("-500", -500),
+        ("−500", -500),
+        # Rates and bracketed notes carry numbers that are not the amount
+        ("1,100円(内税100円)", 1100),
+        ("1,100円（8%対象）", 1100),
+        ("合計 1,100円 (税率10%)", 1100),
+        (1100.7, 1100),
+        (1100, 1100),
+        (None, None),
+    ],
+)
+def test_to_int_repairs_amounts(value, expected):
+    assert _to_int(value) == expected
+
+
+@pytest.mark.parametrize("value", ["1,000 / 1,100", "なし", ""])
+def test_to_int_gives_none_when_ambiguous_or_missing(value):
+    assert _to_int(value) is None
+
+
+def test_amount_fields_are_repaired_on_validation():
+    extracted = ReceiptExtraction.model_validate({"amount": "¥1,100", "tax_amount": "(内税)100円"})
+    assert (extracted.amount, extracted.tax_amount) == (1100, 100)
+    assert SuicaTransaction.model_validate({"amount": "-210", "balance": "¥9,790"}).balance == 9790
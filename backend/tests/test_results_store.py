@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from models.receipt import AccountingCategory, ReceiptResult
+from models.result_models import ResultUpdate
+from services import results_store
+from services.duplicate_service import normalize_date
+
+FOOD = AccountingCategory.MEETING
+TRAIN = AccountingCategory.TRANSPORTATION
+
+
+def receipt(id: str, file_path: str, date: str | None, category: AccountingCategory | None, amount: int | None) -> ReceiptResult:
+    return ReceiptResult(
+        id=id, file_name=file_path.rsplit("/", 1)[-1], file_path=file_path,
+        company_name="カフェ", date=date, category=category, amount=amount,
+    )
+
+
+def recomputed() -> tuple[dict, dict]:
+    """Totals recomputed from every stored result, to check the incremental ones against."""
+    monthly, by_category = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+    for result in results_store.iter_results():
+        if result.amount is None:
+            continue
+        if date := normalize_date(result.date):
+            monthly[date[:7]][0] += 1
+            monthly[date[:7]][1] += result.amount
+        if result.category:
+            by_category[result.category][0] += 1
+            by_category[result.category][1] += result.amount
+    return dict(monthly), dict(by_category)
+
+
+def totals() -> tuple[dict, dict]:
+    monthly = {t.month: [t.count, t.total_amount] for t in results_store.monthly_totals()}
+    by_category = {t.category: [t.count, t.total_amount] for t in results_store.category_totals()}
+    return monthly, by_category
+
+
+def seed() -> None:
+    results_store.save_file_results("/a.pdf", [
+        receipt("a1", "/a.pdf", "2025-04-01", FOOD, 1100),
+        receipt("a2", "/a.pdf", "2025-04-20", TRAIN, 210),
+    ])
+    results_store.save_file_results("/b.jpg", [receipt("b1", "/b.jpg", "2025/5/3", FOOD, 880)])
+    results_store.save_file_results("/c.jpg", [receipt("c1", "/c.jpg", None, TRAIN, 500)])
+    results_store.save_file_results("/d.jpg", [receipt("d1", "/d.jpg", "2025-05-09", FOOD, None)])
+
+
+def test_totals_are_kept_per_month_and_category():
+    seed()
+    monthly, by_category = totals()
+    assert monthly == {"2025-04": [2, 1310], "2025-05": [1, 880]}
+    assert by_category == {FOOD: [2, 1980], TRAIN: [2, 710]}
+    assert totals() == recomputed()
+    assert [t.month for t in results_store.monthly_totals("2025")] == ["2025-04", "2025-05"]
+    assert results_store.category_totals(from_month="2025-05", to_month="2025-05")[0].total_amount == 880
+
+
+def test_reprocessing_a_file_replaces_its_contribution():
+    seed()
+    results_store.save_file_results("/a.pdf", [receipt("a3", "/a.pdf", "2025-04-01", FOOD, 1000)])
+    monthly, by_category = totals()
+    assert monthly["2025-04"] == [1, 1000]
+    assert TRAIN not in {t.category for t in results_store.category_totals(to_month="2025-04")}
+    assert totals() == recomputed()
+
+
+def test_edit_moves_the_result_between_totals():
+    seed()
+    edited = results_store.update_result("a1", ResultUpdate(date="2025-05-10", category=TRAIN, amount=1200))
+    assert edited.is_manually_edited
+    monthly, by_category = totals()
+    assert monthly == {"2025-04": [1, 210], "2025-05": [2, 2080]}
+    assert by_category == {FOOD: [1, 880], TRAIN: [3, 1910]}
+    assert totals() == recomputed()
+    assert results_store.update_result("missing", ResultUpdate(amount=1)) is None
+
+
+def test_edited_file_keeps_its_results_when_reprocessed():
+    seed()
+    results_store.update_result("b1", ResultUpdate(amount=900))
+    kept = results_store.save_file_results("/b.jpg", [receipt("b2", "/b.jpg", "2025-05-03", FOOD, 1)])
+    assert [(r.id, r.amount) for r in kept] == [("b1", 900)]
+    assert totals() == recomputed()
+
+
+def test_deleting_a_folder_removes_its_totals():
+    results_store.save_file_results("/2025/a.jpg", [receipt("a1", "/2025/a.jpg", "2025-04-01", FOOD, 100)])
+    results_store.save_file_results("/2025_old/b.jpg", [receipt("b1", "/2025_old/b.jpg", "2025-04-02", FOOD, 200)])
+    assert results_store.delete_file_results("/2025/") == 1
+    assert totals() == ({"2025-04": [1, 200]}, {FOOD: [1, 200]})
+
+
+def test_with_stored_edits_applies_manual_edits():
+    seed()
+    results_store.update_result("a2", ResultUpdate(amount=420))
+    unstored = receipt("x1", "/x.jpg", "2025-06-01", FOOD, 1)
+    given = [receipt("a1", "/a.pdf", "2025-04-01", FOOD, 1100), receipt("a2", "/a.pdf", "2025-04-20", TRAIN, 210), unstored]
+    merged = list(results_store.with_stored_edits(given, page_size=2))
+    assert [(r.id, r.amount, r.is_manually_edited) for r in merged] == [
+        ("a1", 1100, False), ("a2", 420, True), ("x1", 1, False),
+    ]
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from services import routing_service
+from services.routing_service import RoutePlan, filename_plan, is_statement_text, plan_from_layouts, plan_route
+from utils.layout_utils import PageLayout
+
+MULTI_NAME = "2025-04-01 10.20.30.pdf"
+SUICA_NAME = "JE80FB21040250463_202504.pdf"
+
+
+def layout(ink=0.05, width=0.6, height=0.6, top=0.2, bottom=0.2) -> PageLayout:
+    return PageLayout(
+        width=600, height=848, ink=ink, text_rows=20,
+        content_width=width, content_height=height, top_margin=top, bottom_margin=bottom,
+    )
+
+
+def photo() -> PageLayout:
+    return layout(width=0.95, height=0.95, top=0.01, bottom=0.01)
+
+
+def statement_lines(rows: int = 10) -> list[str]:
+    balance, lines = 10000, []
+    for day in range(1, rows + 1):
+        balance -= 210
+        lines.append(f"04/{day:02d} JR東日本 渋谷 新宿 -210 {balance:,}")
+    return ["\n".join(lines)]
+
+
+def test_single_document_keeps_all_content_pages_together():
+    plan = plan_from_layouts([layout(), layout(), layout()], "invoice.pdf")
+    assert (plan.kind, plan.groups, plan.reason) == ("single", [[1, 2, 3]], "one document")
+
+
+def test_blank_pages_are_not_sent():
+    plan = plan_from_layouts([layout(), layout(ink=0.0005), layout()], "invoice.pdf")
+    assert plan.groups == [[1, 3]]
+
+
+def test_all_blank_pages_still_send_the_first():
+    plan = plan_from_layouts([layout(ink=0.0), layout(ink=0.0)], "invoice.pdf")
+    assert plan.groups == [[1]]
+
+
+def test_photo_pages_are_split_into_receipts():
+    plan = plan_from_layouts([photo(), photo(), photo()], "scans.pdf")
+    assert (plan.kind, plan.groups) == ("multi", [[1], [2], [3]])
+    assert plan.reason == "3 receipts (photo pages)"
+
+
+def test_multi_receipt_filename_joins_pages_that_run_over_the_break():
+    pages = [layout(bottom=0.01), layout(top=0.01), layout(), layout()]
+    plan = plan_from_layouts(pages, MULTI_NAME)
+    assert (plan.kind, plan.groups) == ("multi", [[1, 2], [3], [4]])
+    assert plan.reason == "3 receipts (filename)"
+
+
+def test_multi_receipt_filename_with_one_receipt_is_single():
+    plan = plan_from_layouts([layout(bottom=0.01), layout(top=0.01)], MULTI_NAME)
+    assert (plan.kind, plan.groups, plan.reason) == ("single", [[1, 2]], "one receipt")
+
+
+def test_statement_rows_in_text_layer_route_to_statement_prompt():
+    plan = plan_from_layouts([layout(), layout()], "statement.pdf", statement_lines())
+    assert (plan.kind, plan.groups, plan.reason) == ("suica", [[1, 2]], "statement rows")
+
+
+def test_statement_filename_wins_over_layout():
+    plan = plan_from_layouts([photo(), photo()], SUICA_NAME)
+    assert (plan.kind, plan.reason) == ("suica", "filename")
+
+
+def test_statement_text_needs_enough_rows():
+    assert is_statement_text(statement_lines(10))
+    assert not is_statement_text(statement_lines(5))
+
+
+def test_itemized_invoice_is_not_a_statement():
+    # Dated, priced rows without a running balance
+    lines = [f"04/{day:02d} コピー用紙 {day} 1,100" for day in range(1, 12)]
+    assert not is_statement_text(["\n".join(lines)])
+
+
+@pytest.fixture
+def analysed(monkeypatch):
+    """Stub the PDF analysis (poppler is not needed) and count how often it runs."""
+    calls = []
+
+    async def run_inline(func, *args):
+        return func(*args)
+
+    def analyze_pdf(file_bytes):
+        calls.append(file_bytes)
+        return [photo(), photo()]
+
+    monkeypatch.setattr(routing_service, "_memo", type(routing_service._memo)())
+    monkeypatch.setattr(routing_service, "run_in_image_pool", run_inline)
+    monkeypatch.setattr(routing_service, "analyze_pdf", analyze_pdf)
+    monkeypatch.setattr(routing_service, "pdf_text_layer", lambda file_bytes: ["", ""])
+    return calls
+
+
+def test_plan_route_memoizes_by_content(analysed):
+    first = asyncio.run(plan_route(b"pdf", "scans.pdf", "hash"))
+    again = asyncio.run(plan_route(b"pdf", "copy of scans.pdf", "hash"))
+    assert len(analysed) == 1
+    assert (again.kind, again.groups) == (first.kind, first.groups) == ("multi", [[1], [2]])
+    # The text layer is handed to the caller that read it, not kept in the memo
+    assert first.texts == ["", ""]
+    assert again.texts is None
+
+
+def test_plan_route_memo_key_includes_filename_routing(analysed):
+    # Same content: a statement filename must not reuse the plan memoized for an ordinary name
+    plain = asyncio.run(plan_route(b"pdf", "scans.pdf", "hash"))
+    statement = asyncio.run(plan_route(b"pdf", SUICA_NAME, "hash"))
+    assert len(analysed) == 2
+    assert plain.kind == "multi"
+    assert statement.kind == "suica"
+
+
+def test_plan_route_falls_back_to_filename(analysed, monkeypatch):
+    def broken(file_bytes):
+        raise RuntimeError("no poppler")
+
+    monkeypatch.setattr(routing_service, "analyze_pdf", broken)
+    assert asyncio.run(plan_route(b"pdf", MULTI_NAME, "hash")) == RoutePlan("multi", None, "filename")
+    assert asyncio.run(plan_route(b"img", "receipt.jpg", "other")) == filename_plan("receipt.jpg")
@@ -0,0 +1,46 @@
+from services.ocr_service import merge_band_rows
+from utils.layout_utils import TableBand
+
+
+def band(page: int, overlap_rows: int = 0) -> TableBand:
+    return TableBand(page=page, image=("", "image/png"), header=None, overlap_rows=overlap_rows)
+
+
+def tx(date: str, amount: int, balance: int) -> dict:
+    return {"date": date, "amount": amount, "balance": balance}
+
+
+def test_overlap_rows_are_dropped():
+    first = [tx("2025-04-01", -210, 9790), tx("2025-04-01", -170, 9620), tx("2025-04-02", -210, 9410)]
+    second = [tx("2025-04-01", -170, 9620), tx("2025-04-02", -210, 9410), tx("2025-04-03", 3000, 12410)]
+    merged = merge_band_rows([band(1), band(1, overlap_rows=2)], [first, second])
+    assert merged == [*first, tx("2025-04-03", 3000, 12410)]
+
+
+def test_one_extra_row_of_slack_for_a_cut_row():
+    first = [tx("2025-04-01", -210, 9790), tx("2025-04-01", -170, 9620), tx("2025-04-02", -210, 9410)]
+    second = [tx("2025-04-01", -170, 9620), tx("2025-04-02", -210, 9410), tx("2025-04-03", -150, 9260)]
+    merged = merge_band_rows([band(1), band(1, overlap_rows=1)], [first, second])
+    assert merged == [*first, tx("2025-04-03", -150, 9260)]
+
+
+def test_same_fare_on_the_same_day_is_kept():
+    # Two identical commutes differ only by the running balance
+    first = [tx("2025-04-01", -210, 9790)]
+    second = [tx("2025-04-01", -210, 9580), tx("2025-04-01", -210, 9370)]
+    merged = merge_band_rows([band(1), band(1, overlap_rows=1)], [first, second])
+    assert merged == [*first, *second]
+
+
+def test_sign_of_the_amount_does_not_hide_an_overlap():
+    first = [tx("2025-04-01", -210, 9790)]
+    second = [tx("2025-04-01", 210, 9790), tx("2025-04-02", -170, 9620)]
+    merged = merge_band_rows([band(1), band(1, overlap_rows=1)], [first, second])
+    assert merged == [*first, tx("2025-04-02", -170, 9620)]
+
+
+def test_bands_of_a_new_page_are_not_deduplicated():
+    first = [tx("2025-04-01", -210, 9790)]
+    second = [tx("2025-04-01", -210, 9790)]
+    merged = merge_band_rows([band(1), band(2, overlap_rows=1)], [first, second])
+    assert merged == [*first, *second]
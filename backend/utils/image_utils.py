@@ -1,34 +1,266 @@
+import asyncio
 import base64
 import io
+import logging
+import math
+import re
+import subprocess
+import tempfile
+import time
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-from PIL import Image
+from PIL import Image, ImageFilter, ImageOps
 
+from config import settings
 
-def prepare_image_base64(file_bytes: bytes, file_name: str) -> list[tuple[str, str]]:
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_SIZE = 1568
+PDF_MAX_DPI = 200
+EXIF_ORIENTATION_TAG = 0x0112
+# Formats the Vision API accepts directly, and the largest file sent without re-encoding
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+PASSTHROUGH_MAX_BYTES = 1024 * 1024
+# PDF pages with a text layer are sent as text (media type TEXT_MEDIA_TYPE in the (data, media_type) pairs),
+# optionally with a grayscale thumbnail this many pixels on the longest side
+TEXT_MEDIA_TYPE = "text/plain"
+TEXT_THUMBNAIL_SIZE = 512
+# A page needs this many non-space characters, at most this share of them undecodable, to count as text
+TEXT_LAYER_MIN_CHARS = 40
+TEXT_LAYER_MAX_GARBAGE = 0.05
+# dHash compares horizontally adjacent pixels of a (DHASH_SIZE + 1) x DHASH_SIZE thumbnail: 256 bits
+DHASH_SIZE = 16
+# The receipt region is found on a grayscale copy this many pixels on the longest side
+DHASH_CROP_SIZE = 256
+
+_process_pool: ProcessPoolExecutor | None = None
+_current_timings: ContextVar[dict[str, float] | None] = ContextVar("preprocess_timings", default=None)
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.image_workers)
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Stop the image worker processes (called on app shutdown)."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+
+def start_timings() -> dict[str, float]:
+    """Begin collecting preprocessing stage timings (seconds per stage) for the current batch."""
+    timings: dict[str, float] = {}
+    _current_timings.set(timings)
+    return timings
+
+
+def _merge_timings(timings: dict[str, float]) -> None:
+    batch = _current_timings.get()
+    if batch is not None:
+        for stage, seconds in timings.items():
+            batch[stage] = batch.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def _timed(timings: dict[str, float] | None, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+async def run_in_image_pool(func, *args):
+    """Run a CPU-bound image function (picklable, module-level) in the image process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_process_pool(), func, *args)
+
+
+async def prepare_image_base64_async(file_bytes: bytes, file_name: str) -> list[tuple[str, str]]:
+    """Run prepare_image_base64 in the image process pool so decoding and resizing stay off the event loop."""
+    images, timings = await run_in_image_pool(prepare_image_with_timings, file_bytes, file_name)
+    _merge_timings(timings)
+    logger.debug("Preprocessed %s: %s", file_name, {k: f"{v * 1000:.1f}ms" for k, v in timings.items()})
+    return images
+
+
+async def prepare_image_with_hash_async(file_bytes: bytes, file_name: str) -> tuple[list[tuple[str, str]], int | None]:
+    """prepare_image_base64_async plus the image's perceptual hash (None for PDFs), computed in the same worker."""
+    images, timings, image_hash = await run_in_image_pool(prepare_image_with_hash, file_bytes, file_name)
+    _merge_timings(timings)
+    return images, image_hash
+
+
+def prepare_image_with_timings(file_bytes: bytes, file_name: str) -> tuple[list[tuple[str, str]], dict[str, float]]:
+    timings: dict[str, float] = {}
+    return prepare_image_base64(file_bytes, file_name, timings), timings
+
+
+def prepare_image_with_hash(file_bytes: bytes, file_name: str) -> tuple[list[tuple[str, str]], dict[str, float], int | None]:
+    images, timings = prepare_image_with_timings(file_bytes, file_name)
+    if file_name.lower().endswith(".pdf"):
+        return images, timings, None
+    with _timed(timings, "dhash"):
+        image_hash = dhash_bytes(file_bytes)
+    return images, timings, image_hash
+
+
+def _otsu_threshold(gray: Image.Image) -> int:
+    """Gray level that best separates the histogram into two classes (paper and background)."""
+    histogram = gray.histogram()
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    best_level, best_variance = 128, 0.0
+    below = weighted_below = 0
+    for level, count in enumerate(histogram):
+        below += count
+        weighted_below += level * count
+        if below == 0 or below == total:
+            continue
+        mean_below = weighted_below / below
+        mean_above = (weighted_total - weighted_below) / (total - below)
+        variance = below * (total - below) * (mean_below - mean_above) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def receipt_region(image: Image.Image) -> Image.Image:
+    """
+    Crop to the bright paper, so a photo of a receipt on a table and a scan of it hash alike.
+    Images that are all paper (scans) come back as they are.
+    """
+    gray = image.convert("L")
+    gray.thumbnail((DHASH_CROP_SIZE, DHASH_CROP_SIZE))
+    threshold = _otsu_threshold(gray)
+    # The min filter erases text strokes and specks so only solid paper is left in the mask
+    mask = gray.point(lambda p: 255 if p > threshold else 0).filter(ImageFilter.MinFilter(5))
+    box = mask.getbbox()
+    if box is None:
+        return image
+    scale_x, scale_y = image.width / gray.width, image.height / gray.height
+    return image.crop((
+        int(box[0] * scale_x), int(box[1] * scale_y), math.ceil(box[2] * scale_x), math.ceil(box[3] * scale_y),
+    ))
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    256-bit difference hash: one bit per horizontally adjacent pixel pair of a small grayscale thumbnail
+    of the receipt region. Re-encoded, resized or recropped copies of an image differ in only a few bits.
+    It captures layout, not text: different receipts printed in the same layout can hash alike, so a
+    match is only a candidate to confirm against extracted fields.
+    """
+    small = receipt_region(image).convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + col]
+            value = (value << 1) | (left > pixels[row * (DHASH_SIZE + 1) + col + 1])
+    return value
+
+
+def dhash_bytes(file_bytes: bytes) -> int:
+    """dHash of an image file, decoded at reduced size (JPEG draft mode) with EXIF orientation applied."""
+    image = Image.open(io.BytesIO(file_bytes))
+    if image.format == "JPEG":
+        image.draft("L", (DHASH_CROP_SIZE * 2, DHASH_CROP_SIZE * 2))
+    return dhash(ImageOps.exif_transpose(image))
+
+
+def prepare_image_base64(file_bytes: bytes, file_name: str, timings: dict[str, float] | None = None) -> list[tuple[str, str]]:
     """
     Prepare image(s) as base64 for Claude Vision API.
     For PDFs, converts each page to an image.
+    Images that already fit the API limits are passed through byte-for-byte;
+    otherwise JPEGs are reduced at decode time (draft mode), EXIF orientation is applied,
+    and the smaller of the candidate output formats is kept.
+    If timings is given, seconds spent per stage are added to it.
     Returns list of (base64_data, media_type) tuples.
     """
     ext = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
 
     if ext == "pdf":
-        return _pdf_to_images_base64(file_bytes)
+        return list(iter_pdf_pages_base64(file_bytes, timings))
 
-    image = Image.open(io.BytesIO(file_bytes))
-    image = _resize_if_needed(image)
+    with _timed(timings, "open"):
+        image = Image.open(io.BytesIO(file_bytes))
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+    if _can_pass_through(image, len(file_bytes), orientation):
+        with _timed(timings, "passthrough"):
+            return [(base64.b64encode(file_bytes).decode(), PASSTHROUGH_FORMATS[image.format])]
+
+    with _timed(timings, "decode"):
+        if image.format == "JPEG":
+            # Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding
+            w, h = image.size
+            ratio = min(1.0, MAX_IMAGE_SIZE / max(w, h))
+            image.draft("RGB", (int(w * ratio), int(h * ratio)))
+        image.load()
+
+    if orientation != 1:
+        with _timed(timings, "orient"):
+            image = ImageOps.exif_transpose(image)
 
+    with _timed(timings, "resize"):
+        image = _resize_if_needed(image)
+
+    with _timed(timings, "encode"):
+        data, media_type = _encode_smallest(image, prefer_png=ext == "png")
+
+    return [(base64.b64encode(data).decode(), media_type)]
+
+
+def _can_pass_through(image: Image.Image, size_bytes: int, orientation: int) -> bool:
+    """The original bytes are usable as-is: supported format, within size limits, no rotation pending."""
+    return (
+        image.format in PASSTHROUGH_FORMATS
+        and max(image.size) <= MAX_IMAGE_SIZE
+        and size_bytes <= PASSTHROUGH_MAX_BYTES
+        and orientation == 1
+        and not getattr(image, "is_animated", False)
+    )
+
+
+def _encode_smallest(image: Image.Image, prefer_png: bool = False) -> tuple[bytes, str]:
+    """
+    Encode as JPEG, and also as PNG for images where lossless may win (PNG sources, line art,
+    palette or alpha images); return whichever is smaller.
+    """
+    candidates: list[tuple[bytes, str]] = []
+
+    if prefer_png or image.mode in ("1", "L", "P", "LA", "PA", "RGBA"):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        candidates.append((buffer.getvalue(), "image/png"))
+
+    rgb = image
+    if image.mode in ("RGBA", "LA", "PA", "P"):
+        rgb = image.convert("RGBA")
+        background = Image.new("RGB", rgb.size, "white")
+        background.paste(rgb, mask=rgb.getchannel("A"))
+        rgb = background
+    elif image.mode not in ("RGB", "L"):
+        rgb = image.convert("RGB")
     buffer = io.BytesIO()
-    fmt = "PNG" if ext == "png" else "JPEG"
-    media_type = "image/png" if ext == "png" else "image/jpeg"
-    if image.mode == "RGBA" and fmt == "JPEG":
-        image = image.convert("RGB")
-    image.save(buffer, format=fmt, quality=85)
+    rgb.save(buffer, format="JPEG", quality=85)
+    candidates.append((buffer.getvalue(), "image/jpeg"))
 
-    return [(base64.b64encode(buffer.getvalue()).decode(), media_type)]
+    return min(candidates, key=lambda c: len(c[0]))
 
 
-def _resize_if_needed(image: Image.Image, max_size: int = 1568) -> Image.Image:
+def _resize_if_needed(image: Image.Image, max_size: int = MAX_IMAGE_SIZE) -> Image.Image:
     """Resize image if any dimension exceeds max_size."""
     w, h = image.size
     if w <= max_size and h <= max_size:
@@ -38,17 +270,155 @@ def _resize_if_needed(image: Image.Image, max_size: int = 1568) -> Image.Image:
     return image.resize(new_size, Image.LANCZOS)
 
 
-def _pdf_to_images_base64(file_bytes: bytes) -> list[tuple[str, str]]:
-    """Convert PDF pages to base64 images."""
-    from pdf2image import convert_from_bytes
+def pdf_render_dpi(page_size: str | None, max_size: int = MAX_IMAGE_SIZE) -> int:
+    """
+    DPI at which the page's longest side comes out at max_size pixels (capped at PDF_MAX_DPI),
+    so pages are rendered at the target resolution instead of rendered large and downscaled.
+    page_size is pdfinfo's "Page size" value, e.g. "595.276 x 841.89 pts (A4)".
+    """
+    match = re.match(r"\s*([\d.]+) x ([\d.]+) pts", page_size or "")
+    if not match:
+        return PDF_MAX_DPI
+    longest_pt = max(float(match.group(1)), float(match.group(2)))
+    return max(1, min(PDF_MAX_DPI, int(max_size * 72 / longest_pt)))
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Approximate input tokens of an image (width * height / 750)."""
+    return math.ceil(width * height / 750)
 
-    images = convert_from_bytes(file_bytes, dpi=200)
 
-    results: list[tuple[str, str]] = []
-    for img in images:
+def _page_size_points(page_size: str | None) -> tuple[float, float]:
+    match = re.match(r"\s*([\d.]+) x ([\d.]+) pts", page_size or "")
+    return (float(match.group(1)), float(match.group(2))) if match else (595.276, 841.89)
+
+
+def _render_page_base64(
+    file_bytes: bytes, page: int, dpi: int, timings: dict[str, float] | None, grayscale: bool = False
+) -> tuple[str, str]:
+    from pdf2image import convert_from_bytes
+
+    with _timed(timings, "pdf_render"):
+        (img,) = convert_from_bytes(file_bytes, dpi=dpi, first_page=page, last_page=page, grayscale=grayscale)
+    with _timed(timings, "resize"):
         img = _resize_if_needed(img)
+    with _timed(timings, "encode"):
         buffer = io.BytesIO()
         img.save(buffer, format="JPEG", quality=85)
-        results.append((base64.b64encode(buffer.getvalue()).decode(), "image/jpeg"))
+        img.close()
+    return base64.b64encode(buffer.getvalue()).decode(), "image/jpeg"
+
+
+def iter_pdf_pages_base64(
+    file_bytes: bytes, timings: dict[str, float] | None = None, pages: list[int] | None = None
+) -> Iterator[tuple[str, str]]:
+    """
+    Render a PDF one page at a time, yielding (base64_data, media_type) per page.
+    Only one rendered page is held in memory, whatever the page count.
+    pages (1-based) limits rendering to those pages, in that order.
+    """
+    from pdf2image import pdfinfo_from_bytes
+
+    with _timed(timings, "pdf_info"):
+        info = pdfinfo_from_bytes(file_bytes)
+        dpi = pdf_render_dpi(info.get("Page size"))
+
+    for page in pages or range(1, int(info["Pages"]) + 1):
+        yield _render_page_base64(file_bytes, page, dpi, timings)
+
+
+def _compact_text(text: str) -> str:
+    """pdftotext -layout output with trailing spaces, wide column gaps and repeated blank lines squeezed."""
+    lines = [re.sub(r" {3,}", "  ", line.rstrip()) for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _is_text_page(text: str) -> bool:
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return False
+    return chars.count("\ufffd") <= TEXT_LAYER_MAX_GARBAGE * len(chars)
+
+
+def pdf_text_layer(file_bytes: bytes) -> list[str]:
+    """
+    Compacted text layer of every page (poppler's pdftotext), "" for pages without a usable one
+    (scans, or text that does not decode). Empty when settings.pdf_text_layer_mode is "off" or
+    the text cannot be extracted, so every page is rendered as before.
+    """
+    if settings.pdf_text_layer_mode == "off":
+        return []
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(file_bytes)
+        f.flush()
+        try:
+            output = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", f.name, "-"], capture_output=True, check=True, timeout=60
+            ).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("PDF text layer extraction failed: %s", e)
+            return []
+    # Every page ends with a form feed
+    pages = [_compact_text(page) for page in output.decode("utf-8", "replace").split("\f")[:-1]]
+    return [page if _is_text_page(page) else "" for page in pages]
+
+
+def iter_pdf_page_parts(
+    file_bytes: bytes,
+    texts: list[str],
+    timings: dict[str, float] | None = None,
+    pages: list[int] | None = None,
+    stats: dict[str, int] | None = None,
+) -> Iterator[list[tuple[str, str]]]:
+    """
+    Like iter_pdf_pages_base64, but yields the parts sent for each page. A page with a text layer
+    (texts from pdf_text_layer) is sent as (text, TEXT_MEDIA_TYPE), after a small grayscale thumbnail
+    in "thumbnail" mode; other pages are rendered in full.
+    stats, if given, gets text_pages, image_pages and the estimated image_tokens_saved added to it.
+    """
+    from pdf2image import pdfinfo_from_bytes
+
+    with _timed(timings, "pdf_info"):
+        info = pdfinfo_from_bytes(file_bytes)
+        dpi = pdf_render_dpi(info.get("Page size"))
+        thumbnail_dpi = pdf_render_dpi(info.get("Page size"), max_size=TEXT_THUMBNAIL_SIZE)
+    width_pt, height_pt = _page_size_points(info.get("Page size"))
+    scale = min(1.0, MAX_IMAGE_SIZE / (max(width_pt, height_pt) * dpi / 72))
+    full_tokens = image_tokens(int(width_pt * dpi / 72 * scale), int(height_pt * dpi / 72 * scale))
+    if stats is not None:
+        for key in ("text_pages", "image_pages", "image_tokens_saved"):
+            stats.setdefault(key, 0)
+
+    for page in pages or range(1, int(info["Pages"]) + 1):
+        text = texts[page - 1] if page <= len(texts) else ""
+        if not text:
+            if stats is not None:
+                stats["image_pages"] += 1
+            yield [_render_page_base64(file_bytes, page, dpi, timings)]
+            continue
+
+        parts = []
+        sent_tokens = len(text)  # ~1 token per character of Japanese-heavy text
+        if settings.pdf_text_layer_mode == "thumbnail":
+            parts.append(_render_page_base64(file_bytes, page, thumbnail_dpi, timings, grayscale=True))
+            sent_tokens += image_tokens(int(width_pt * thumbnail_dpi / 72), int(height_pt * thumbnail_dpi / 72))
+        parts.append((text, TEXT_MEDIA_TYPE))
+        if stats is not None:
+            stats["text_pages"] += 1
+            stats["image_tokens_saved"] += max(0, full_tokens - sent_tokens)
+        yield parts
+
 
-    return results
+async def aiter_pdf_page_parts(
+    file_bytes: bytes, texts: list[str], pages: list[int] | None = None, stats: dict[str, int] | None = None
+) -> AsyncIterator[list[tuple[str, str]]]:
+    """Async version of iter_pdf_page_parts: each page is prepared in a worker thread as it is consumed."""
+    timings: dict[str, float] = {}
+    prepared = iter_pdf_page_parts(file_bytes, texts, timings, pages, stats)
+    done = object()
+    while True:
+        parts = await asyncio.to_thread(next, prepared, done)
+        if parts is done:
+            _merge_timings(timings)
+            return
+        yield parts
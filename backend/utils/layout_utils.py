@@ -0,0 +1,220 @@
+import base64
+import io
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from utils.image_utils import pdf_render_dpi
+
+# Pages are analysed as grayscale thumbnails whose longest side is this many pixels
+THUMBNAIL_SIZE = 600
+# Pixels darker than this fraction of the page's median brightness count as ink
+INK_THRESHOLD = 0.6
+# A row or column with at least this fraction of ink pixels counts as content
+PROFILE_THRESHOLD = 0.01
+# Statement tables are cut from pages rendered at up to this many pixels on the longest side
+TILE_RENDER_SIZE = 2400
+# A row inked across at least this fraction of the content width is a table rule
+RULE_THRESHOLD = 0.5
+# Content more than this fraction of the page below the top is table, not header
+HEADER_MAX_HEIGHT = 0.25
+# Blank border (rendered pixels) kept around cropped content
+CROP_PADDING = 8
+
+
+@dataclass
+class PageLayout:
+    """
+    Cheap layout features of one page. Margins and content extents are fractions of the page size;
+    text_rows is the number of separate bands of inked rows (roughly, lines of text).
+    """
+    width: int
+    height: int
+    ink: float
+    text_rows: int
+    content_width: float
+    content_height: float
+    top_margin: float
+    bottom_margin: float
+
+    @property
+    def aspect(self) -> float:
+        return self.height / self.width if self.width else 0.0
+
+
+def _ink_profiles(gray: Image.Image) -> tuple[float, list[float], list[float]]:
+    """Ink density of a grayscale image and the ink fraction of each row and each column."""
+    w, h = gray.size
+    histogram = gray.histogram()
+    total = w * h
+    # Median brightness stands in for the paper colour, so photos of off-white paper still work
+    running, median = 0, 255
+    for value, count in enumerate(histogram):
+        running += count
+        if running >= total / 2:
+            median = value
+            break
+    threshold = int(median * INK_THRESHOLD)
+    ink_mask = gray.point(lambda v: 255 if v < threshold else 0)
+    ink = sum(histogram[:threshold]) / total if total else 0.0
+
+    # Averaging the mask down to one column (or row) gives the ink fraction per row (or column)
+    rows = [v / 255 for v in ink_mask.resize((1, h), Image.BOX).getdata()]
+    columns = [v / 255 for v in ink_mask.resize((w, 1), Image.BOX).getdata()]
+    return ink, rows, columns
+
+
+def analyze_page(image: Image.Image) -> PageLayout:
+    """Measure ink density and the row/column ink profiles of a page image."""
+    gray = ImageOps.grayscale(image)
+    gray.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    w, h = gray.size
+
+    ink, rows, columns = _ink_profiles(gray)
+    inked_rows = [i for i, v in enumerate(rows) if v >= PROFILE_THRESHOLD]
+    inked_columns = [i for i, v in enumerate(columns) if v >= PROFILE_THRESHOLD]
+
+    text_rows = 0
+    previous = -2
+    for i in inked_rows:
+        if i != previous + 1:
+            text_rows += 1
+        previous = i
+
+    if not inked_rows or not inked_columns:
+        return PageLayout(w, h, ink, 0, 0.0, 0.0, 1.0, 1.0)
+    return PageLayout(
+        width=w,
+        height=h,
+        ink=ink,
+        text_rows=text_rows,
+        content_width=(inked_columns[-1] - inked_columns[0] + 1) / w,
+        content_height=(inked_rows[-1] - inked_rows[0] + 1) / h,
+        top_margin=inked_rows[0] / h,
+        bottom_margin=(h - 1 - inked_rows[-1]) / h,
+    )
+
+
+def analyze_pdf(file_bytes: bytes) -> list[PageLayout]:
+    """Layout of every page of a PDF, rendered one at a time as small grayscale thumbnails."""
+    from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+    info = pdfinfo_from_bytes(file_bytes)
+    dpi = pdf_render_dpi(info.get("Page size"), max_size=THUMBNAIL_SIZE)
+    layouts = []
+    for page in range(1, int(info["Pages"]) + 1):
+        (image,) = convert_from_bytes(file_bytes, dpi=dpi, first_page=page, last_page=page, grayscale=True)
+        layouts.append(analyze_page(image))
+        image.close()
+    return layouts
+
+
+@dataclass
+class TableBand:
+    """
+    One horizontal slice of a statement table as a (base64_data, media_type) image. header is the
+    part of the statement above the table (title, period) or None; overlap_rows is the number of text
+    rows the band shares with the previous band of the same page.
+    """
+    page: int
+    image: tuple[str, str]
+    header: tuple[str, str] | None
+    overlap_rows: int
+
+
+def _runs(flags: list[bool]) -> list[tuple[int, int]]:
+    """(start, end) ranges of consecutive True values, end exclusive."""
+    runs, start = [], None
+    for i, flag in enumerate([*flags, False]):
+        if flag and start is None:
+            start = i
+        elif not flag and start is not None:
+            runs.append((start, i))
+            start = None
+    return runs
+
+
+def _cut_point(rows: list[float], low: int, target: int) -> int:
+    """The emptiest row in [low, target], nearest target on ties, so cuts fall between lines of text."""
+    return min(range(low, target + 1), key=lambda y: (rows[y], target - y))
+
+
+def _encode_crop(image: Image.Image, box: tuple[int, int, int, int], scale: float) -> tuple[str, str]:
+    crop = image.crop(box)
+    if scale < 1:
+        crop = crop.resize((max(1, round(crop.width * scale)), max(1, round(crop.height * scale))), Image.LANCZOS)
+    buffer = io.BytesIO()
+    crop.save(buffer, format="JPEG", quality=85)
+    return base64.b64encode(buffer.getvalue()).decode(), "image/jpeg"
+
+
+def tile_table_page(
+    image: Image.Image, page: int, tile_width: int, band_height: int, overlap: int
+) -> tuple[tuple[str, str] | None, list[TableBand]]:
+    """
+    Crop a statement page to its content and cut the table into bands of about band_height pixels
+    (after scaling the content to tile_width), each starting overlap pixels above the end of the previous one.
+    Cuts are moved to the emptiest nearby row so they fall between table rows.
+    Returns the header image (content above the first table rule, if any) and the bands.
+    """
+    gray = ImageOps.grayscale(image)
+    w, h = gray.size
+    _, rows, columns = _ink_profiles(gray)
+    inked_rows = [i for i, v in enumerate(rows) if v >= PROFILE_THRESHOLD]
+    inked_columns = [i for i, v in enumerate(columns) if v >= PROFILE_THRESHOLD]
+    if not inked_rows or not inked_columns:
+        return None, []
+
+    left, right = max(0, inked_columns[0] - CROP_PADDING), min(w, inked_columns[-1] + 1 + CROP_PADDING)
+    top, bottom = max(0, inked_rows[0] - CROP_PADDING), min(h, inked_rows[-1] + 1 + CROP_PADDING)
+    scale = min(1.0, tile_width / (right - left))
+
+    # Rows inked across most of the content are table rules; the title and period sit above the first one
+    is_rule = [v * w >= RULE_THRESHOLD * (right - left) for v in rows]
+    rules = _runs(is_rule)
+    header = None
+    body_top = top
+    if rules and top < rules[0][0] - CROP_PADDING and rules[0][0] <= top + HEADER_MAX_HEIGHT * h:
+        header = _encode_crop(gray, (left, top, right, rules[0][0]), scale)
+        body_top = rules[0][0]
+
+    band = max(1, int(band_height / scale))
+    step_back = min(int(overlap / scale), band // 2)
+    is_text = [v >= PROFILE_THRESHOLD and not rule for v, rule in zip(rows, is_rule)]
+    bands: list[TableBand] = []
+    start, previous_end = body_top, None
+    while True:
+        end = start + band
+        if end >= bottom - band // 3:
+            # Fold a short remainder into this band rather than sending a sliver
+            end = bottom
+        else:
+            end = _cut_point(rows, end - band // 4, end)
+        overlap_rows = len(_runs(is_text[start:previous_end])) if previous_end is not None else 0
+        bands.append(TableBand(page, _encode_crop(gray, (left, start, right, end), scale), header, overlap_rows))
+        if end >= bottom:
+            return header, bands
+        previous_end = end
+        start = _cut_point(rows, max(start + 1, end - step_back - step_back // 2), max(start + 1, end - step_back))
+
+
+def tile_pdf_tables(
+    file_bytes: bytes, pages: list[int] | None, tile_width: int, band_height: int, overlap: int
+) -> list[TableBand]:
+    """
+    Table bands of every page (or the given 1-based pages) of a statement PDF, in reading order.
+    Pages without a header of their own carry the header of an earlier page, so every band has the period.
+    """
+    from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+    info = pdfinfo_from_bytes(file_bytes)
+    dpi = pdf_render_dpi(info.get("Page size"), max_size=TILE_RENDER_SIZE)
+    bands: list[TableBand] = []
+    header = None
+    for page in pages or range(1, int(info["Pages"]) + 1):
+        (image,) = convert_from_bytes(file_bytes, dpi=dpi, first_page=page, last_page=page, grayscale=True)
+        page_header, page_bands = tile_table_page(image, page, tile_width, band_height, overlap)
+        image.close()
+        header = page_header or header
+        bands += [TableBand(b.page, b.image, b.header or header, b.overlap_rows) for b in page_bands]
+    return bands
@@ -0,0 +1,15 @@
+import sqlite3
+from pathlib import Path
+
+from config import settings
+
+
+def connect(db_name: str) -> sqlite3.Connection:
+    """Open a SQLite database under settings.data_dir, shared across threads."""
+    data_dir = Path(settings.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(data_dir / db_name, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -14,7 +14,7 @@ import type { DropboxFile } from "./types";
 
 function App() {
   const { auth, login, logout } = useAuth();
-  const { results, processing, processFiles, updateResult, cancelProcessing } =
+  const { results, jobId, processing, processFiles, updateResult, cancelProcessing } =
     useReceiptProcessing();
 
   const [files, setFiles] = useState<DropboxFile[]>([]);
@@ -135,7 +135,7 @@ function App() {
                 <ResultsTable results={results} onUpdate={updateResult} />
                 <CategorySummary results={results} />
                 <div className="flex justify-end">
-                  <ExportButton results={results} />
+                  <ExportButton results={results} jobId={jobId} />
                 </div>
               </section>
             )}
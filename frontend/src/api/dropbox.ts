@@ -12,13 +12,13 @@ export async function listFiles(
   return data;
 }
 
-export async function downloadFile(
-  accessToken: string,
-  filePath: string,
-): Promise<{ file_name: string; data_base64: string; media_type: string }> {
-  const { data } = await apiClient.post("/dropbox/download", {
-    access_token: accessToken,
-    file_path: filePath,
+// ファイル本体を取得する（プレビュー用）。トークンは URL に載せず Authorization ヘッダーで送る。
+// サーバーは ETag と Range に対応しており、ブラウザのキャッシュが再検証で使われる
+export async function downloadFile(accessToken: string, filePath: string): Promise<Blob> {
+  const { data } = await apiClient.get<Blob>("/dropbox/file", {
+    params: { path: filePath },
+    headers: { Authorization: `Bearer ${accessToken}` },
+    responseType: "blob",
   });
   return data;
 }
@@ -1,5 +1,17 @@
 import type { ReceiptResult } from "../types";
 
+export type ExportFormat = "csv" | "xlsx" | "jsonl" | "parquet";
+
+// ジョブの結果はサーバー側に保存されているため、ブラウザが直接ストリーミングでダウンロードする
+export function downloadJobExport(jobId: string, format: ExportFormat): void {
+  const a = document.createElement("a");
+  a.href = `/api/export/jobs/${encodeURIComponent(jobId)}?format=${format}`;
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+
+// ジョブIDがない場合（ジョブ開始前に失敗した場合など）は、画面上の結果を送って CSV を作る
 export async function downloadCsv(results: ReceiptResult[]): Promise<void> {
   const response = await fetch("/api/export/csv", {
     method: "POST",
@@ -7,8 +7,17 @@ export function startBatchProcess(
   onResult: (data: import("../types").ReceiptResult) => void,
   onError: (data: { file_name: string; error: string }) => void,
   onDone: () => void,
+  onJob?: (jobId: string) => void,
 ): AbortController {
   const controller = new AbortController();
+  let jobId: string | null = null;
+
+  // ジョブはサーバー側で継続するため、キャンセル時は明示的に停止する
+  controller.signal.addEventListener("abort", () => {
+    if (jobId) {
+      fetch(`${API_BASE}/jobs/${jobId}/cancel`, { method: "POST" }).catch(() => {});
+    }
+  });
 
   fetch(`${API_BASE}/ocr/process-batch`, {
     method: "POST",
@@ -44,6 +53,10 @@ export function startBatchProcess(
           try {
             const data = JSON.parse(line.slice(6));
             switch (eventType) {
+              case "job":
+                jobId = data.job_id;
+                onJob?.(data.job_id);
+                break;
               case "progress":
                 onProgress(data);
                 break;
@@ -0,0 +1,16 @@
+import axios from "axios";
+import apiClient from "./client";
+import type { ReceiptResult } from "../types";
+
+export async function saveResultEdit(
+  result: ReceiptResult,
+  updates: Partial<ReceiptResult>,
+): Promise<void> {
+  try {
+    await apiClient.patch(`/results/${result.id}`, updates);
+  } catch (e) {
+    if (!axios.isAxiosError(e) || e.response?.status !== 404) throw e;
+    // 結果ストアにない結果は、修正内容を学習にだけ送る
+    await apiClient.post("/categories/feedback", { results: [result] });
+  }
+}
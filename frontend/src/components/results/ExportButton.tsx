@@ -1,20 +1,33 @@
 import { useState } from "react";
-import { downloadCsv } from "../../api/export";
+import { downloadCsv, downloadJobExport, type ExportFormat } from "../../api/export";
 import type { ReceiptResult } from "../../types";
 
 interface Props {
   results: ReceiptResult[];
+  jobId: string | null;
 }
 
-export function ExportButton({ results }: Props) {
+const FORMAT_LABELS: Record<ExportFormat, string> = {
+  csv: "CSV",
+  xlsx: "Excel",
+  jsonl: "JSON Lines",
+  parquet: "Parquet",
+};
+
+export function ExportButton({ results, jobId }: Props) {
   const [isExporting, setIsExporting] = useState(false);
+  const [format, setFormat] = useState<ExportFormat>("csv");
 
   const handleExport = async () => {
     setIsExporting(true);
     try {
-      await downloadCsv(results);
+      if (jobId) {
+        downloadJobExport(jobId, format);
+      } else {
+        await downloadCsv(results);
+      }
     } catch (e) {
-      alert("CSVエクスポートに失敗しました");
+      alert("エクスポートに失敗しました");
     } finally {
       setIsExporting(false);
     }
@@ -24,12 +37,27 @@ export function ExportButton({ results }: Props) {
   if (validResults.length === 0) return null;
 
   return (
-    <button
-      onClick={handleExport}
-      disabled={isExporting}
-      className="px-6 py-2 bg-green-600 text-white rounded hover:bg-green-700 disabled:opacity-50 transition text-sm font-medium"
-    >
-      {isExporting ? "エクスポート中..." : "CSVダウンロード"}
-    </button>
+    <div className="flex items-center gap-2">
+      {jobId && (
+        <select
+          value={format}
+          onChange={(e) => setFormat(e.target.value as ExportFormat)}
+          className="border border-gray-300 rounded px-2 py-2 text-sm"
+        >
+          {(Object.keys(FORMAT_LABELS) as ExportFormat[]).map((f) => (
+            <option key={f} value={f}>
+              {FORMAT_LABELS[f]}
+            </option>
+          ))}
+        </select>
+      )}
+      <button
+        onClick={handleExport}
+        disabled={isExporting}
+        className="px-6 py-2 bg-green-600 text-white rounded hover:bg-green-700 disabled:opacity-50 transition text-sm font-medium"
+      >
+        {isExporting ? "エクスポート中..." : `${jobId ? FORMAT_LABELS[format] : "CSV"}ダウンロード`}
+      </button>
+    </div>
   );
 }
@@ -1,9 +1,11 @@
 import { useState, useCallback, useRef } from "react";
 import { startBatchProcess } from "../api/ocr";
+import { saveResultEdit } from "../api/results";
 import type { ReceiptResult, ProcessingState } from "../types";
 
 export function useReceiptProcessing() {
   const [results, setResults] = useState<ReceiptResult[]>([]);
+  const [jobId, setJobId] = useState<string | null>(null);
   const [processing, setProcessing] = useState<ProcessingState>({
     isProcessing: false,
     completed: 0,
@@ -15,6 +17,7 @@ export function useReceiptProcessing() {
   const processFiles = useCallback(
     (accessToken: string, filePaths: string[]) => {
       setResults([]);
+      setJobId(null);
       setProcessing({
         isProcessing: true,
         completed: 0,
@@ -71,23 +74,28 @@ export function useReceiptProcessing() {
             currentFile: null,
           }));
         },
+        setJobId,
       );
     },
     [],
   );
 
-  const updateResult = useCallback((id: string, updates: Partial<ReceiptResult>) => {
-    setResults((prev) =>
-      prev.map((r) =>
-        r.id === id ? { ...r, ...updates, is_manually_edited: true } : r,
-      ),
-    );
-  }, []);
+  const updateResult = useCallback(
+    (id: string, updates: Partial<ReceiptResult>) => {
+      const current = results.find((r) => r.id === id);
+      if (!current) return;
+      const edited = { ...current, ...updates, is_manually_edited: true };
+      setResults((prev) => prev.map((r) => (r.id === id ? { ...r, ...updates, is_manually_edited: true } : r)));
+      // 修正内容はサーバーに保存し、勘定科目の学習にも使う
+      saveResultEdit(edited, updates).catch(() => {});
+    },
+    [results],
+  );
 
   const cancelProcessing = useCallback(() => {
     controllerRef.current?.abort();
     setProcessing((prev) => ({ ...prev, isProcessing: false, currentFile: null }));
   }, []);
 
-  return { results, processing, processFiles, updateResult, cancelProcessing };
+  return { results, jobId, processing, processFiles, updateResult, cancelProcessing };
 }
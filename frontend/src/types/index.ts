@@ -28,9 +28,11 @@ export interface ReceiptResult {
   description: string | null;
   category: AccountingCategory | null;
   category_reason: string | null;
+  category_source?: "model" | "local" | "default" | null;
   confidence: number | null;
   error: string | null;
   is_manually_edited: boolean;
+  duplicate_of?: string | null;
 }
 
 export interface CategoryTotal {